@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fast annotation pre-scan
+
+Finds the pages that carry annotations by reading each page's /Annots
+entry through the xref table, without building page objects. The
+annotation extractors then only load the pages that actually need it.
+"""
+
+
+def annotation_subtypes(doc, page_num):
+    """Subtype names (e.g. 'Highlight') of the annotations on one page"""
+    subtypes = []
+    for xref, _, _ in doc.page_annot_xrefs(page_num):
+        kind, value = doc.xref_get_key(xref, "Subtype")
+        if kind == 'name':
+            subtypes.append(value.lstrip('/'))
+    return subtypes
+
+
+def has_annotations(doc, page_num, subtypes=None):
+    """Check if a page carries annotations of the given subtypes (default any)"""
+    found = annotation_subtypes(doc, page_num)
+    if subtypes is None:
+        return bool(found)
+    return any(subtype in subtypes for subtype in found)
+
+
+def annotated_pages(doc, subtypes=None):
+    """
+    Pages carrying annotations of the given subtypes
+    
+    Args:
+        doc: Open fitz document
+        subtypes (iterable): Annotation subtype names to look for
+            (optional, default any annotation)
+    
+    Returns:
+        list: Zero-based page numbers in ascending order
+    """
+    if subtypes is not None:
+        subtypes = set(subtypes)
+    return [page_num for page_num in range(len(doc))
+            if has_annotations(doc, page_num, subtypes)]
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+asyncio API for the highlight extractors
+
+aextract() yields the records of a PDF without blocking the event loop:
+the pages are extracted in chunks on a process pool and the records of
+each chunk are yielded, in page order, as soon as it completes:
+    
+    from async_highlights import aextract
+    
+    async for record in aextract("book.pdf"):
+        print(record['page'], record['text'])
+
+Cancelling the consuming task (or closing the generator) cancels the
+chunks that have not started yet. At most MAX_DOCUMENTS documents are
+extracted at a time; further calls wait for their turn, so hundreds of
+concurrent uploads do not flood the pool. Use an AsyncExtractor for a pool
+of its own size:
+    
+    async with AsyncExtractor(workers=4, max_documents=8) as extractor:
+        async for record in extractor.aextract("book.pdf", method='simple'):
+            ...
+"""
+
+import asyncio
+import collections
+import os
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from batch_extractor import extract_shard, init_worker, plan_shards
+from dedup import Deduplicator
+from logs import get_logger
+
+log = get_logger('async')
+
+
+# Documents extracted at the same time by one AsyncExtractor
+MAX_DOCUMENTS = 16
+
+# Pages per chunk handed to a worker; records are yielded chunk by chunk
+DEFAULT_CHUNK_PAGES = 8
+
+
+class AsyncExtractor:
+    """
+    Process pool and document limit shared by aextract() calls
+    
+    Args:
+        workers (int): Worker processes (default: number of cores)
+        max_documents (int): Documents extracted at the same time; further
+            calls wait
+        chunk_pages (int): Pages per chunk handed to a worker
+    """
+    
+    def __init__(self, workers=None, max_documents=MAX_DOCUMENTS, chunk_pages=DEFAULT_CHUNK_PAGES):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_documents = max_documents
+        self.chunk_pages = chunk_pages
+        self.executor = self._new_executor()
+        
+        # asyncio primitives belong to one event loop
+        self._semaphores = weakref.WeakKeyDictionary()
+    
+    def _new_executor(self):
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                   initargs=('quiet',))
+    
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_documents)
+        return semaphore
+    
+    async def aextract(self, pdf_path, method='enhanced'):
+        """
+        Yield the highlight records of a PDF as its pages are extracted
+        
+        Args:
+            pdf_path (str): PDF file path
+            method (str): 'enhanced' (all detectors, duplicates removed) or 'simple'
+        
+        Yields:
+            dict: Records in page order, as from iter_highlights()
+        """
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            executor = self.executor
+            dedup = None if method == 'simple' else Deduplicator()
+            
+            # Keep one chunk per worker in flight, so a slow consumer does not
+            # make finished chunks pile up in memory
+            pending = collections.deque()
+            try:
+                chunks = iter(await loop.run_in_executor(executor, plan_shards, pdf_path,
+                                                         self.chunk_pages))
+                for start, stop in chunks:
+                    pending.append(loop.run_in_executor(executor, extract_shard, pdf_path,
+                                                        start, stop, method))
+                    if len(pending) >= self.workers:
+                        break
+                
+                while pending:
+                    records = await pending.popleft()
+                    for start, stop in chunks:
+                        pending.append(loop.run_in_executor(executor, extract_shard, pdf_path,
+                                                            start, stop, method))
+                        break
+                    
+                    for record in (dedup.add(records) if dedup else records):
+                        yield record
+            
+            except BrokenProcessPool:
+                # A worker died (e.g. MuPDF crashed on a corrupt file); later
+                # documents get a fresh pool
+                self._replace_executor(executor)
+                raise
+            
+            finally:
+                for future in pending:
+                    future.cancel()
+    
+    def _replace_executor(self, broken):
+        if self.executor is broken:
+            log.warning("Worker pool broke while extracting, starting a new one")
+            self.executor = self._new_executor()
+            broken.shutdown(wait=False)
+    
+    def close(self, wait=True):
+        """Shut the process pool down"""
+        self.executor.shutdown(wait=wait, cancel_futures=True)
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+
+# Extractor of the module-level aextract(), created on first use
+_default = None
+
+
+def aextract(pdf_path, method='enhanced'):
+    """
+    Yield the highlight records of a PDF without blocking the event loop
+    
+    Uses a shared AsyncExtractor with one worker per core; see
+    AsyncExtractor.aextract for the arguments.
+    """
+    global _default
+    if _default is None:
+        _default = AsyncExtractor()
+    return _default.aextract(pdf_path, method)
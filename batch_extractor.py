@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Batch PDF Highlight Extractor
+Extracts highlights from whole directories of PDF files on all CPU cores
+"""
+
+import argparse
+import collections
+import glob
+import os
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import enhanced_extractor
+import profiling
+import simple_extractor
+from lazy_modules import lazy_import
+from logs import PROGRESS, configure, get_logger
+from result_cache import ResultCache
+from writers import WRITERS
+
+fitz = lazy_import('fitz')  # PyMuPDF
+
+log = get_logger('batch')
+
+
+# Files with more pages than this are split into page-range shards
+DEFAULT_SHARD_PAGES = 200
+
+
+def find_pdfs(inputs):
+    """
+    Expand directories, glob patterns and file paths into a sorted list of PDFs
+    
+    Args:
+        inputs (list): Directories, glob patterns or PDF file paths
+    
+    Returns:
+        list: Absolute paths of the PDF files found
+    """
+    found = set()
+    
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                for name in files:
+                    if name.lower().endswith('.pdf'):
+                        found.add(os.path.abspath(os.path.join(root, name)))
+        elif os.path.isfile(item):
+            found.add(os.path.abspath(item))
+        else:
+            for path in glob.glob(item, recursive=True):
+                if os.path.isfile(path) and path.lower().endswith('.pdf'):
+                    found.add(os.path.abspath(path))
+    
+    return sorted(found)
+
+
+def shard_ranges(page_count, shard_pages=DEFAULT_SHARD_PAGES):
+    """Split page_count pages into (start, stop) page ranges of at most shard_pages pages"""
+    if shard_pages <= 0 or page_count <= shard_pages:
+        return [(0, page_count)]
+    
+    return [(start, min(start + shard_pages, page_count))
+            for start in range(0, page_count, shard_pages)]
+
+
+def plan_shards(pdf_path, shard_pages=DEFAULT_SHARD_PAGES):
+    """Split a PDF into (start, stop) page ranges of at most shard_pages pages"""
+    with fitz.open(pdf_path) as doc:
+        return shard_ranges(len(doc), shard_pages)
+
+
+def extract_pages(doc, start, stop, method='enhanced', detectors=None):
+    """
+    Extract highlights from pages [start, stop) of an open document
+    
+    Args:
+        detectors (list): Names of the enhanced detectors to run (default: all)
+    
+    Returns:
+        list: Extracted records in page order, before duplicate removal
+    """
+    records = []
+    
+    if method == 'simple':
+        for page_num in range(start, stop):
+            records.extend(simple_extractor.extract_page_highlights(doc[page_num], page_num))
+    else:
+        if detectors is not None:
+            detectors = [(name, detector) for name, detector in enhanced_extractor.DETECTORS
+                         if name in detectors]
+        enhanced_extractor.run_detectors(doc, records, detectors, range(start, stop))
+    
+    return records
+
+
+def extract_shard(pdf_path, start, stop, method='enhanced', detectors=None):
+    """
+    Extract highlights from pages [start, stop) of a PDF (runs in a worker process)
+    
+    Args:
+        detectors (list): Names of the enhanced detectors to run (default: all)
+    
+    Returns:
+        list: Extracted records in page order, before duplicate removal
+    """
+    with fitz.open(pdf_path) as doc:
+        return extract_pages(doc, start, stop, method, detectors)
+
+
+def extract_first_shard(pdf_path, shard_pages, method='enhanced', auto=False, options=None):
+    """
+    Look a PDF up in the cache, or plan its shards and extract the first one
+    (runs in a worker process)
+    
+    The parent neither hashes nor opens the documents itself, so a batch
+    starts working right away, the hashing of large files runs in parallel
+    and a file that crashes MuPDF only takes a worker down. With auto, the
+    enhanced detectors are chosen here for the whole document, as
+    extract_all_highlights does, and the other shards run the same ones.
+    
+    Args:
+        options (dict): Cache options of the run (see extract_batch)
+    
+    Returns:
+        tuple: (digest of the file, None without a cache; list of (start,
+            stop) shards; names of the detectors to run or None for all;
+            records of the first shard). For a cached file the list of
+            shards is empty and the records are its final results.
+    """
+    digest = None
+    if _cache:
+        digest = _cache.digest(pdf_path)
+        cached = _cache.lookup(digest, method, options)
+        if cached is not None:
+            return digest, [], None, cached
+    
+    with fitz.open(pdf_path) as doc:
+        shards = shard_ranges(len(doc), shard_pages)
+        detectors = None
+        if auto and method != 'simple':
+            detectors = [name for name, _ in enhanced_extractor.choose_detectors(doc)]
+        start, stop = shards[0]
+        return digest, shards, detectors, extract_pages(doc, start, stop, method, detectors)
+
+
+def profile_task(function, *args):
+    """
+    Run a worker function with profiling (runs in a worker process)
+    
+    Returns:
+        tuple: (result, profiler data to merge into the run's profile)
+    """
+    profiler = profiling.start(args[0])
+    try:
+        result = function(*args)
+    finally:
+        profiling.stop()
+    return result, profiler.data()
+
+
+# Result cache of a worker process (see init_worker)
+_cache = None
+
+
+def init_worker(worker_log, cache_dir=None):
+    """Set up logging (messages go to stderr) and, with a cache_dir, the result cache of a worker process"""
+    global _cache
+    configure(worker_log, sys.stderr)
+    if cache_dir:
+        _cache = ResultCache(cache_dir)
+
+
+def output_path_for(pdf_path, output_dir, used_names, extension='txt'):
+    """Output file name for a PDF, unique within this run"""
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+    name = f"{stem}_highlights.{extension}"
+    counter = 2
+    while name in used_names:
+        name = f"{stem}_highlights_{counter}.{extension}"
+        counter += 1
+    used_names.add(name)
+    return os.path.join(output_dir, name)
+
+
+def new_pool(workers, worker_log='quiet', cache_dir=None):
+    """Process pool whose workers log in worker_log mode (see logs.MODES) and use the cache in cache_dir"""
+    return ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                               initargs=(worker_log, cache_dir))
+
+
+def submit(pool, task, profiler=None):
+    function, args = task
+    if profiler:
+        return pool.submit(profile_task, function, *args)
+    return pool.submit(function, *args)
+
+
+def task_outcome(future, profiler=None):
+    """(result, error) of a finished task; raises BrokenProcessPool if its worker died"""
+    try:
+        result = future.result()
+    except BrokenProcessPool:
+        raise
+    except Exception as e:
+        return None, str(e) or type(e).__name__
+    
+    if profiler:
+        result, data = result
+        profiler.merge(data)
+    return result, None
+
+
+def run_shards(tasks, workers, worker_log='quiet', profiler=None, cache_dir=None):
+    """
+    Run tasks on a process pool and yield their outcomes as they complete
+    
+    At most one task per worker is handed to the pool at a time. When a worker
+    dies (e.g. MuPDF crashed on a corrupt file) it takes the pool with it:
+    the tasks that were running are then retried in a process each, so only
+    the culprit fails, and the others continue on a new pool.
+    
+    Args:
+        tasks (deque): (function, args) pairs, e.g. (extract_shard, (path,
+            start, stop, method)); more may be appended while iterating
+        worker_log (str): Logging mode of the worker processes (see logs.MODES)
+        profiler (Profiler): Receives the timings of every task (optional)
+        cache_dir (str): Result cache directory of the workers (optional)
+    
+    Yields:
+        tuple: (task, result, error), result is None when the task failed
+    """
+    # Per-page and per-hit output from the extractors is not useful in workers
+    pool = new_pool(workers, worker_log, cache_dir)
+    running = {}
+    
+    try:
+        while tasks or running:
+            while tasks and len(running) < workers:
+                task = tasks.popleft()
+                running[submit(pool, task, profiler)] = task
+            
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            crashed = []
+            for future in done:
+                task = running.pop(future)
+                try:
+                    result, error = task_outcome(future, profiler)
+                except BrokenProcessPool:
+                    crashed.append(task)
+                    continue
+                yield task, result, error
+            
+            if not crashed:
+                continue
+            
+            # The other running tasks fail with the pool; those that finished
+            # just before still have their results
+            for future in as_completed(list(running)):
+                task = running.pop(future)
+                try:
+                    result, error = task_outcome(future, profiler)
+                except BrokenProcessPool:
+                    crashed.append(task)
+                    continue
+                yield task, result, error
+            
+            pool.shutdown(wait=False)
+            log.warning("A worker process died, retrying the %d running task(s) one per process", len(crashed))
+            yield from run_isolated(crashed, worker_log, profiler, cache_dir)
+            pool = new_pool(workers, worker_log, cache_dir)
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def run_isolated(tasks, worker_log='quiet', profiler=None, cache_dir=None):
+    """Run tasks in a single-worker pool each, so a crash only fails its own task"""
+    pools = [new_pool(1, worker_log, cache_dir) for _ in tasks]
+    try:
+        futures = [submit(pool, task, profiler) for pool, task in zip(pools, tasks)]
+        for task, future in zip(tasks, futures):
+            try:
+                result, error = task_outcome(future, profiler)
+            except BrokenProcessPool as e:
+                result, error = None, str(e)
+            yield task, result, error
+    finally:
+        for pool in pools:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def extract_batch(inputs, output_dir, method='enhanced', workers=None,
+                  shard_pages=DEFAULT_SHARD_PAGES, cache=None, output_format='txt', worker_log='quiet',
+                  profiler=None, auto=False):
+    """
+    Extract highlights from many PDFs in parallel
+    
+    Args:
+        inputs (list): Directories, glob patterns or PDF file paths
+        output_dir (str): Directory for the per-file result files
+        method (str): 'enhanced' or 'simple'
+        workers (int): Number of worker processes (default: number of cores)
+        shard_pages (int): Maximum pages per shard of a large PDF
+        cache (ResultCache): Result cache; unchanged files are not re-extracted (optional)
+        output_format (str): 'txt', 'jsonl', 'csv' or 'docx' result files
+        worker_log (str): Logging mode of the worker processes (see logs.MODES)
+        profiler (Profiler): Collects stage, detector and page timings from
+            the workers, e.g. to find the slowest files (optional)
+        auto (bool): Only run the enhanced detectors that are productive on a
+            sample of each file's pages
+    
+    Returns:
+        dict: {pdf_path: number of records saved}, failed files are mapped to None
+    """
+    pdf_paths = find_pdfs(inputs)
+    if not pdf_paths:
+        log.warning("No PDF files found.")
+        return {}
+    
+    workers = workers or os.cpu_count() or 1
+    log.log(PROGRESS, "📂 Found %d PDF file(s), using %d worker process(es)", len(pdf_paths), workers)
+    
+    # Auto mode results are cached separately from full runs
+    options = {'auto': True} if auto and method != 'simple' else None
+    
+    # Result files are named in path order, whichever file finishes first
+    os.makedirs(output_dir, exist_ok=True)
+    used_names = set()
+    output_paths = {pdf_path: output_path_for(pdf_path, output_dir, used_names, output_format)
+                    for pdf_path in pdf_paths}
+    counts = {}
+    
+    def fail(pdf_path, error):
+        counts[pdf_path] = None
+        log.error("  ✗ %s: %s", os.path.basename(pdf_path), error)
+    
+    def save(pdf_path, records, digest):
+        with profiling.stage('write'):
+            if method == 'simple':
+                simple_extractor.save_to_file(records, pdf_path, output_paths[pdf_path], output_format, digest)
+            else:
+                enhanced_extractor.save_results(records, pdf_path, output_paths[pdf_path], output_format,
+                                                digest)
+        counts[pdf_path] = len(records)
+        log.log(PROGRESS, "  ✓ %s: %d highlighted text(s)", os.path.basename(pdf_path), len(records))
+    
+    # Every file starts with a task that looks it up in the cache (hashing it
+    # in the worker) or plans its shards
+    tasks = collections.deque((extract_first_shard, (pdf_path, shard_pages, method, auto, options))
+                              for pdf_path in pdf_paths)
+    
+    # Digests and shard results of each file until its last shard is in
+    digests = {}
+    parts = {}
+    remaining = {}
+    cached = 0
+    
+    for (function, args), result, error in run_shards(tasks, workers, worker_log, profiler,
+                                                       cache.cache_dir if cache else None):
+        pdf_path = args[0]
+        if pdf_path in counts:
+            # Another shard of this file already failed
+            continue
+        
+        if error is not None:
+            fail(pdf_path, error)
+            digests.pop(pdf_path, None)
+            parts.pop(pdf_path, None)
+            remaining.pop(pdf_path, None)
+            for task in [task for task in tasks if task[1][0] == pdf_path]:
+                tasks.remove(task)
+            continue
+        
+        if function is extract_first_shard:
+            digest, shards, detectors, result = result
+            if not shards:
+                # Unchanged since it was cached
+                cached += 1
+                save(pdf_path, result, digest)
+                continue
+            
+            start = shards[0][0]
+            digests[pdf_path] = digest
+            parts[pdf_path] = {}
+            remaining[pdf_path] = len(shards)
+            tasks.extend((extract_shard, (pdf_path, shard_start, shard_stop, method, detectors))
+                         for shard_start, shard_stop in shards[1:])
+        else:
+            start = args[1]
+        
+        parts[pdf_path][start] = result
+        remaining[pdf_path] -= 1
+        if remaining[pdf_path]:
+            continue
+        
+        # Merge the shards back in page order and save the file right away
+        del remaining[pdf_path]
+        digest = digests.pop(pdf_path)
+        shard_results = parts.pop(pdf_path)
+        records = [record for start in sorted(shard_results) for record in shard_results[start]]
+        if method != 'simple':
+            with profiling.stage('dedup'):
+                records = enhanced_extractor.remove_duplicates(records)
+        if cache:
+            with profiling.stage('cache'):
+                cache.store(digest, method, records, options)
+        save(pdf_path, records, digest)
+    
+    if cached:
+        log.log(PROGRESS, "♻️  %d file(s) unchanged, loaded from cache", cached)
+    
+    failed = sum(count is None for count in counts.values())
+    log.log(PROGRESS, "\n📈 Processed %d file(s), %d failed", len(pdf_paths) - failed, failed)
+    return counts
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(
+        description="Extract highlights from many PDF files in parallel")
+    parser.add_argument('inputs', nargs='+',
+                        help="PDF files, directories or glob patterns (e.g. 'courses/**/*.pdf')")
+    parser.add_argument('-o', '--output-dir', default='highlights',
+                        help="Directory for the result files (default: highlights)")
+    parser.add_argument('-f', '--format', default='txt', choices=sorted(WRITERS),
+                        help="Format of the result files (default: txt)")
+    parser.add_argument('--simple', action='store_true',
+                        help="Use the simple extractor instead of the enhanced one")
+    parser.add_argument('--auto', action='store_true',
+                        help="Try every method on a sample of pages and only run the productive ones")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Number of worker processes (default: number of cores)")
+    parser.add_argument('--shard-pages', type=int, default=DEFAULT_SHARD_PAGES,
+                        help=f"Split PDFs larger than this many pages across workers (default: {DEFAULT_SHARD_PAGES})")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Re-extract every file instead of reusing cached results")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Result cache directory (default: ~/.cache/pdf_highlight_extractor)")
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="Only show errors")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="Also show the per-page and per-hit output of the workers")
+    parser.add_argument('--profile', metavar='PATH', default=None,
+                        help="Time every stage, detector and page, print a summary and save it as JSON")
+    args = parser.parse_args()
+    
+    # Batch runs only report per-file progress unless asked for more
+    configure('quiet' if args.quiet else 'progress')
+    worker_log = 'verbose' if args.verbose else 'quiet'
+    
+    cache = None if args.no_cache else ResultCache(args.cache_dir)
+    profiler = profiling.start() if args.profile else None
+    try:
+        extract_batch(args.inputs, args.output_dir,
+                      method='simple' if args.simple else 'enhanced',
+                      workers=args.workers, shard_pages=args.shard_pages, cache=cache,
+                      output_format=args.format, worker_log=worker_log, profiler=profiler,
+                      auto=args.auto)
+    finally:
+        if cache:
+            cache.close()
+    
+    if profiler:
+        profiling.stop()
+        profiler.save(args.profile)
+        print("\n" + "\n".join(profiler.summary()))
+        print(f"\n⏱️  Profile saved to: {args.profile}")
+
+
+if __name__ == "__main__":
+    main()
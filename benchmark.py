@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the PDF highlight extractors
+
+Builds synthetic annotated PDFs locally with PyMuPDF and times the
+extractors on them. The "suite" command runs every extractor and detector
+on documents of controlled size and highlight density, reports throughput
+and peak memory, and compares the results with a stored baseline:
+    
+    python benchmark.py suite --save-baseline baseline.json
+    python benchmark.py suite --baseline baseline.json    # exit code 1 on regressions
+
+The suite also times the start-up imports of the entry modules in fresh
+interpreters (python -X importtime); "python benchmark.py imports" runs only
+that part.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import enhanced_extractor
+import profiling
+import simple_extractor
+from annotation_scan import annotated_pages
+from lazy_modules import lazy_import
+from memory import peak_rss_mb
+from page_text import np
+
+fitz = lazy_import('fitz')  # PyMuPDF
+
+
+WORDS = ("alpha beta gamma delta epsilon zeta theta kappa lambda sigma omega "
+         "dopamine receptor levodopa synapse neuron cortex signal pathway").split()
+
+
+# Fill colours of drawn highlights: yellow, green, orange, pink
+DRAWN_COLORS = [(1.0, 1.0, 0.4), (0.6, 1.0, 0.6), (1.0, 0.8, 0.4), (1.0, 0.7, 0.9)]
+
+
+def make_synthetic_pdf(path, pages=100, words_per_page=300, highlights_per_page=5,
+                       multiline=True, annotated_every=1, seed=0, drawn_per_page=0,
+                       backgrounds=False):
+    """
+    Build a synthetic annotated PDF
+    
+    Args:
+        path (str): Output PDF path
+        pages (int): Number of pages
+        words_per_page (int): Approximate number of words per page
+        highlights_per_page (int): Highlight annotations on each annotated page
+        multiline (bool): Make every other highlight span two lines
+        annotated_every (int): Only every n-th page gets highlights
+        seed (int): Random seed, the same seed builds the same document
+        drawn_per_page (int): Highlights drawn as filled rectangles behind the
+            text on each annotated page
+        backgrounds (bool): Add a page background, a grid of table cells and
+            white boxes to every page (shapes that are not highlights)
+    """
+    rng = random.Random(seed)
+    doc = fitz.open()
+    words_per_line = 10
+    line_height = 14
+    
+    for page_num in range(pages):
+        page = doc.new_page()
+        line_count = max(1, min(words_per_page // words_per_line, 50))
+        
+        if backgrounds:
+            # Light page background, a table of grey cells and white boxes
+            page.draw_rect(page.rect, color=None, fill=(0.97, 0.97, 0.94), overlay=False)
+            for row in range(8):
+                for col in range(4):
+                    cell = fitz.Rect(50 + col * 120, 500 + row * 30, 170 + col * 120, 530 + row * 30)
+                    page.draw_rect(cell, color=(0.5, 0.5, 0.5), fill=(0.9, 0.9, 0.9), overlay=False)
+            for i in range(5):
+                page.draw_rect(fitz.Rect(400, 60 + i * 80, 560, 120 + i * 80),
+                               color=None, fill=(1, 1, 1), overlay=False)
+        
+        for line in range(line_count):
+            text = " ".join(rng.choice(WORDS) for _ in range(words_per_line))
+            page.insert_text((50, 60 + line * line_height), text, fontsize=10)
+        
+        if page_num % annotated_every:
+            continue
+        
+        for i in range(drawn_per_page):
+            line = rng.randrange(line_count)
+            y0 = 60 + line * line_height - 10
+            page.draw_rect(fitz.Rect(60, y0, 300, y0 + 13), color=None,
+                           fill=DRAWN_COLORS[i % len(DRAWN_COLORS)], overlay=False)
+        
+        for i in range(highlights_per_page):
+            line = rng.randrange(max(1, line_count - 1))
+            y0 = 60 + line * line_height - 10
+            rects = [fitz.Rect(60, y0, 300, y0 + 13)]
+            if multiline and i % 2:
+                rects.append(fitz.Rect(50, y0 + line_height, 200, y0 + line_height + 13))
+            annot = page.add_highlight_annot(quads=[r.quad for r in rects])
+            annot.update()
+    
+    doc.save(path)
+    doc.close()
+
+
+def timed(func, *args):
+    """Run func with its output silenced, return (seconds, result)"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        result = func(*args)
+        return time.perf_counter() - start, result
+
+
+def find_annotations_every_page(doc):
+    """Collect annotations by loading every page, as before the xref pre-scan"""
+    return sum(len(list(doc[page_num].annots())) for page_num in range(len(doc)))
+
+
+def find_annotations_prescan(doc):
+    """Collect annotations by loading only the pages found by the xref pre-scan"""
+    pages = annotated_pages(doc, enhanced_extractor.ANNOTATION_TYPES)
+    return sum(len(list(doc[page_num].annots())) for page_num in pages)
+
+
+def bench_annotation_scan(pages=1000, annotated_every=50):
+    """Compare annotation lookup with and without the xref pre-scan on a sparse document"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sparse.pdf")
+        make_synthetic_pdf(path, pages=pages, annotated_every=annotated_every)
+        
+        # Fresh documents each time, so no page is already loaded
+        with fitz.open(path) as doc:
+            full_time, full_found = timed(find_annotations_every_page, doc)
+        with fitz.open(path) as doc:
+            scan_time, scan_found = timed(find_annotations_prescan, doc)
+        with fitz.open(path) as doc:
+            extract_time, extracted = timed(enhanced_extractor.extract_from_annotations, doc, [])
+    
+    print(f"Sparse document: {pages} pages, highlights on every {annotated_every}th page")
+    print("Finding annotated pages:")
+    print(f"  Loading every page:    {full_time:8.3f} s ({full_found} annotations)")
+    print(f"  With xref pre-scan:    {scan_time:8.3f} s ({scan_found} annotations)")
+    print(f"  Speedup:               {full_time / scan_time:8.1f}x")
+    print(f"Full extract_from_annotations: {extract_time:.3f} s ({extracted} highlights)")
+    
+    return check_lazy_text(pages, annotated_every)
+
+
+def check_lazy_text(pages=200, annotated_every=50):
+    """
+    Check that the simple extractor never parses the text of a page without annotations
+    
+    Returns:
+        int: Number of unannotated pages whose text was parsed (0 when the check passes)
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sparse.pdf")
+        make_synthetic_pdf(path, pages=pages, annotated_every=annotated_every)
+        with fitz.open(path) as doc:
+            annotated = set(annotated_pages(doc, enhanced_extractor.ANNOTATION_TYPES))
+        
+        profiler = profiling.start(path)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                simple_extractor.extract_yellow_highlights(path)
+        finally:
+            profiling.stop()
+    
+    parsed = {record['page'] - 1 for record in profiler.pages
+              if 'get_textpage' in record['stages'] or 'get_text("words")' in record['stages']}
+    wasted = sorted(parsed - annotated)
+    if wasted:
+        print(f"FAIL: text parsed on {len(wasted)} page(s) without annotations, "
+              f"e.g. page {wasted[0] + 1}")
+    else:
+        print(f"Text parsed on {len(parsed)} of {pages} pages, all of them annotated")
+    return len(wasted)
+
+
+# Documents of the suite: name -> make_synthetic_pdf arguments
+SCENARIOS = {
+    'plain': dict(pages=20, words_per_page=300, highlights_per_page=5, multiline=False),
+    'multiline': dict(pages=20, words_per_page=300, highlights_per_page=5, multiline=True),
+    'dense': dict(pages=20, words_per_page=500, highlights_per_page=30),
+    'sparse': dict(pages=200, words_per_page=300, highlights_per_page=5, annotated_every=50),
+    'drawn': dict(pages=20, words_per_page=300, highlights_per_page=0, drawn_per_page=5),
+    'backgrounds': dict(pages=20, words_per_page=300, highlights_per_page=5, drawn_per_page=2,
+                        backgrounds=True),
+}
+
+# A result slower than the baseline by more than this share is a regression
+DEFAULT_TOLERANCE = 0.25
+
+# Differences below this many seconds are timer noise, never regressions
+MIN_SLOWDOWN = 0.02
+
+# Modules whose start-up imports are timed, and the heavy dependencies that
+# none of them should load before they are needed
+STARTUP_MODULES = ('simple_extractor', 'enhanced_extractor', 'batch_extractor', 'highlights', 'writers')
+HEAVY_MODULES = ('fitz', 'numpy', 'tkinter')
+
+
+def suite_targets():
+    """Names of the timed functions: both extractors and each enhanced detector"""
+    return ['simple', 'enhanced'] + [f"enhanced/{name}" for name, _ in enhanced_extractor.DETECTORS]
+
+
+def run_target(target, path):
+    """Run one timed function on a PDF, return the number of highlights found"""
+    if target == 'simple':
+        return len(simple_extractor.extract_yellow_highlights(path))
+    if target == 'enhanced':
+        return len(enhanced_extractor.extract_all_highlights(path))
+    
+    name = target.split('/', 1)[1]
+    detectors = [(n, detector) for n, detector in enhanced_extractor.DETECTORS if n == name]
+    with fitz.open(path) as doc:
+        return enhanced_extractor.run_detectors(doc, [], detectors)[name]
+
+
+def measure_target(target, path, repeat):
+    """
+    Time one target on a PDF (runs in a fresh worker process)
+    
+    Returns:
+        dict: Best and median seconds of repeat runs, highlights found and
+            peak RSS of the worker
+    """
+    baseline_rss = peak_rss_mb()
+    times = []
+    for _ in range(repeat):
+        seconds, found = timed(run_target, target, path)
+        times.append(seconds)
+    
+    peak = peak_rss_mb()
+    return {
+        'seconds': round(min(times), 6),
+        'median': round(statistics.median(times), 6),
+        'highlights': found,
+        'peak_rss_mb': peak,
+        'rss_growth_mb': None if peak is None else round(peak - baseline_rss, 1),
+    }
+
+
+def run_suite(scenarios=None, targets=None, repeat=3, scale=1.0):
+    """
+    Run the benchmark suite
+    
+    Every target runs in its own fresh process, so peak memory is measured
+    per target and no run warms caches for the next one.
+    
+    Args:
+        scenarios (list): Names from SCENARIOS (default all)
+        targets (list): Names from suite_targets() (default all)
+        repeat (int): Runs per target; the fastest one is reported
+        scale (float): Multiplier for the page counts of the scenarios
+    
+    Returns:
+        dict: 'environment', 'scenarios' (their settings) and 'results'
+            ({scenario: {target: measurements}})
+    """
+    scenarios = scenarios or list(SCENARIOS)
+    targets = targets or suite_targets()
+    report = {'environment': environment(), 'repeat': repeat, 'scenarios': {}, 'results': {}}
+    spawn = multiprocessing.get_context('spawn')
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        for scenario in scenarios:
+            settings = dict(SCENARIOS[scenario])
+            settings['pages'] = max(1, round(settings['pages'] * scale))
+            path = os.path.join(tmp, f"{scenario}.pdf")
+            make_synthetic_pdf(path, **settings)
+            report['scenarios'][scenario] = settings
+            report['results'][scenario] = {}
+            
+            for target in targets:
+                with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                    result = pool.submit(measure_target, target, path, repeat).result()
+                result['pages_per_s'] = round(settings['pages'] / result['seconds'], 1)
+                result['highlights_per_s'] = round(result['highlights'] / result['seconds'], 1)
+                report['results'][scenario][target] = result
+                print_result(scenario, target, result)
+    
+    return report
+
+
+def measure_import(module, repeat=5):
+    """
+    Import cost of a module in fresh interpreters
+    
+    Returns:
+        dict: Best cumulative import time of the module as reported by
+            -X importtime, best wall time of the whole interpreter run, and
+            the HEAVY_MODULES that the import actually loaded
+    """
+    # Deferred modules (see lazy_modules) are in sys.modules before they are loaded
+    code = (f"import sys, types, {module}; "
+            f"print(','.join(m for m in {HEAVY_MODULES!r} if type(sys.modules.get(m)) is types.ModuleType))")
+    imports, processes = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                                cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True)
+        processes.append(time.perf_counter() - start)
+        
+        # "import time: self [us] | cumulative | imported package"
+        for line in result.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == module:
+                imports.append(int(fields[1]) / 1e6)
+    
+    # Last line only: PyMuPDF may print a notice when it is loaded
+    loaded = (result.stdout.strip().splitlines() or [''])[-1]
+    return {
+        'seconds': round(min(imports), 6),
+        'process_seconds': round(min(processes), 6),
+        'loaded': [name for name in loaded.split(',') if name],
+    }
+
+
+def run_imports(modules=STARTUP_MODULES, repeat=5):
+    """Import cost of each start-up module, printed as measured"""
+    print(f"{'Module':<24} {'Import (s)':>10} {'Process (s)':>11}  Heavy modules loaded")
+    print("-" * 70)
+    results = {}
+    for module in modules:
+        result = results[module] = measure_import(module, repeat)
+        print(f"{module:<24} {result['seconds']:10.3f} {result['process_seconds']:11.3f}  "
+              f"{', '.join(result['loaded']) or '-'}")
+    return results
+
+
+def environment():
+    """Versions the results depend on"""
+    return {
+        'python': platform.python_version(),
+        'pymupdf': fitz.VersionBind,
+        'numpy': np.__version__ if np is not None else None,
+        'platform': platform.platform(),
+    }
+
+
+def print_result(scenario, target, result):
+    """One line of the suite table"""
+    rss = f"{result['peak_rss_mb']:8.1f}" if result['peak_rss_mb'] is not None else f"{'-':>8}"
+    print(f"{scenario:<12} {target:<32} {result['seconds']:9.3f} {result['pages_per_s']:9.1f} "
+          f"{result['highlights_per_s']:11.1f} {result['highlights']:7d} {rss}")
+
+
+def compare_to_baseline(report, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Regressions of a suite report against a baseline report
+    
+    A target regresses when it is slower than its baseline time by more than
+    tolerance (and by at least MIN_SLOWDOWN seconds), when its peak memory
+    grew by more than tolerance, or when it finds a different number of
+    highlights. Scenarios whose settings changed are not compared.
+    
+    Returns:
+        list: Descriptions of the regressions, empty if there are none
+    """
+    regressions = []
+    
+    for scenario, results in report['results'].items():
+        if baseline.get('scenarios', {}).get(scenario) != report['scenarios'][scenario]:
+            continue
+        for target, result in results.items():
+            old = baseline['results'].get(scenario, {}).get(target)
+            if not old:
+                continue
+            name = f"{scenario} / {target}"
+            
+            slowdown = result['seconds'] - old['seconds']
+            if slowdown > MIN_SLOWDOWN and result['seconds'] > old['seconds'] * (1 + tolerance):
+                regressions.append(f"{name}: {old['seconds']:.3f} s -> {result['seconds']:.3f} s "
+                                   f"({result['seconds'] / old['seconds']:.2f}x)")
+            
+            if (result['peak_rss_mb'] and old.get('peak_rss_mb') and
+                    result['peak_rss_mb'] > old['peak_rss_mb'] * (1 + tolerance)):
+                regressions.append(f"{name}: peak memory {old['peak_rss_mb']} MB -> {result['peak_rss_mb']} MB")
+            
+            if result['highlights'] != old['highlights']:
+                regressions.append(f"{name}: found {result['highlights']} highlights, "
+                                   f"baseline found {old['highlights']}")
+    
+    for module, result in report.get('imports', {}).items():
+        old = baseline.get('imports', {}).get(module)
+        if not old:
+            continue
+        
+        slowdown = result['seconds'] - old['seconds']
+        if slowdown > MIN_SLOWDOWN and result['seconds'] > old['seconds'] * (1 + tolerance):
+            regressions.append(f"import {module}: {old['seconds']:.3f} s -> {result['seconds']:.3f} s")
+        
+        loaded = sorted(set(result['loaded']) - set(old['loaded']))
+        if loaded:
+            regressions.append(f"import {module}: now loads {', '.join(loaded)} at start-up")
+    
+    return regressions
+
+
+def bench_suite(scenarios=None, targets=None, repeat=3, scale=1.0, baseline_path=None,
+                save_path=None, tolerance=DEFAULT_TOLERANCE):
+    """
+    Run the suite, print the results and compare or save a baseline
+    
+    Returns:
+        int: Exit status, 1 if there are regressions against the baseline
+    """
+    baseline = None
+    if baseline_path:
+        with open(baseline_path, encoding='utf-8') as f:
+            baseline = json.load(f)
+    
+    print(f"{'Scenario':<12} {'Target':<32} {'Seconds':>9} {'Pages/s':>9} "
+          f"{'Highlights/s':>11} {'Found':>7} {'RSS (MB)':>8}")
+    print("-" * 94)
+    report = run_suite(scenarios, targets, repeat, scale)
+    print()
+    report['imports'] = run_imports(repeat=max(repeat, 5))
+    
+    if save_path:
+        with open(save_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to: {save_path}")
+    
+    if baseline is None:
+        return 0
+    
+    if baseline.get('environment') != report['environment']:
+        print("\nNote: the baseline was recorded in a different environment:")
+        print(f"  {baseline.get('environment')}")
+    
+    regressions = compare_to_baseline(report, baseline, tolerance)
+    if not regressions:
+        print(f"\nNo regressions against {baseline_path} (tolerance {tolerance:.0%})")
+        return 0
+    
+    print(f"\n{len(regressions)} regression(s) against {baseline_path}:")
+    for regression in regressions:
+        print(f"  {regression}")
+    return 1
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Benchmarks for the PDF highlight extractors")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    scan = commands.add_parser('annot-scan', help="Annotation pre-scan on a sparse document; exit code 1 "
+                                                  "if text is parsed on pages without annotations")
+    scan.add_argument('--pages', type=int, default=1000)
+    scan.add_argument('--annotated-every', type=int, default=50)
+    
+    imports = commands.add_parser('imports', help="Start-up import time of the entry modules")
+    imports.add_argument('--repeat', type=int, default=5,
+                         help="Interpreter runs per module, the fastest is reported (default 5)")
+    
+    suite = commands.add_parser('suite', help="Time every extractor and detector on synthetic documents")
+    suite.add_argument('--scenario', action='append', choices=list(SCENARIOS), dest='scenarios',
+                       help="Only run this scenario (repeatable, default all)")
+    suite.add_argument('--target', action='append', choices=suite_targets(), dest='targets',
+                       help="Only time this extractor or detector (repeatable, default all)")
+    suite.add_argument('--repeat', type=int, default=3,
+                       help="Runs per target, the fastest is reported (default 3)")
+    suite.add_argument('--scale', type=float, default=1.0,
+                       help="Multiply the page counts of the scenarios (e.g. 0.25 for a quick run)")
+    suite.add_argument('--baseline', metavar='PATH',
+                       help="Compare with a saved baseline; exit code 1 on regressions")
+    suite.add_argument('--save-baseline', metavar='PATH',
+                       help="Save the results as a baseline")
+    suite.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                       help=f"Allowed slowdown and memory growth (default {DEFAULT_TOLERANCE})")
+    
+    args = parser.parse_args()
+    
+    if args.command == 'annot-scan':
+        sys.exit(1 if bench_annotation_scan(args.pages, args.annotated_every) else 0)
+    elif args.command == 'imports':
+        run_imports(repeat=args.repeat)
+    elif args.command == 'suite':
+        sys.exit(bench_suite(args.scenarios, args.targets, args.repeat, args.scale,
+                             args.baseline, args.save_baseline, args.tolerance))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Near-duplicate merging of extracted highlights
+
+Results are merged in two stages:
+
+1. Spatial: hits on the same page whose rectangles overlap (IoU of at least
+   MIN_IOU) describe the same region, e.g. an annotation and the drawing of
+   the same highlight; they are merged into one.
+2. Text: the remaining hits are compared by the word shingles of their text
+   with MinHash signatures and locality-sensitive hashing, so only hits that
+   share a band of their signature are ever compared; texts with a Jaccard
+   similarity of at least MIN_SIMILARITY are merged.
+
+A merged hit keeps the text of its best member (by METHOD_RANK) and the
+first colour found among its members. Both stages only compare candidates
+that share a grid cell or a hash bucket, never all pairs.
+"""
+
+import hashlib
+import itertools
+import re
+import zlib
+from array import array
+
+from page_text import np
+
+
+# Rectangles overlapping at least this much (intersection over union) are one region
+MIN_IOU = 0.5
+
+# Texts whose shingle sets have at least this Jaccard similarity are duplicates
+MIN_SIMILARITY = 0.8
+
+# Texts this short are dropped, as before
+MIN_TEXT_LENGTH = 6
+
+# Words per shingle (shorter texts use their single words)
+SHINGLE_WORDS = 2
+
+# MinHash signature size, split into BANDS bands of NUM_HASHES / BANDS values;
+# texts sharing a band become candidates (about 50% similar or more)
+NUM_HASHES = 32
+BANDS = 8
+_SIGNATURE_BYTES = NUM_HASHES * 4
+
+# Preference of the detection methods when hits are merged, best first
+METHOD_RANK = ('Annotation', 'Raster', 'Drawing', 'ColoredText', 'Comprehensive')
+
+# Multiply-shift hash family h(x) = ((a * x + b) mod 2^64) >> 32 over the
+# 32-bit shingle hashes, with fixed odd multipliers so results are reproducible
+_MASK64 = (1 << 64) - 1
+_COEFFICIENTS = []
+_seed = 0x9E3779B97F4A7C15
+for _ in range(NUM_HASHES):
+    _seed = (_seed * 6364136223846793005 + 1442695040888963407) & _MASK64
+    _a = _seed | 1
+    _seed = (_seed * 6364136223846793005 + 1442695040888963407) & _MASK64
+    _COEFFICIENTS.append((_a, _seed))
+del _seed, _a
+
+# The coefficients as NumPy columns, built on first use so importing this
+# module does not load NumPy
+_columns = None
+
+_WORD = re.compile(r"\w+")
+
+
+def iou(a, b):
+    """Intersection over union of two (x0, y0, x1, y1) rectangles"""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    inter = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def normalize(text):
+    """Text as compared for duplicates: lowercase words only"""
+    return " ".join(_WORD.findall(text.lower()))
+
+
+def shingles(text):
+    """Set of word n-grams of a normalized text"""
+    words = text.split()
+    if len(words) <= SHINGLE_WORDS:
+        return set(words)
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+def minhash_many(shingle_sets):
+    """
+    MinHash signatures of several shingle sets, computed in one batch
+    
+    Returns:
+        list: One signature per set, NUM_HASHES 32-bit values packed as bytes
+    """
+    hashes = [[zlib.crc32(shingle.encode('utf-8')) for shingle in shingle_set] or [0]
+              for shingle_set in shingle_sets]
+    if not hashes:
+        return []
+    
+    if np is not None:
+        global _columns
+        if _columns is None:
+            _columns = (np.array([a for a, _ in _COEFFICIENTS], dtype=np.uint64)[:, None],
+                        np.array([b for _, b in _COEFFICIENTS], dtype=np.uint64)[:, None])
+        a, b = _columns
+        lengths = [len(values) for values in hashes]
+        x = np.fromiter(itertools.chain.from_iterable(hashes), dtype=np.uint64, count=sum(lengths))
+        # uint64 arithmetic wraps around, which is the mod 2^64
+        values = (a * x + b) >> np.uint64(32)
+        offsets = np.cumsum([0] + lengths[:-1])
+        minima = np.minimum.reduceat(values, offsets, axis=1).T.astype(np.uint32)
+        return [row.tobytes() for row in minima]
+    
+    return [array('I', (min(((a * x + b) & _MASK64) >> 32 for x in values) for a, b in _COEFFICIENTS)).tobytes()
+            for values in hashes]
+
+
+def minhash(shingle_set):
+    """MinHash signature of one shingle set"""
+    return minhash_many([shingle_set])[0]
+
+
+def similarity(signature, other):
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    return sum(x == y for x, y in zip(array('I', signature), array('I', other))) / NUM_HASHES
+
+
+def method_rank(record):
+    """Position of a record's method in METHOD_RANK (lower is better)"""
+    method = record.get('method') or ('Drawing' if record.get('type') == 'Drawing' else 'Annotation')
+    method = method.split('-', 1)[0]
+    return METHOD_RANK.index(method) if method in METHOD_RANK else len(METHOD_RANK)
+
+
+def merge(records):
+    """One record for a group of duplicates: the best method, with a colour if any member has one"""
+    best = min(records, key=method_rank)
+    if best.get('color'):
+        return best
+    color = next((record['color'] for record in records if record.get('color')), None)
+    return dict(best, color=color) if color else best
+
+
+class _Groups:
+    """Union-find over record positions"""
+    
+    def __init__(self, size):
+        self.parent = list(range(size))
+    
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+    
+    def union(self, i, j):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+
+def merge_overlapping(records):
+    """
+    Merge hits of one page whose rectangles cover the same region
+    
+    Returns:
+        list: Merged records in the order of their first member
+    """
+    boxed = [i for i, record in enumerate(records) if len(record.get('rect') or ()) >= 4]
+    if len(boxed) < 2:
+        return list(records)
+    
+    groups = _Groups(len(records))
+    rects = {i: tuple(records[i]['rect'][:4]) for i in boxed}
+    
+    # Sweep down the page, comparing each rect only with those still open at its top
+    open_rects = []
+    for i in sorted(boxed, key=lambda i: rects[i][1]):
+        rect = rects[i]
+        open_rects = [j for j in open_rects if rects[j][3] > rect[1]]
+        for j in open_rects:
+            if iou(rect, rects[j]) >= MIN_IOU:
+                groups.union(i, j)
+        open_rects.append(i)
+    
+    members = {}
+    for i in range(len(records)):
+        members.setdefault(groups.find(i), []).append(records[i])
+    return [merge(group) for group in members.values()]
+
+
+class Deduplicator:
+    """
+    Merges duplicates among records added page by page
+    
+    Records of the same add() call are merged among themselves (keeping the
+    best method); a record that duplicates one returned by an earlier call
+    is dropped, since that one may already have been written out.
+    
+    The state kept for earlier records is small and of fixed size per
+    record: a digest of its text, its signature in one shared buffer and its
+    bucket entries, never the record or its text.
+    """
+    
+    def __init__(self):
+        self.texts = {}
+        self.signatures = bytearray()
+        self.count = 0
+        self.buckets = [{} for _ in range(BANDS)]
+        self.merged_regions = 0
+        self.merged_texts = 0
+    
+    def add(self, records):
+        """
+        Unique records among records (of one or more pages, in page order)
+        
+        Returns:
+            list: Merged records, in order
+        """
+        unique = []
+        page_records = []
+        for record in records:
+            if page_records and record['page'] != page_records[0]['page']:
+                unique.extend(self._add_page(page_records))
+                page_records = []
+            page_records.append(record)
+        if page_records:
+            unique.extend(self._add_page(page_records))
+        return unique
+    
+    def _add_page(self, records):
+        """Merge the records of one page and against earlier pages"""
+        records = [record for record in records if len(record['text'].strip()) >= MIN_TEXT_LENGTH]
+        regions = merge_overlapping(records)
+        self.merged_regions += len(records) - len(regions)
+        
+        # Positions of this page's groups among the indexed records, and their members
+        first = self.count
+        groups = []
+        
+        texts = []
+        for record in regions:
+            text = normalize(record['text'])
+            texts.append(text if len(text) >= MIN_TEXT_LENGTH else record['text'].strip().lower())
+        keys = [hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest() for text in texts]
+        
+        # Signatures of all new texts of the page in one batch
+        new_texts = {key: text for key, text in zip(keys, texts) if key not in self.texts}
+        signatures = dict(zip(new_texts, minhash_many([shingles(text) for text in new_texts.values()])))
+        
+        for record, key in zip(regions, keys):
+            match = self.texts.get(key)
+            signature = signatures.get(key)
+            if match is None:
+                match = self._similar(signature)
+            
+            if match is None:
+                self.texts[key] = self.count
+                self._index(signature)
+                groups.append([record])
+                continue
+            
+            self.merged_texts += 1
+            self.texts.setdefault(key, match)
+            if match >= first:
+                groups[match - first].append(record)
+            # Duplicates of earlier pages are dropped, those were already returned
+        
+        return [merge(group) for group in groups]
+    
+    @staticmethod
+    def _band_keys(signature):
+        """Bucket key of each band of a signature (its first 8 bytes as an int)"""
+        size = len(signature) // BANDS
+        return [int.from_bytes(signature[band * size:band * size + 8], 'little') for band in range(BANDS)]
+    
+    def _similar(self, signature):
+        """Position of an indexed signature similar to signature, or None"""
+        checked = set()
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            candidates = bucket.get(key, ())
+            for candidate in (candidates,) if isinstance(candidates, int) else candidates:
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                start = candidate * _SIGNATURE_BYTES
+                if similarity(signature, self.signatures[start:start + _SIGNATURE_BYTES]) >= MIN_SIMILARITY:
+                    return candidate
+        return None
+    
+    def _index(self, signature):
+        """Add a signature to the LSH buckets"""
+        position = self.count
+        self.signatures += signature
+        self.count += 1
+        # Most buckets hold a single position, stored as a plain int
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            candidates = bucket.get(key)
+            if candidates is None:
+                bucket[key] = position
+            elif isinstance(candidates, int):
+                bucket[key] = [candidates, position]
+            else:
+                candidates.append(position)
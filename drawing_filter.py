@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cheap pre-filter for highlight-like drawings
+
+Rejects filled shapes that cannot be highlights (page backgrounds, table
+cells, slide backgrounds, white or grey boxes) using only their geometry
+and colour, before any text is extracted from them.
+
+Hue is not checked: highlighter palettes (Acrobat, Preview, Zotero, ...)
+include red, orange, yellow, green, blue, purple and pink, so any
+saturated colour may be a highlight.
+"""
+
+import colorsys
+
+
+# Shapes covering more than this share of the page are backgrounds
+MAX_AREA_RATIO = 0.25
+
+# Highlights are strips over at most a few text lines
+MAX_LINES = 3
+
+# Typical line height when the page has no text lines to measure
+DEFAULT_LINE_HEIGHT = 14.0
+
+# Greys and whites are never highlight colours
+MIN_SATURATION = 0.15
+
+
+def reject_reason(drawing, page_rect, line_height=None):
+    """
+    Why a filled drawing cannot be a highlight
+    
+    Args:
+        drawing (dict): Item of page.get_drawings()
+        page_rect: Page rectangle
+        line_height (float): Typical text line height on the page (optional)
+    
+    Returns:
+        str: Short reason, or None if the drawing may be a highlight
+    """
+    rect = drawing.get('rect')
+    fill = drawing.get('fill')
+    if not rect or not fill:
+        return 'no fill'
+    
+    width = rect[2] - rect[0]
+    height = rect[3] - rect[1]
+    if width <= 0 or height <= 0:
+        return 'empty'
+    
+    if drawing.get('fill_opacity') == 0:
+        return 'invisible'
+    
+    page_area = abs(page_rect[2] - page_rect[0]) * abs(page_rect[3] - page_rect[1])
+    if page_area and width * height / page_area > MAX_AREA_RATIO:
+        return 'background'
+    
+    # A highlight is a horizontal strip at most a few lines high
+    if height > MAX_LINES * (line_height or DEFAULT_LINE_HEIGHT) or height > width:
+        return 'not a strip'
+    
+    if isinstance(fill, (list, tuple)) and len(fill) >= 3:
+        _, saturation, _ = colorsys.rgb_to_hsv(*fill[:3])
+        if saturation < MIN_SATURATION:
+            return 'grey'
+    
+    return None
@@ -5,10 +5,25 @@ Enhanced PDF Highlight Extractor - Debug Version
 Advanced version for extracting highlighted text from PDF files
 """
 
-import fitz  # PyMuPDF
+import contextlib
+import logging
 import sys
 import os
-from datetime import datetime
+
+import profiling
+from annotation_scan import annotated_pages, has_annotations
+from dedup import Deduplicator
+from drawing_filter import DEFAULT_LINE_HEIGHT, reject_reason
+from lazy_modules import lazy_import
+from logs import PROGRESS, configure, get_logger, mode_from_args
+from memory import RecordSpool
+from page_text import PageText, np, quad_rects
+from result_cache import ResultCache
+from writers import STDOUT, open_writer
+
+fitz = lazy_import('fitz')  # PyMuPDF
+
+log = get_logger('enhanced')
 
 
 def debug_pdf_structure(pdf_path):
@@ -82,271 +97,788 @@ def debug_pdf_structure(pdf_path):
                                     blocks_with_color += 1
                 
                 print(f"Colored texts: {blocks_with_color}")
-                
+            
             except Exception as e:
                 print(f"Error analyzing texts: {e}")
         
         doc.close()
         print("\n" + "=" * 60)
-        
+    
     except Exception as e:
         print(f"Error analyzing file: {e}")
 
 
-def extract_all_highlights(pdf_path, output_path=None):
-    """Extract all types of highlights from PDF using multiple methods"""
+# Resolution of the page renderings searched by the raster method
+RASTER_DPI = 36
+
+# Highlighter pixels are bright and clearly coloured
+RASTER_MIN_SATURATION = 0.25
+RASTER_MIN_VALUE = 0.6
+
+# Share of a region's bounding box that must be highlighter-coloured
+# (solid strips pass, coloured glyphs do not)
+RASTER_MIN_FILL = 0.75
+
+# Pages of a document that auto mode runs every detector on (one per equal
+# part of the document) before picking the productive detectors
+AUTO_SAMPLE_PAGES = 6
+
+# Sampled pages with text needed for a decision; with fewer, everything runs
+AUTO_MIN_TEXT_PAGES = 2
+
+# Share of a detector's sample hits that must survive duplicate merging
+AUTO_MIN_PRECISION = 0.2
+
+# With a memory ceiling, MuPDF's resource cache is emptied after this many pages
+MEMORY_WINDOW_PAGES = 25
+
+# Annotation types that might contain highlights
+ANNOTATION_TYPES = ['Highlight', 'Squiggly', 'Underline', 'StrikeOut', 
+                    'Square', 'FreeText', 'Text', 'Note', 'Polygon']
+
+
+class PageContext(PageText):
+    """Shared view of one page handed to every detector"""
+    
+    def __init__(self, page, page_num, has_annots=True):
+        super().__init__(page)
+        self.page_num = page_num
+        self.has_annots = has_annots
+        self.stats = {}
+        self._annots = None
+        self._drawings = None
+    
+    @property
+    def annots(self):
+        """Annotations of the page (empty if the pre-scan found none)"""
+        if self._annots is None:
+            with profiling.stage('annots'):
+                self._annots = list(self.page.annots()) if self.has_annots else []
+        return self._annots
+    
+    @property
+    def drawings(self):
+        """Output of page.get_drawings()"""
+        if self._drawings is None:
+            with profiling.stage('get_drawings'):
+                self._drawings = self.page.get_drawings()
+        return self._drawings
+
+
+def extract_all_highlights(pdf_path, output_path=None, cache=None, raster=False, raster_dpi=None,
+                           output_format=None, auto=False, max_memory_mb=None):
+    """
+    Extract all types of highlights from PDF using multiple methods
+    
+    Args:
+        pdf_path (str): PDF file path
+        output_path (str): Output file path (optional)
+        cache (ResultCache): Result cache to read from and update (optional)
+        raster (bool): Also search page renderings for flattened highlights
+        raster_dpi (int): Rendering resolution for the raster search (default RASTER_DPI)
+        output_format (str): 'txt', 'jsonl', 'csv' or 'docx' (optional, default
+            from the output file extension)
+        auto (bool): Only run the detectors that are productive on a sample of pages
+        max_memory_mb (int): Bounded-memory mode: while the pages are
+            processed, results move to a temporary file when the process
+            nears this resident size, and MuPDF's caches are emptied every
+            MEMORY_WINDOW_PAGES pages (optional). The returned list is built
+            after the document is closed and is not covered by the ceiling.
+    
+    Returns:
+        list: List of extracted texts
+    """
     
     if not os.path.exists(pdf_path):
-        print(f"❌ Error: File not found: {pdf_path}")
+        log.error("❌ Error: File not found: %s", pdf_path)
         return []
     
+    detectors, options = select_detectors(raster, raster_dpi, auto)
+    
     try:
-        print(f"📂 Opening file: {os.path.basename(pdf_path)}")
-        doc = fitz.open(pdf_path)
-        all_extracts = []
+        with profiling.stage('cache'):
+            cached = cache.get(pdf_path, 'enhanced', options) if cache else None
+        if cached is not None:
+            log.log(PROGRESS, "♻️  Loaded results for %s from cache", os.path.basename(pdf_path))
+            display_results(cached)
+            if output_path and cached:
+                save_results(cached, pdf_path, output_path, output_format, cache.digest(pdf_path))
+            return cached
         
-        print(f"📊 Number of pages: {len(doc)}")
+        log.log(PROGRESS, "📂 Opening file: %s", os.path.basename(pdf_path))
+        with profiling.stage('open'):
+            doc = fitz.open(pdf_path)
         
-        # Method 1: Extract from annotations
-        print("\n🎯 Method 1: Searching in annotations...")
-        annotations_found = extract_from_annotations(doc, all_extracts)
+        log.log(PROGRESS, "📊 Number of pages: %d", len(doc))
         
-        # Method 2: Extract from colored drawings
-        print("\n🎨 Method 2: Searching in colored drawings...")
-        drawings_found = extract_from_drawings(doc, all_extracts)
+        if auto:
+            detectors = choose_detectors(doc, detectors)
         
-        # Method 3: Extract colored texts
-        print("\n🌈 Method 3: Searching in colored texts...")
-        colored_text_found = extract_colored_texts(doc, all_extracts)
+        # All methods share a single pass over the pages
+        log.log(PROGRESS, "\n🔍 Searching with %s in a single pass...",
+                "the chosen methods" if auto else "all methods")
+        counts = {}
+        if cache:
+            pages = iter_incremental(doc, pdf_path, cache, detectors, options, counts)
+        else:
+            pages = iter_detectors(doc, detectors, counts=counts)
         
-        # Method 4: Comprehensive search
-        print("\n🔍 Method 4: Comprehensive search...")
-        comprehensive_found = extract_comprehensive(doc, all_extracts)
+        # Results are written out page by page as they are found. In
+        # bounded-memory mode they are collected in a RecordSpool, which moves
+        # them to disk while the pages are processed
+        # The cache has the file's digest already, the writers need not hash it again
+        digest = cache.digest(pdf_path) if cache and output_path else None
+        writer = open_output(output_path, pdf_path, output_format, digest) if output_path else None
+        dedup = Deduplicator()
+        found = 0
         
-        doc.close()
+        with RecordSpool(max_memory_mb) if max_memory_mb else contextlib.nullcontext([]) as collected:
+            try:
+                for done, page_extracts in enumerate(pages, 1):
+                    found += len(page_extracts)
+                    
+                    # Remove duplicates
+                    with profiling.stage('dedup'):
+                        page_unique = list(iter_unique(page_extracts, dedup))
+                    collected.extend(page_unique)
+                    
+                    if writer:
+                        with profiling.stage('write'):
+                            for extract in page_unique:
+                                writer.write(extract)
+                    
+                    if max_memory_mb:
+                        if done % MEMORY_WINDOW_PAGES == 0:
+                            fitz.TOOLS.store_shrink(100)
+                        collected.check()
+            except BaseException:
+                if writer:
+                    writer.discard()
+                raise
+            finally:
+                doc.close()
+            
+            # The results only come back into memory once MuPDF has let go of
+            # the document; the peak is measured after that, so it includes them
+            if max_memory_mb:
+                fitz.TOOLS.store_shrink(100)
+            unique_extracts = list(collected)
+            if max_memory_mb:
+                collected.update_peak()
+                spilled, peak_rss_mb = collected.spilled, collected.peak_rss_mb
         
-        # Remove duplicates
-        unique_extracts = remove_duplicates(all_extracts)
+        if cache:
+            with profiling.stage('cache'):
+                cache.put(pdf_path, 'enhanced', unique_extracts, options)
         
-        print(f"\n📈 Extraction statistics:")
-        print(f"  Annotations: {annotations_found}")
-        print(f"  Colored drawings: {drawings_found}")
-        print(f"  Colored texts: {colored_text_found}")
-        print(f"  Comprehensive search: {comprehensive_found}")
-        print(f"  Total before removing duplicates: {len(all_extracts)}")
-        print(f"  Total after removing duplicates: {len(unique_extracts)}")
+        log.info("\n📈 Extraction statistics:")
+        for name, value in counts.items():
+            log.info("  %s: %s", name, value)
+        log.info("  Total before removing duplicates: %d", found)
+        log.info("  Merged overlapping hits: %d", dedup.merged_regions)
+        log.info("  Merged near-duplicate texts: %d", dedup.merged_texts)
+        log.info("  Total after removing duplicates: %d", len(unique_extracts))
+        if max_memory_mb:
+            log.log(PROGRESS, "🧠 Peak memory: %s MB (ceiling %d MB), %d result(s) spilled to disk",
+                    peak_rss_mb, max_memory_mb, spilled)
         
         # Display results
         display_results(unique_extracts)
         
         # Save results
-        if output_path and unique_extracts:
-            save_results(unique_extracts, pdf_path, output_path)
+        if writer and unique_extracts:
+            close_output(writer, output_path)
+        elif writer:
+            writer.discard()
         
         return unique_extracts
-        
+    
     except Exception as e:
-        print(f"❌ Error processing file: {str(e)}")
+        log.error("❌ Error processing file: %s", e)
         return []
 
 
-def extract_from_annotations(doc, extracts):
-    """Extract from annotations"""
-    found = 0
+def select_detectors(raster=False, raster_dpi=None, auto=False):
+    """
+    Detectors and cache options for the chosen extraction settings
+    
+    Returns:
+        tuple: (list of (name, detector) pairs, options dict or None)
+    """
+    detectors = DETECTORS
+    options = {}
+    if raster:
+        raster_dpi = raster_dpi or RASTER_DPI
+        detectors = DETECTORS + [('Raster highlights', raster_detector(raster_dpi))]
+        options['raster_dpi'] = raster_dpi
+    if auto:
+        options['auto'] = True
+    return detectors, options or None
+
+
+def sample_pages(page_count, size=AUTO_SAMPLE_PAGES):
+    """Stratified sample of page positions: the middle page of each of size equal parts"""
+    if page_count <= size:
+        return list(range(page_count))
+    return [int((i + 0.5) * page_count / size) for i in range(size)]
+
+
+def choose_detectors(doc, detectors=None, pages=None):
+    """
+    Detectors worth running on a document, judged on a sample of its pages
+    
+    Every detector runs on a stratified sample of pages. A detector is kept
+    if it found results there that survive duplicate merging (at least
+    AUTO_MIN_PRECISION of its hits); the others only produce nothing or
+    duplicates of better methods. Annotations are kept whenever the xref
+    pre-scan finds any, as that check is exact and cheap. If the sample is
+    too small or has too little text to judge, or nothing is found in it,
+    all detectors are kept.
+    
+    Args:
+        doc: Open fitz document
+        detectors (list): (name, detector) pairs, defaults to DETECTORS
+        pages (iterable): Zero-based page numbers to choose for (optional, default all)
+    
+    Returns:
+        list: The (name, detector) pairs to run, in their original order
+    """
+    if detectors is None:
+        detectors = DETECTORS
+    pages = list(range(len(doc)) if pages is None else pages)
     
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        annotations = page.annots()
+    # On short documents the sample would be most of the work
+    if len(pages) <= 2 * AUTO_SAMPLE_PAGES:
+        return detectors
+    
+    sample = [pages[i] for i in sample_pages(len(pages))]
+    hits = dict.fromkeys((name for name, _ in detectors), 0)
+    unique = dict.fromkeys(hits, 0)
+    text_pages = 0
+    dedup = Deduplicator()
+    
+    for page_num in sample:
+        context = PageContext(doc[page_num], page_num, has_annotations(doc, page_num, ANNOTATION_TYPES))
+        text_pages += bool(context.words)
         
-        for annot in annotations:
-            try:
-                annot_type = annot.type[1] if len(annot.type) > 1 else annot.type[0]
-                
-                # Accept all annotation types that might contain highlights
-                if annot_type in ['Highlight', 'Squiggly', 'Underline', 'StrikeOut', 
-                                'Square', 'FreeText', 'Text', 'Note', 'Polygon']:
-                    
-                    text = extract_text_from_annotation(page, annot)
-                    
-                    if text and text.strip():
-                        extract_info = {
-                            'page': page_num + 1,
-                            'text': text.strip(),
-                            'method': f'Annotation-{annot_type}',
-                            'color': get_annotation_color(annot),
-                            'rect': list(annot.rect)
-                        }
-                        extracts.append(extract_info)
-                        found += 1
-                        print(f"    ✓ Page {page_num + 1}: {text[:50]}...")
-                        
-            except Exception as e:
-                print(f"    ✗ Error in annotation: {e}")
+        # Tag the sample results to see which detector each merged result came from
+        found = []
+        for name, detector in detectors:
+            results = detector(context)
+            hits[name] += len(results)
+            found.extend(dict(result, detector=name) for result in results)
+        for result in dedup.add(found):
+            unique[result['detector']] += 1
+    
+    log.info("🎯 Auto mode: sampled pages %s", ", ".join(str(page_num + 1) for page_num in sample))
+    for name in hits:
+        log.info("  %s: %d hit(s), %d after merging duplicates", name, hits[name], unique[name])
     
-    return found
+    if text_pages < AUTO_MIN_TEXT_PAGES or not any(unique.values()):
+        log.info("  Sample is inconclusive, running all methods")
+        return detectors
+    
+    annotated = set(annotated_pages(doc, ANNOTATION_TYPES)).intersection(pages)
+    chosen = [
+        (name, detector) for name, detector in detectors
+        if (unique[name] and unique[name] >= AUTO_MIN_PRECISION * hits[name]) or
+        (detector is detect_annotations and annotated)
+    ]
+    log.info("  Running: %s", ", ".join(name for name, _ in chosen))
+    return chosen
 
 
-def extract_from_drawings(doc, extracts):
-    """Extract from colored drawings"""
-    found = 0
+def run_detectors(doc, extracts, detectors=None, pages=None):
+    """
+    Run detectors over the document, loading each page only once
     
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        
-        try:
-            drawings = page.get_drawings()
+    Args:
+        doc: Open fitz document
+        extracts (list): Results are appended here in page order
+        detectors (list): (name, detector) pairs, defaults to DETECTORS
+        pages (iterable): Zero-based page numbers (optional, default all)
+    
+    Returns:
+        dict: Number of results per detector name, followed by any extra
+            counters the detectors reported through context.stats
+    """
+    counts = {}
+    for page_extracts in iter_detectors(doc, detectors, pages, counts):
+        extracts.extend(page_extracts)
+    return counts
+
+
+def iter_detectors(doc, detectors=None, pages=None, counts=None):
+    """
+    Like run_detectors, but yield the results of each page as soon as it is done
+    
+    Args:
+        counts (dict): Updated in place with the per-detector counters (optional)
+    
+    Yields:
+        list: Results of one page, pages in the order given
+    """
+    if detectors is None:
+        detectors = DETECTORS
+    if pages is None:
+        pages = range(len(doc))
+    if counts is None:
+        counts = {}
+    
+    for name, _ in detectors:
+        counts.setdefault(name, 0)
+    
+    for page_num in pages:
+        with profiling.page(page_num):
+            # Pre-scan the xref table so annotation-free pages skip page.annots()
+            with profiling.stage('annotation scan'):
+                has_annots = has_annotations(doc, page_num, ANNOTATION_TYPES)
+            with profiling.stage('load page'):
+                context = PageContext(doc[page_num], page_num, has_annots)
+            page_extracts = []
+            log.log(PROGRESS, "  📄 Page %d of %d", page_num + 1, len(doc))
             
-            for drawing in drawings:
-                if 'fill' in drawing and drawing['fill']:
-                    fill_color = drawing['fill']
-                    
-                    # التحقق من أن اللون فاتح (قد يكون تحديد)
-                    if is_light_color(fill_color):
-                        rect = drawing.get('rect')
-                        if rect:
-                            # توسيع المنطقة قليلاً
-                            expanded_rect = fitz.Rect(
-                                rect[0] - 2, rect[1] - 2,
-                                rect[2] + 2, rect[3] + 2
-                            )
-                            
-                            text = page.get_textbox(expanded_rect)
-                            
-                            if text and text.strip():
-                                extract_info = {
-                                    'page': page_num + 1,
-                                    'text': text.strip(),
-                                    'method': 'Drawing',
-                                    'color': fill_color,
-                                    'rect': rect
-                                }
-                                extracts.append(extract_info)
-                                found += 1
-                                print(f"    ✓ Page {page_num + 1}: {text[:50]}...")
-                                
-        except Exception as e:
-            print(f"    ✗ Error in drawings page {page_num + 1}: {e}")
+            for name, detector in detectors:
+                with profiling.detector(name):
+                    found = detector(context)
+                page_extracts.extend(found)
+                counts[name] += len(found)
+        
+        for name, value in context.stats.items():
+            counts[name] = counts.get(name, 0) + value
+        
+        # Release the page and its parsed text before the consumer gets the results
+        context = None
+        yield page_extracts
+
+
+def extract_incremental(doc, pdf_path, extracts, cache, detectors=None, options=None):
+    """
+    Like run_detectors, but reuse cached results of pages unchanged since the last run
     
-    return found
+    Returns:
+        dict: Number of results per detector name
+    """
+    counts = {}
+    for page_extracts in iter_incremental(doc, pdf_path, cache, detectors, options, counts):
+        extracts.extend(page_extracts)
+    return counts
+
+
+def iter_incremental(doc, pdf_path, cache, detectors=None, options=None, counts=None):
+    """
+    Like extract_incremental, but yield the results of each page as soon as it is done
+    
+    Yields:
+        list: Results of one page, in page order
+    """
+    if detectors is None:
+        detectors = DETECTORS
+    if counts is None:
+        counts = {}
+    
+    def extract_page(page_num):
+        page_counts = {}
+        page_extracts = next(iter_detectors(doc, detectors, [page_num], page_counts))
+        return page_extracts, page_counts
+    
+    for name, _ in detectors:
+        counts.setdefault(name, 0)
+    
+    options = dict(options or {}, detectors=[name for name, _ in detectors])
+    reused = 0
+    for (page_extracts, page_counts), from_cache in cache.iter_pages(
+            doc, pdf_path, 'enhanced', extract_page, options):
+        reused += from_cache
+        for name, found in page_counts.items():
+            counts[name] = counts.get(name, 0) + found
+        yield page_extracts
+    
+    if reused:
+        log.log(PROGRESS, "♻️  Reused results of %d unchanged page(s)", reused)
+
+
+def extract_from_annotations(doc, extracts):
+    """Extract from annotations"""
+    # Only visit pages that carry annotations at all
+    pages = annotated_pages(doc, ANNOTATION_TYPES)
+    if not pages:
+        return 0
+    return run_detectors(doc, extracts, [('Annotations', detect_annotations)], pages)['Annotations']
+
+
+def extract_from_drawings(doc, extracts):
+    """Extract from colored drawings"""
+    return run_detectors(doc, extracts, [('Colored drawings', detect_drawings)])['Colored drawings']
 
 
 def extract_colored_texts(doc, extracts):
     """Extract colored texts"""
-    found = 0
+    return run_detectors(doc, extracts, [('Colored texts', detect_colored_texts)])['Colored texts']
+
+
+def extract_comprehensive(doc, extracts):
+    """Comprehensive search for any distinctive content"""
+    return run_detectors(doc, extracts, [('Comprehensive search', detect_comprehensive)])['Comprehensive search']
+
+
+def detect_annotations(context):
+    """Find highlights stored as annotations on one page"""
+    extracts = []
+    page_num = context.page_num
     
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        
+    # Find the words under all annotations of the page in one batch
+    context.prepare_annotations(context.annots)
+    
+    for annot in context.annots:
         try:
-            text_dict = page.get_text("dict")
+            annot_type = annot.type[1] if len(annot.type) > 1 else annot.type[0]
             
-            for block in text_dict.get("blocks", []):
-                if "lines" in block:
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            # التحقق من وجود لون مختلف
-                            if span.get("color", 0) != 0 or span.get("flags", 0) != 0:
-                                text = span.get("text", "").strip()
-                                
-                                if text and len(text) > 3:  # نص ذو معنى
-                                    extract_info = {
-                                        'page': page_num + 1,
-                                        'text': text,
-                                        'method': 'ColoredText',
-                                        'color': span.get("color", 0),
-                                        'flags': span.get("flags", 0),
-                                        'rect': span.get("bbox", [])
-                                    }
-                                    extracts.append(extract_info)
-                                    found += 1
-                                    print(f"    ✓ Page {page_num + 1}: {text[:50]}...")
-                                    
+            # Accept all annotation types that might contain highlights
+            if annot_type in ANNOTATION_TYPES:
+                
+                text = extract_text_from_annotation(context.page, annot, context)
+                
+                if text and text.strip():
+                    extract_info = {
+                        'page': page_num + 1,
+                        'text': text.strip(),
+                        'method': f'Annotation-{annot_type}',
+                        'color': get_annotation_color(annot),
+                        'rect': list(annot.rect),
+                        'quads': [list(quad) for quad in quad_rects(annot)]
+                    }
+                    extracts.append(extract_info)
+                    log.debug("    ✓ Page %d: %.50s...", page_num + 1, text)
+        
         except Exception as e:
-            print(f"    ✗ Error in colored texts page {page_num + 1}: {e}")
+            log.warning("    ✗ Error in annotation: %s", e)
     
-    return found
+    return extracts
 
 
-def extract_comprehensive(doc, extracts):
-    """Comprehensive search for any distinctive content"""
-    found = 0
+def detect_drawings(context):
+    """Find highlights drawn as colored shapes on one page"""
+    extracts = []
+    page_num = context.page_num
     
-    for page_num in range(len(doc)):
-        page = doc[page_num]
+    try:
+        candidates = []
+        rejected = 0
+        for drawing in context.drawings:
+            if 'fill' in drawing and drawing['fill']:
+                fill_color = drawing['fill']
+                
+                # التحقق من أن اللون فاتح (قد يكون تحديد)
+                if is_light_color(fill_color):
+                    # Backgrounds, table cells and grey boxes are not highlights
+                    if reject_reason(drawing, context.page.rect, context.line_height):
+                        rejected += 1
+                        continue
+                    
+                    rect = drawing.get('rect')
+                    if rect:
+                        # توسيع المنطقة قليلاً
+                        expanded_rect = fitz.Rect(
+                            rect[0] - 2, rect[1] - 2,
+                            rect[2] + 2, rect[3] + 2
+                        )
+                        candidates.append((rect, expanded_rect, fill_color))
         
-        try:
-            # Search for text in specific areas (might be highlighted)
-            words = page.get_text("words")
+        context.stats['Rejected drawings'] = rejected
+        
+        # Find the words under all candidate shapes in one batch
+        context.prepare([expanded_rect for _, expanded_rect, _ in candidates])
+        
+        for rect, expanded_rect, fill_color in candidates:
+            # Skip shapes with no words under them
+            if not context.has_text(expanded_rect):
+                continue
             
-            # Group adjacent words
-            lines = []
-            current_line = []
-            last_y = None
+            text = context.textbox(expanded_rect)
             
-            for word in words:
-                x0, y0, x1, y1, text, block_no, line_no, word_no = word
-                
-                if last_y is None or abs(y0 - last_y) < 5:  # Same line approximately
-                    current_line.append(text)
-                else:
-                    if current_line:
-                        lines.append(" ".join(current_line))
-                    current_line = [text]
+            if text and text.strip():
+                extract_info = {
+                    'page': page_num + 1,
+                    'text': text.strip(),
+                    'method': 'Drawing',
+                    'color': fill_color,
+                    'rect': list(rect)
+                }
+                extracts.append(extract_info)
+                log.debug("    ✓ Page %d: %.50s...", page_num + 1, text)
+    
+    except Exception as e:
+        log.warning("    ✗ Error in drawings page %d: %s", page_num + 1, e)
+    
+    return extracts
+
+
+def detect_colored_texts(context):
+    """Find colored or formatted text spans on one page"""
+    extracts = []
+    page_num = context.page_num
+    
+    try:
+        for span in context.spans:
+            # التحقق من وجود لون مختلف
+            if span.get("color", 0) != 0 or span.get("flags", 0) != 0:
+                text = span.get("text", "").strip()
                 
-                last_y = y0
-            
-            if current_line:
-                lines.append(" ".join(current_line))
-            
-            # Search for important lines (might be highlighted)
-            for line_text in lines:
-                if (len(line_text) > 10 and 
-                    (any(keyword in line_text.lower() for keyword in 
-                     ['important', 'note', 'key', 'main', 'primary', 'essential']) or
-                     line_text.isupper() or  # Text in uppercase
-                     line_text.count('*') > 0 or  # Contains asterisks
-                     line_text.count('-') > 2)):  # Contains many dashes
-                    
+                if text and len(text) > 3:  # نص ذو معنى
                     extract_info = {
                         'page': page_num + 1,
-                        'text': line_text.strip(),
-                        'method': 'Comprehensive',
-                        'reason': 'Pattern-based detection'
+                        'text': text,
+                        'method': 'ColoredText',
+                        'color': span.get("color", 0),
+                        'flags': span.get("flags", 0),
+                        'rect': span.get("bbox", [])
                     }
                     extracts.append(extract_info)
-                    found += 1
-                    print(f"    ✓ Page {page_num + 1}: {line_text[:50]}...")
-                    
-        except Exception as e:
-            print(f"    ✗ Error in comprehensive search page {page_num + 1}: {e}")
+                    log.debug("    ✓ Page %d: %.50s...", page_num + 1, text)
+    
+    except Exception as e:
+        log.warning("    ✗ Error in colored texts page %d: %s", page_num + 1, e)
+    
+    return extracts
+
+
+def detect_comprehensive(context):
+    """Search one page for any distinctive content"""
+    extracts = []
+    page_num = context.page_num
+    
+    try:
+        # Search for text in specific areas (might be highlighted)
+        words = context.words
+        
+        # Group adjacent words
+        lines = []
+        current_line = []
+        last_y = None
+        
+        for word in words:
+            x0, y0, x1, y1, text, block_no, line_no, word_no = word
+            
+            if last_y is None or abs(y0 - last_y) < 5:  # Same line approximately
+                current_line.append(text)
+            else:
+                if current_line:
+                    lines.append(" ".join(current_line))
+                current_line = [text]
+            
+            last_y = y0
+        
+        if current_line:
+            lines.append(" ".join(current_line))
+        
+        # Search for important lines (might be highlighted)
+        for line_text in lines:
+            if (len(line_text) > 10 and 
+                (any(keyword in line_text.lower() for keyword in 
+                 ['important', 'note', 'key', 'main', 'primary', 'essential']) or
+                 line_text.isupper() or  # Text in uppercase
+                 line_text.count('*') > 0 or  # Contains asterisks
+                 line_text.count('-') > 2)):  # Contains many dashes
+                
+                extract_info = {
+                    'page': page_num + 1,
+                    'text': line_text.strip(),
+                    'method': 'Comprehensive',
+                    'reason': 'Pattern-based detection'
+                }
+                extracts.append(extract_info)
+                log.debug("    ✓ Page %d: %.50s...", page_num + 1, line_text)
+    
+    except Exception as e:
+        log.warning("    ✗ Error in comprehensive search page %d: %s", page_num + 1, e)
+    
+    return extracts
+
+
+def extract_from_raster(doc, extracts, dpi=None):
+    """Extract highlights flattened into the page image"""
+    name = 'Raster highlights'
+    return run_detectors(doc, extracts, [(name, raster_detector(dpi))])[name]
+
+
+def raster_detector(dpi=None):
+    """Detector finding highlights in a low-resolution rendering of each page"""
+    dpi = dpi or RASTER_DPI
+    
+    def detect(context):
+        return detect_raster(context, dpi)
+    
+    return detect
+
+
+def detect_raster(context, dpi=None):
+    """
+    Find highlights that are part of the page image on one page
+    
+    Renders only the text-bearing area of the page at a low resolution,
+    builds a highlighter-colour mask with NumPy and maps its connected
+    regions back to the words underneath.
+    """
+    extracts = []
+    page_num = context.page_num
+    dpi = dpi or RASTER_DPI
+    
+    if np is None:
+        context.stats['Raster skipped (NumPy missing)'] = 1
+        return extracts
     
-    return found
+    try:
+        # Only render the area that carries text
+        text_blocks = [block["bbox"] for block in context.text_dict.get("blocks", []) if "lines" in block]
+        if not text_blocks:
+            return extracts
+        clip = fitz.Rect(text_blocks[0])
+        for bbox in text_blocks[1:]:
+            clip |= bbox
+        
+        with profiling.stage('render'):
+            pix = context.page.get_pixmap(dpi=dpi, clip=clip, annots=False,
+                                          colorspace=fitz.csRGB, alpha=False)
+        pixels = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+        mask = highlight_mask(pixels[:, :, :3])
+        
+        # Pixel coordinates back to page coordinates
+        zoom = dpi / 72
+        line_height = context.line_height or DEFAULT_LINE_HEIGHT
+        regions = []
+        
+        for x0, y0, x1, y1, count in connected_regions(mask):
+            rect = fitz.Rect((pix.x + x0) / zoom, (pix.y + y0) / zoom,
+                             (pix.x + x1) / zoom, (pix.y + y1) / zoom)
+            
+            # Highlights are solid strips about a line high; coloured glyphs are not
+            if (rect.height < 0.7 * line_height or rect.width < line_height or
+                    count < RASTER_MIN_FILL * (x1 - x0) * (y1 - y0)):
+                continue
+            
+            color = tuple(round(float(c) / 255, 2)
+                          for c in pixels[y0:y1, x0:x1, :3][mask[y0:y1, x0:x1]].mean(axis=0))
+            regions.append((rect, color))
+        
+        # Find the words under all regions in one batch
+        context.prepare([rect for rect, _ in regions])
+        
+        for rect, color in regions:
+            text = " ".join(word[4] for word in context.words_in_quads([rect]))
+            
+            if text.strip():
+                extract_info = {
+                    'page': page_num + 1,
+                    'text': text.strip(),
+                    'method': 'Raster',
+                    'color': color,
+                    'rect': list(rect)
+                }
+                extracts.append(extract_info)
+                log.debug("    ✓ Page %d: %.50s...", page_num + 1, text)
+    
+    except Exception as e:
+        log.warning("    ✗ Error in raster search page %d: %s", page_num + 1, e)
+    
+    return extracts
+
+
+def highlight_mask(rgb):
+    """Boolean mask of bright, saturated pixels (vectorized HSV thresholds; any hue)"""
+    rgb = rgb.astype(np.float32) / 255
+    maxc = rgb.max(axis=2)
+    minc = rgb.min(axis=2)
+    saturation = np.where(maxc > 0, (maxc - minc) / np.maximum(maxc, 1e-6), 0)
+    
+    return (saturation >= RASTER_MIN_SATURATION) & (maxc >= RASTER_MIN_VALUE)
+
+
+def connected_regions(mask):
+    """
+    Bounding boxes of the 8-connected regions of a boolean mask
+    
+    Returns:
+        list: (x0, y0, x1, y1, pixel_count) per region, in pixel coordinates
+    """
+    parent = []
+    
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    
+    # Runs of set pixels per row: (row, start, stop, label)
+    runs = []
+    previous = []
+    
+    for y, row in enumerate(mask):
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], row.view(np.int8), [0]))))
+        current = []
+        for start, stop in zip(edges[::2], edges[1::2]):
+            label = len(parent)
+            parent.append(label)
+            # Runs touching (including diagonally) a run of the previous row join its region
+            for p_start, p_stop, p_label in previous:
+                if p_start <= stop and start <= p_stop:
+                    root, other = find(label), find(p_label)
+                    if root != other:
+                        parent[other] = root
+            current.append((start, stop, label))
+            runs.append((y, start, stop, label))
+        previous = current
+    
+    regions = {}
+    for y, start, stop, label in runs:
+        root = find(label)
+        if root in regions:
+            x0, y0, x1, y1, count = regions[root]
+            regions[root] = (min(x0, start), y0, max(x1, stop), y + 1, count + stop - start)
+        else:
+            regions[root] = (start, y, stop, y + 1, stop - start)
+    
+    return [tuple(int(v) for v in region) for region in regions.values()]
+
+
+# Detectors run by extract_all_highlights, in the order they are applied to each page
+DETECTORS = [
+    ('Annotations', detect_annotations),
+    ('Colored drawings', detect_drawings),
+    ('Colored texts', detect_colored_texts),
+    ('Comprehensive search', detect_comprehensive),
+]
 
 
-def extract_text_from_annotation(page, annot):
+def extract_text_from_annotation(page, annot, page_text=None):
     """Extract text from annotation using multiple methods"""
     
+    if page_text is None:
+        page_text = PageText(page)
+    
+    # Method 0: Words inside the highlight's quad points (exact lines only)
+    text = page_text.quad_text(annot)
+    if text:
+        return text
+    
     rect = annot.rect
     
     # Method 1: Direct text
-    text = page.get_textbox(rect)
+    text = page_text.textbox(rect)
     if text and text.strip():
         return text
     
     # Method 2: Expand area
     expanded_rect = fitz.Rect(rect.x0 - 3, rect.y0 - 3, rect.x1 + 3, rect.y1 + 3)
-    text = page.get_textbox(expanded_rect)
+    text = page_text.textbox(expanded_rect)
     if text and text.strip():
         return text
     
     # Method 3: Extract overlapping words
-    words = page.get_text("words")
     overlapping_text = ""
     
-    for word in words:
-        word_rect = fitz.Rect(word[:4])
-        if word_rect.intersects(rect):
-            overlapping_text += word[4] + " "
+    for word in page_text.words_intersecting(rect):
+        overlapping_text += word[4] + " "
     
     if overlapping_text.strip():
         return overlapping_text
@@ -388,81 +920,122 @@ def is_light_color(color):
 
 def remove_duplicates(extracts):
     """Remove duplicate entries"""
-    unique = []
-    seen_texts = set()
+    return list(iter_unique(extracts))
+
+
+def iter_unique(extracts, dedup=None):
+    """
+    Yield the entries of extracts that are not duplicates
     
-    for extract in extracts:
-        text_clean = extract['text'].strip().lower()
-        
-        # Ignore very short or duplicate texts
-        if len(text_clean) > 5 and text_clean not in seen_texts:
-            seen_texts.add(text_clean)
-            unique.append(extract)
+    Overlapping hits and near-duplicate texts are merged (see dedup.py).
+    Pass the same Deduplicator to successive calls to remove duplicates
+    across pages while they are still being extracted.
+    """
+    if dedup is None:
+        dedup = Deduplicator()
     
-    return unique
+    yield from dedup.add(extracts)
 
 
 def display_results(extracts):
     """Display results"""
+    # Nothing is formatted unless it will be shown
+    if not log.isEnabledFor(logging.INFO):
+        return
+    
     if not extracts:
-        print("\n❌ No highlighted text found in this file.")
+        log.info("\n❌ No highlighted text found in this file.")
         return
     
-    print(f"\n✅ Found {len(extracts)} highlighted text(s)!")
-    print("=" * 60)
+    log.info("\n✅ Found %d highlighted text(s)!", len(extracts))
+    log.info("=" * 60)
     
     for i, extract in enumerate(extracts, 1):
-        print(f"\n[{i}] Page {extract['page']} - Method: {extract['method']}")
-        print("-" * 50)
-        print(extract['text'])
+        log.info("\n[%d] Page %s - Method: %s", i, extract['page'], extract['method'])
+        log.info("-" * 50)
+        log.info("%s", extract['text'])
         if 'color' in extract and extract['color']:
-            print(f"Color: {extract['color']}")
+            log.info("Color: %s", extract['color'])
 
 
-def save_results(extracts, pdf_path, output_path):
-    """Save results to file"""
+def save_results(extracts, pdf_path, output_path, output_format=None, digest=None):
+    """Save results to file (digest: SHA-256 of the PDF if already known)"""
     try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write("Highlighted Text from PDF - Enhanced Version\n")
-            f.write("=" * 60 + "\n")
-            f.write(f"Source file: {os.path.basename(pdf_path)}\n")
-            f.write(f"Extraction date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"Number of extracted texts: {len(extracts)}\n")
-            f.write("=" * 60 + "\n\n")
-            
-            for i, extract in enumerate(extracts, 1):
-                f.write(f"[{i}] Page {extract['page']} - Method: {extract['method']}\n")
-                f.write("-" * 50 + "\n")
-                f.write(f"{extract['text']}\n")
-                if 'color' in extract and extract['color']:
-                    f.write(f"Color: {extract['color']}\n")
-                f.write("-" * 50 + "\n\n")
-        
-        print(f"\n💾 Results saved to: {output_path}")
+        with open_writer(output_path, pdf_path, True, output_format, digest) as writer:
+            for extract in extracts:
+                writer.write(extract)
         
+        log.log(PROGRESS, "\n💾 Results saved to: %s", output_path)
+    
     except Exception as e:
-        print(f"❌ Error saving file: {str(e)}")
+        log.error("❌ Error saving file: %s", e)
+
+
+def open_output(output_path, pdf_path, output_format=None, digest=None):
+    """Writer that saves results while they are extracted, or None if it cannot be opened"""
+    try:
+        return open_writer(output_path, pdf_path, True, output_format, digest)
+    except Exception as e:
+        log.error("❌ Error saving file: %s", e)
+        return None
+
+
+def close_output(writer, output_path):
+    """Finish a writer from open_output"""
+    try:
+        with profiling.stage('write'):
+            writer.close()
+        log.log(PROGRESS, "\n💾 Results saved to: %s", output_path)
+    except Exception as e:
+        log.error("❌ Error saving file: %s", e)
 
 
 def main():
     """Main function"""
-    print("🚀 PDF Highlight Extractor - Enhanced Version")
-    print("=" * 60)
+    # Records go to standard output, so everything else goes to stderr
+    if sys.argv[2:3] == [STDOUT]:
+        sys.stdout = sys.stderr
+    configure(mode_from_args(sys.argv))
+    
+    log.info("🚀 PDF Highlight Extractor - Enhanced Version")
+    log.info("=" * 60)
     
     if len(sys.argv) < 2:
         print("Usage:")
-        print(f"python {sys.argv[0]} <PDF_file_path> [output_file_path] [--debug]")
+        print(f"python {sys.argv[0]} <PDF_file_path> [output_file_path | -] [--format=jsonl|csv|txt|docx] [--debug] [--cache] [--raster] [--auto]")
+        print("                 [--quiet | --progress | --verbose] [--profile[=profile.json]] [--max-memory=MB]")
         print("\nOptions:")
         print("  --debug    Display detailed analysis of file structure")
+        print("  --cache    Reuse results from previous runs if the file is unchanged")
+        print("  --auto     Try every method on a sample of pages, then only run the productive ones")
+        print("  --raster   Also find highlights flattened into the page image (needs NumPy)")
+        print(f"  --raster-dpi=N  Rendering resolution for --raster (default {RASTER_DPI})")
+        print("  --max-memory=MB  Keep memory bounded on huge files: results move to a temporary")
+        print("             file near MB megabytes of resident memory; reports the peak")
+        print("  --format=F Output format (default from the file extension; JSONL for -)")
+        print("  -          Write records to standard output (messages go to stderr)")
+        print("  --quiet    Only show errors")
+        print("  --progress Only show file and page progress")
+        print("  --verbose  Also show every hit of every method")
+        print("  --profile  Time every stage, detector and page; print a summary and save")
+        print("             it as JSON (default <PDF name>_profile.json)")
         print("\nExamples:")
         print(f"python {sys.argv[0]} document.pdf")
         print(f"python {sys.argv[0]} document.pdf output.txt")
         print(f"python {sys.argv[0]} document.pdf output.txt --debug")
+        print(f"python {sys.argv[0]} document.pdf - --format=csv")
         return
     
     pdf_path = sys.argv[1]
     output_path = sys.argv[2] if len(sys.argv) > 2 and not sys.argv[2].startswith('--') else None
     debug_mode = '--debug' in sys.argv
+    cache = ResultCache() if '--cache' in sys.argv else None
+    auto = '--auto' in sys.argv
+    raster_dpi = next((int(arg.split('=', 1)[1]) for arg in sys.argv if arg.startswith('--raster-dpi=')), None)
+    raster = '--raster' in sys.argv or raster_dpi is not None
+    output_format = next((arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--format=')), None)
+    max_memory_mb = next((int(arg.split('=', 1)[1]) for arg in sys.argv if arg.startswith('--max-memory=')), None)
+    profile_path = profiling.path_from_args(sys.argv, pdf_path)
     
     # Run detailed analysis if requested
     if debug_mode:
@@ -470,13 +1043,24 @@ def main():
         print("\n" + "="*60 + "\n")
     
     # Run enhanced extraction
-    extracts = extract_all_highlights(pdf_path, output_path)
+    profiler = profiling.start(pdf_path) if profile_path else None
+    extracts = extract_all_highlights(pdf_path, output_path, cache, raster, raster_dpi, output_format, auto,
+                                      max_memory_mb)
+    
+    if profiler:
+        profiling.stop()
+        profiler.save(profile_path)
+        print("\n" + "\n".join(profiler.summary()))
+        print(f"\n⏱️  Profile saved to: {profile_path}")
+    
+    if cache:
+        cache.close()
     
     if extracts:
-        print(f"\n🎉 Completed successfully! Extracted {len(extracts)} text(s).")
+        log.log(PROGRESS, "\n🎉 Completed successfully! Extracted %d text(s).", len(extracts))
     else:
-        print("\n😔 No highlighted text found.")
-        print("💡 Try using the --debug option to analyze file structure")
+        log.log(PROGRESS, "\n😔 No highlighted text found.")
+        log.info("💡 Try using the --debug option to analyze file structure")
 
 
 if __name__ == "__main__":
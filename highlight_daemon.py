@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local extraction daemon with a warm worker pool
+
+Keeps worker processes with PyMuPDF and the extractors already loaded, so
+a request only pays for the extraction itself. Listens on localhost HTTP
+(or a Unix socket) and streams the records back as JSON lines while the
+pages are processed:
+    
+    python highlight_daemon.py --port 8765 -j 4
+    
+    curl -s localhost:8765/extract -d '{"path": "/abs/path/book.pdf"}'
+    curl -s "localhost:8765/extract?name=book.pdf&method=simple" \\
+         -H "Content-Type: application/pdf" --data-binary @book.pdf
+    curl -s localhost:8765/health
+
+POST /extract takes either a JSON job {"path", "method", "raster",
+"raster_dpi", "auto", "timeout"} or the PDF bytes themselves (any body
+starting with %PDF), with the same options in the query string. Every response line is a record in the
+SCHEMA_FIELDS layout of writers.py, except the last one, which is
+{"status": "done", "count": ..., "seconds": ...} or {"status": "error",
+"error": ..., "count": ...}.
+
+At most WORKERS jobs run at a time; up to --max-queue more wait for a free
+worker, further requests are refused with 503. A job that runs longer than
+its timeout has its worker process replaced.
+"""
+
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import get_context
+from urllib.parse import parse_qs, urlsplit
+
+from lazy_modules import lazy_import
+from logs import PROGRESS, configure, get_logger
+from result_cache import ResultCache, file_digest
+
+log = get_logger('daemon')
+
+
+DEFAULT_PORT = 8765
+
+# Requests allowed to wait for a worker before new ones are refused
+DEFAULT_MAX_QUEUE = 32
+
+# Seconds a job may run before its worker is replaced
+DEFAULT_TIMEOUT = 300
+
+# Largest PDF accepted as request body
+MAX_UPLOAD_BYTES = 512 * 1024 * 1024
+
+METHODS = ('enhanced', 'simple')
+
+
+class QueueFull(Exception):
+    """All workers are busy and the wait queue is full"""
+
+
+class JobError(Exception):
+    """The extraction of a job failed in the worker"""
+
+
+def warm_up():
+    """Load PyMuPDF, NumPy and the extractors before the first job"""
+    import highlights
+    
+    fitz = lazy_import('fitz')
+    fitz.Rect()
+    np = lazy_import('numpy', optional=True)
+    if np is not None:
+        np.zeros(1)
+    return highlights
+
+
+def serve_jobs(conn, cache_dir=None, use_cache=True):
+    """
+    Worker process: run the jobs received on conn until it is closed
+    
+    Sends ('records', rows) once per page with highlights, then ('done',
+    count) or ('error', message).
+    """
+    from writers import schema_record
+    
+    highlights = warm_up()
+    cache = ResultCache(cache_dir) if use_cache else None
+    conn.send(('ready', os.getpid()))
+    
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        
+        try:
+            path = job['path']
+            source = job.get('name') or os.path.basename(path)
+            settings = (job.get('method', 'enhanced'), job.get('raster', False), job.get('raster_dpi'),
+                       job.get('auto', False))
+            if job.get('upload'):
+                digest = file_digest(path)
+                records = iter_upload(highlights, path, digest, cache, *settings)
+            else:
+                digest = cache.digest(path) if cache else file_digest(path)
+                records = highlights.iter_highlights(path, settings[0], cache, *settings[1:])
+            
+            count = 0
+            rows = []
+            for record in records:
+                if rows and rows[-1]['page'] != record['page']:
+                    conn.send(('records', rows))
+                    rows = []
+                rows.append(schema_record(record, source, digest))
+                count += 1
+            if rows:
+                conn.send(('records', rows))
+            conn.send(('done', count))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+    
+    if cache:
+        cache.close()
+
+
+def iter_upload(highlights, path, digest, cache, method='enhanced', raster=False, raster_dpi=None,
+                auto=False):
+    """
+    iter_highlights for an uploaded PDF, cached by its content only
+    
+    Uploads are saved under a random temporary name, so per-page results
+    keyed by their path could never be reused; only the records of the
+    whole file are stored, under its digest.
+    """
+    import enhanced_extractor
+    
+    options = None if method == 'simple' else enhanced_extractor.select_detectors(raster, raster_dpi, auto)[1]
+    cached = cache.lookup(digest, method, options) if cache else None
+    if cached is not None:
+        yield from cached
+        return
+    
+    records = []
+    for record in highlights.iter_highlights(path, method, None, raster, raster_dpi, auto):
+        records.append(record)
+        yield record
+    if cache:
+        cache.store(digest, method, records, options)
+
+
+class Worker:
+    """One warm worker process and its end of the pipe"""
+    
+    def __init__(self, context, cache_dir=None, use_cache=True):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=serve_jobs, args=(child_conn, cache_dir, use_cache),
+                                       daemon=True)
+        self.process.start()
+        child_conn.close()
+    
+    def wait_ready(self, timeout):
+        """Wait until the worker has loaded everything, return False if it did not in time"""
+        return self.conn.poll(timeout) and self.conn.recv()[0] == 'ready'
+    
+    def stop(self):
+        """Ask the worker to exit"""
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+    
+    def kill(self):
+        """End the worker immediately, e.g. in the middle of a job"""
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    """
+    Fixed number of warm workers with a bounded wait queue
+    
+    run() hands a job to the next free worker and yields the record batches
+    it sends back. Workers that time out, crash or are abandoned by their
+    client in the middle of a job are replaced by fresh ones.
+    """
+    
+    def __init__(self, workers=None, max_queue=DEFAULT_MAX_QUEUE, timeout=DEFAULT_TIMEOUT,
+                 cache_dir=None, use_cache=True):
+        self.size = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._context = get_context('spawn')
+        self._worker_args = (cache_dir, use_cache)
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        
+        workers = [Worker(self._context, *self._worker_args) for _ in range(self.size)]
+        for worker in workers:
+            if not worker.wait_ready(60):
+                raise RuntimeError(f"Worker process {worker.process.pid} did not start")
+            self._idle.put(worker)
+    
+    @property
+    def busy(self):
+        return self.size - self._idle.qsize()
+    
+    def status(self):
+        """Counters for the health endpoint"""
+        return {
+            'workers': self.size,
+            'busy': self.busy,
+            'waiting': self.waiting,
+            'completed': self.completed,
+            'failed': self.failed,
+        }
+    
+    def run(self, job, timeout=None):
+        """
+        Run one job on a free worker
+        
+        Args:
+            job (dict): 'path' and the iter_highlights options
+            timeout (float): Seconds the job may run (default: the pool's)
+        
+        Yields:
+            list: Schema records of one page
+        
+        Raises:
+            QueueFull: When max_queue jobs are already waiting
+            TimeoutError: When the job ran out of time
+            JobError: When the extraction failed
+        """
+        with self._lock:
+            if self.busy >= self.size and self.waiting >= self.max_queue:
+                raise QueueFull(f"{self.size} jobs running and {self.waiting} waiting")
+            self.waiting += 1
+        try:
+            worker = self._idle.get()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        
+        timeout = min(timeout or self.timeout, self.timeout)
+        deadline = time.monotonic() + timeout
+        reusable = False
+        try:
+            worker.conn.send(job)
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not worker.conn.poll(remaining):
+                    raise TimeoutError(f"Extraction did not finish within {timeout:g} s")
+                kind, value = worker.conn.recv()
+                if kind == 'records':
+                    yield value
+                    continue
+                reusable = True
+                if kind == 'error':
+                    raise JobError(value)
+                return
+        except EOFError:
+            raise JobError("Worker process exited during the extraction")
+        finally:
+            if reusable:
+                self.completed += 1
+                self._idle.put(worker)
+            else:
+                self.failed += 1
+                worker.kill()
+                log.info("Replacing worker process %s", worker.process.pid)
+                # The new worker warms up in the background, the response need not wait
+                threading.Thread(target=self._replace, daemon=True).start()
+    
+    def _replace(self):
+        """Start a worker and make it available once it is ready"""
+        worker = Worker(self._context, *self._worker_args)
+        worker.wait_ready(60)
+        self._idle.put(worker)
+    
+    def close(self):
+        """Stop all idle workers (busy ones exit with the daemon)"""
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
+            worker.process.join(5)
+
+
+def _flag(value):
+    """Boolean option from JSON or a query string"""
+    if isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def parse_job(options):
+    """
+    Job options of a request, checked
+    
+    Returns:
+        dict: 'method', 'raster', 'raster_dpi', 'auto' and 'timeout'
+    
+    Raises:
+        ValueError: For an unknown method or a non-numeric value
+    """
+    method = options.get('method') or 'enhanced'
+    if method not in METHODS:
+        raise ValueError(f"Unknown method: {method} (use {', '.join(METHODS)})")
+    raster_dpi = options.get('raster_dpi')
+    timeout = options.get('timeout')
+    return {
+        'method': method,
+        'raster': _flag(options.get('raster', False)) or raster_dpi is not None,
+        'raster_dpi': int(raster_dpi) if raster_dpi is not None else None,
+        'auto': _flag(options.get('auto', False)),
+        'timeout': float(timeout) if timeout is not None else None,
+    }
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """GET /health and POST /extract; self.server.pool is the WorkerPool"""
+    
+    protocol_version = 'HTTP/1.1'
+    
+    def log_message(self, format, *args):
+        log.debug("%s %s", self.address_string(), format % args)
+    
+    def address_string(self):
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'local'
+    
+    def send_json(self, status, data):
+        body = (json.dumps(data) + "\n").encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_lines(self, rows):
+        """Write JSON lines as one chunk of the response"""
+        data = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows).encode('utf-8')
+        self.wfile.write(f"{len(data):X}\r\n".encode('ascii') + data + b"\r\n")
+        self.wfile.flush()
+    
+    def do_GET(self):
+        if urlsplit(self.path).path == '/health':
+            self.send_json(200, dict(self.server.pool.status(), status='ok'))
+        else:
+            self.send_json(404, {'status': 'error', 'error': "Not found"})
+    
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/extract':
+            self.close_connection = True
+            self.send_json(404, {'status': 'error', 'error': "Not found"})
+            return
+        
+        upload = None
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > MAX_UPLOAD_BYTES:
+                self.send_json(413, {'status': 'error', 'error': "PDF too large"})
+                self.close_connection = True
+                return
+            body = self.rfile.read(length)
+            
+            if not body.startswith(b'%PDF'):
+                options = json.loads(body or b'{}')
+                if not isinstance(options, dict):
+                    raise ValueError("Expected a JSON object or a PDF")
+                path = options.get('path')
+                if not path or not os.path.isfile(path):
+                    raise ValueError(f"File not found: {path}")
+                name = options.get('name') or os.path.basename(path)
+            else:
+                # The PDF itself; options come from the query string
+                options = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                upload = tempfile.NamedTemporaryFile(suffix='.pdf', delete=False)
+                upload.write(body)
+                upload.close()
+                path = upload.name
+                name = options.get('name') or 'upload.pdf'
+            
+            job = parse_job(options)
+        except ValueError as e:
+            self.send_json(400, {'status': 'error', 'error': str(e)})
+            self._remove(upload)
+            return
+        
+        try:
+            self.stream_job(dict(job, path=os.path.abspath(path), name=name, upload=upload is not None))
+        finally:
+            self._remove(upload)
+    
+    def stream_job(self, job):
+        """Run a job and stream its records, with the status as the last line"""
+        started = time.perf_counter()
+        count = 0
+        batches = self.server.pool.run(job, job.pop('timeout'))
+        
+        # Errors before the first record still get a proper status code
+        try:
+            first = next(batches, [])
+        except QueueFull as e:
+            self.send_json(503, {'status': 'error', 'error': f"Busy: {e}"})
+            return
+        except TimeoutError as e:
+            self.send_json(504, {'status': 'error', 'error': str(e), 'count': 0})
+            return
+        except JobError as e:
+            self.send_json(422, {'status': 'error', 'error': str(e), 'count': 0})
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        
+        status = {'status': 'done'}
+        try:
+            rows = first
+            while True:
+                if rows:
+                    self.send_lines(rows)
+                    count += len(rows)
+                rows = next(batches, None)
+                if rows is None:
+                    break
+        except (TimeoutError, JobError) as e:
+            status = {'status': 'error', 'error': str(e)}
+        except OSError:
+            # Client went away; closing the generator replaces the busy worker
+            batches.close()
+            log.info("Client disconnected from %s", job['name'])
+            return
+        
+        status.update(count=count, seconds=round(time.perf_counter() - started, 6))
+        self.send_lines([status])
+        self.wfile.write(b"0\r\n\r\n")
+        log.log(PROGRESS, "%s: %d highlight(s) in %.3f s%s", job['name'], count, status['seconds'],
+                f" ({status['error']})" if 'error' in status else "")
+    
+    @staticmethod
+    def _remove(upload):
+        if upload is not None and os.path.exists(upload.name):
+            os.remove(upload.name)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP over a Unix socket, one thread per connection"""
+    
+    daemon_threads = True
+
+
+def make_server(pool, host='127.0.0.1', port=DEFAULT_PORT, socket_path=None):
+    """HTTP server for the pool, on host:port or on a Unix socket"""
+    if socket_path:
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ValueError("Unix sockets are not available on this system")
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, RequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.pool = pool
+    return server
+
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(
+        description="Serve highlight extraction from warm worker processes")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help=f"Port to listen on (default: {DEFAULT_PORT})")
+    parser.add_argument('--socket', metavar='PATH', default=None,
+                        help="Listen on this Unix socket instead of a TCP port")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="Number of worker processes, i.e. concurrent jobs (default: number of cores)")
+    parser.add_argument('--max-queue', type=int, default=DEFAULT_MAX_QUEUE,
+                        help=f"Jobs that may wait for a worker before requests are refused "
+                             f"(default: {DEFAULT_MAX_QUEUE})")
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT,
+                        help=f"Seconds a job may run (default: {DEFAULT_TIMEOUT})")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Re-extract every file instead of reusing cached results")
+    parser.add_argument('--cache-dir', default=None,
+                        help="Result cache directory (default: ~/.cache/pdf_highlight_extractor)")
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help="Only show errors")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="Also log every request")
+    args = parser.parse_args()
+    
+    configure('quiet' if args.quiet else 'verbose' if args.verbose else 'progress')
+    
+    log.log(PROGRESS, "🚀 Starting %s worker process(es)...", args.workers or os.cpu_count())
+    pool = WorkerPool(args.workers, args.max_queue, args.timeout,
+                      cache_dir=args.cache_dir, use_cache=not args.no_cache)
+    server = make_server(pool, args.host, args.port, args.socket)
+    log.log(PROGRESS, "✅ Listening on %s", args.socket or f"http://{args.host}:{args.port}")
+    
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
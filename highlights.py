@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Streaming highlight API
+
+iter_highlights() yields highlight records while the document is still
+being processed, one page at a time, so the first results are available
+after the first page and memory does not grow with the document:
+    
+    from highlights import iter_highlights
+    from writers import write_highlights
+    
+    for record in iter_highlights("book.pdf"):
+        print(record['page'], record['text'])
+    
+    write_highlights(iter_highlights("book.pdf"), "book.pdf", "book.jsonl")
+"""
+
+import enhanced_extractor
+import simple_extractor
+from dedup import Deduplicator
+from lazy_modules import lazy_import
+
+fitz = lazy_import('fitz')  # PyMuPDF
+
+
+def iter_highlights(pdf_path, method='enhanced', cache=None, raster=False, raster_dpi=None, auto=False):
+    """
+    Yield the highlight records of a PDF page by page
+    
+    Args:
+        pdf_path (str): PDF file path
+        method (str): 'enhanced' (all detectors, duplicates removed) or 'simple'
+        cache (ResultCache): Result cache to read from and update (optional).
+            Records are then also kept in memory until the document is done,
+            to store them in the cache.
+        raster (bool): Also search page renderings for flattened highlights (enhanced only)
+        raster_dpi (int): Rendering resolution for the raster search
+        auto (bool): Only run the detectors that are productive on a sample
+            of pages (enhanced only)
+    
+    Yields:
+        dict: One record per highlight, in page order, in the same format as
+            extract_all_highlights / extract_yellow_highlights return
+    """
+    if method == 'simple':
+        options = None
+    else:
+        detectors, options = enhanced_extractor.select_detectors(raster, raster_dpi, auto)
+    
+    if cache:
+        cached = cache.get(pdf_path, method, options)
+        if cached is not None:
+            yield from cached
+            return
+    
+    records = [] if cache else None
+    
+    with fitz.open(pdf_path) as doc:
+        if auto and method != 'simple':
+            detectors = enhanced_extractor.choose_detectors(doc, detectors)
+        
+        if method == 'simple':
+            pages = simple_extractor.iter_page_highlights(doc, pdf_path, cache)
+        elif cache:
+            pages = enhanced_extractor.iter_incremental(doc, pdf_path, cache, detectors, options)
+        else:
+            pages = enhanced_extractor.iter_detectors(doc, detectors)
+        
+        dedup = Deduplicator()
+        for page_records in pages:
+            if method != 'simple':
+                page_records = enhanced_extractor.iter_unique(page_records, dedup)
+            for record in page_records:
+                if records is not None:
+                    records.append(record)
+                yield record
+    
+    if cache:
+        cache.put(pdf_path, method, records, options)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Deferred imports of the heavy dependencies
+
+PyMuPDF and NumPy take a large share of the start-up time of a short
+extraction process. The modules bind them with lazy_import(), which returns
+the module object right away but only executes it on the first attribute
+access, e.g. the first fitz.open():
+    
+    fitz = lazy_import('fitz')
+    np = lazy_import('numpy', optional=True)   # None when not installed
+
+So argument errors, --help and cache hits never load them.
+"""
+
+import importlib.util
+import sys
+
+
+def lazy_import(name, optional=False):
+    """
+    Module that is loaded on first use
+    
+    Args:
+        name (str): Top-level module name
+        optional (bool): Return None instead of raising ImportError when the
+            module is not installed
+    
+    Returns:
+        module: The module (already loaded if it was imported before), or None
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        if optional:
+            return None
+        raise ImportError(f"No module named '{name}'", name=name)
+    
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Leveled logging for the highlight extractors
+
+The extractors report through the "pdf_highlights" logger instead of
+print(), so the amount of output can be chosen per run:
+    
+    quiet      errors only
+    progress   file and page progress, no per-highlight output
+    normal     progress plus the extracted texts and statistics
+    verbose    everything, including every annotation and detector hit
+
+Messages pass their values as %-style arguments, so text previews are only
+formatted when the message is actually shown. Without configure() (e.g.
+when the extractors are used as a library) only errors are printed.
+"""
+
+import logging
+import sys
+
+
+# Between INFO and WARNING, so progress mode can hide the INFO output
+PROGRESS = 25
+logging.addLevelName(PROGRESS, "PROGRESS")
+
+LOGGER_NAME = "pdf_highlights"
+
+MODES = {
+    'quiet': logging.WARNING,
+    'progress': PROGRESS,
+    'normal': logging.INFO,
+    'verbose': logging.DEBUG,
+}
+
+
+def get_logger(name):
+    """Logger of one extractor module"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def configure(mode='normal', stream=None):
+    """
+    Show extractor messages of the given mode
+    
+    Args:
+        mode (str): 'quiet', 'progress', 'normal' or 'verbose'
+        stream: Output stream (default sys.stdout at the time of the call)
+    
+    Returns:
+        logging.Logger: The configured parent logger
+    """
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(MODES[mode])
+    
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(handler)
+    logger.propagate = False
+    
+    return logger
+
+
+def mode_from_args(args, default='normal'):
+    """Mode chosen with --quiet, --progress or --verbose in a list of arguments"""
+    for mode in ('quiet', 'progress', 'verbose'):
+        if f'--{mode}' in args:
+            return mode
+    return default
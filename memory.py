@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Memory accounting for bounded-memory extraction
+
+With a memory ceiling, the extractors collect their results in a
+RecordSpool instead of a list. The spool samples the resident memory of
+the process after every page; once it reaches SPILL_FRACTION of the
+ceiling, the records move to a temporary file and later ones follow in
+batches, so the results of a long document no longer grow the process.
+"""
+
+import os
+import pickle
+import re
+import sys
+import tempfile
+
+try:
+    import resource
+except ImportError:  # Not available on Windows, memory is then not reported
+    resource = None
+
+
+# Records are spilled once resident memory reaches this share of the ceiling
+SPILL_FRACTION = 0.8
+
+# Records written to the temporary file at a time once spilling
+SPILL_BATCH = 500
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None if unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def current_rss_mb():
+    """Resident memory of this process in MB (the peak where the current value is unknown), or None"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024), 1)
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()
+
+
+def high_water_mb():
+    """Peak resident memory in MB since reset_high_water() (else since the start), or None"""
+    try:
+        with open('/proc/self/status') as f:
+            return round(int(re.search(r'VmHWM:\s+(\d+)', f.read()).group(1)) / 1024, 1)
+    except (OSError, AttributeError, ValueError):
+        return peak_rss_mb()
+
+
+def reset_high_water():
+    """Start a new peak measurement for high_water_mb() (Linux only)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+class RecordSpool:
+    """
+    List-like store of records that moves to disk when memory runs short
+    
+    Supports append(), extend(), len() and iteration (records in the order
+    they were added); iterate only once all records are in. Use it as a
+    context manager, or call close(), to delete the temporary file.
+    """
+    
+    def __init__(self, ceiling_mb):
+        self.ceiling_mb = ceiling_mb
+        reset_high_water()
+        self.peak_rss_mb = current_rss_mb()
+        self.spilled = 0
+        self._records = []
+        self._file = None
+    
+    def append(self, record):
+        self._records.append(record)
+    
+    def extend(self, records):
+        self._records.extend(records)
+    
+    def __len__(self):
+        return self.spilled + len(self._records)
+    
+    def __iter__(self):
+        if self._file is not None:
+            self._file.flush()
+            self._file.seek(0)
+            remaining = self.spilled
+            while remaining:
+                batch = pickle.load(self._file)
+                remaining -= len(batch)
+                yield from batch
+            self._file.seek(0, os.SEEK_END)
+        yield from self._records
+    
+    def check(self):
+        """Sample resident memory; spill the records once it nears the ceiling"""
+        rss = current_rss_mb()
+        if rss is None:
+            return
+        self.update_peak()
+        
+        spilling = self._file is not None or rss >= self.ceiling_mb * SPILL_FRACTION
+        if spilling and (self._file is None or len(self._records) >= SPILL_BATCH):
+            self.spill()
+    
+    def update_peak(self):
+        """Update peak_rss_mb, including peaks between samples where the system reports them"""
+        self.peak_rss_mb = max(self.peak_rss_mb or 0, high_water_mb() or 0, current_rss_mb() or 0)
+    
+    def spill(self):
+        """Move the records held in memory to the temporary file"""
+        if not self._records:
+            return
+        if self._file is None:
+            self._file = tempfile.TemporaryFile()
+        pickle.dump(self._records, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.spilled += len(self._records)
+        self._records = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        """Delete the temporary file"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._records = []
+        self.spilled = 0
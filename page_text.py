@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-page text model shared by the highlight extractors
+
+The text of a page is parsed at most once and reused by every annotation
+and every extraction method on that page. Create one PageText per page and
+drop it when moving to the next page.
+"""
+
+import math
+
+import profiling
+from lazy_modules import lazy_import
+
+fitz = lazy_import('fitz')  # PyMuPDF
+
+# Optional, only speeds up batched overlap queries
+np = lazy_import('numpy', optional=True)
+
+
+class SpatialIndex:
+    """Uniform grid over bounding boxes for fast rect-intersection queries"""
+    
+    def __init__(self, boxes):
+        self.boxes = [tuple(box[:4]) for box in boxes]
+        self.cells = {}
+        
+        sized = [(x1 - x0, y1 - y0) for x0, y0, x1, y1 in self.boxes if x0 < x1 and y0 < y1]
+        if not sized:
+            self.cell_w = self.cell_h = 1.0
+            return
+        
+        # Cells about twice the size of an average box keep buckets short
+        self.cell_w = max(2 * sum(w for w, _ in sized) / len(sized), 1.0)
+        self.cell_h = max(2 * sum(h for _, h in sized) / len(sized), 1.0)
+        
+        for i, (x0, y0, x1, y1) in enumerate(self.boxes):
+            # Empty boxes never intersect anything
+            if not (x0 < x1 and y0 < y1):
+                continue
+            for cell in self._cells_for(x0, y0, x1, y1):
+                self.cells.setdefault(cell, []).append(i)
+        
+        self.bounds = (
+            min(cx for cx, _ in self.cells),
+            min(cy for _, cy in self.cells),
+            max(cx for cx, _ in self.cells),
+            max(cy for _, cy in self.cells),
+        )
+    
+    def _cells_for(self, x0, y0, x1, y1):
+        """Grid cells covered by a box"""
+        cx0 = math.floor(x0 / self.cell_w)
+        cx1 = math.floor(x1 / self.cell_w)
+        cy0 = math.floor(y0 / self.cell_h)
+        cy1 = math.floor(y1 / self.cell_h)
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                yield (cx, cy)
+    
+    def query(self, rect):
+        """
+        Indices of boxes intersecting rect, in their original order
+        
+        Uses the same rule as fitz.Rect.intersects: both rectangles must be
+        non-empty and overlap with a positive area.
+        """
+        rect = fitz.Rect(rect)
+        if rect.is_empty or rect.is_infinite or not self.cells:
+            return []
+        rx0, ry0, rx1, ry1 = rect
+        
+        # Clamp the query to the indexed area so huge rects stay cheap
+        min_cx, min_cy, max_cx, max_cy = self.bounds
+        cx0 = max(math.floor(rx0 / self.cell_w), min_cx)
+        cx1 = min(math.floor(rx1 / self.cell_w), max_cx)
+        cy0 = max(math.floor(ry0 / self.cell_h), min_cy)
+        cy1 = min(math.floor(ry1 / self.cell_h), max_cy)
+        
+        found = set()
+        for cx in range(cx0, cx1 + 1):
+            for cy in range(cy0, cy1 + 1):
+                for i in self.cells.get((cx, cy), ()):
+                    if i in found:
+                        continue
+                    x0, y0, x1, y1 = self.boxes[i]
+                    if x0 < rx1 and rx0 < x1 and y0 < ry1 and ry0 < y1:
+                        found.add(i)
+        return sorted(found)
+
+
+# Share of a word's area that must lie inside a highlight quad
+QUAD_OVERLAP = 0.5
+
+# Annotation types whose vertices are quad points over the marked text
+TEXT_MARKUP_TYPES = ('Highlight', 'Underline', 'Squiggly', 'StrikeOut')
+
+
+def quad_rects(annot):
+    """
+    Rectangles of an annotation's quad points (one per highlighted line piece)
+    
+    Returns:
+        list: fitz.Rect per quad, empty if the annotation has no quad points
+    """
+    try:
+        if annot.type[1] not in TEXT_MARKUP_TYPES:
+            return []
+        vertices = annot.vertices
+    except Exception:
+        return []
+    if not vertices or len(vertices) % 4:
+        return []
+    return [fitz.Quad(vertices[i:i + 4]).rect for i in range(0, len(vertices), 4)]
+
+
+def overlap_ratio(box, rect):
+    """Share of box's area that lies inside rect"""
+    x0, y0, x1, y1 = box[:4]
+    area = (x1 - x0) * (y1 - y0)
+    if area <= 0:
+        return 0.0
+    width = min(x1, rect[2]) - max(x0, rect[0])
+    height = min(y1, rect[3]) - max(y0, rect[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    return width * height / area
+
+
+def overlap_matrix(boxes, rects):
+    """
+    Share of each box's area inside each rect, computed in one NumPy operation
+    
+    Args:
+        boxes: N boxes (x0, y0, x1, y1), e.g. word bboxes
+        rects: M rects (x0, y0, x1, y1), e.g. highlight rects or quads
+    
+    Returns:
+        numpy.ndarray: M x N matrix; a value > 0 means the box intersects the rect
+    """
+    b = np.asarray(boxes, dtype=float).reshape(-1, 4)
+    r = np.asarray(rects, dtype=float).reshape(-1, 4)
+    
+    width = np.minimum(b[None, :, 2], r[:, None, 2]) - np.maximum(b[None, :, 0], r[:, None, 0])
+    height = np.minimum(b[None, :, 3], r[:, None, 3]) - np.maximum(b[None, :, 1], r[:, None, 1])
+    inter = np.clip(width, 0, None) * np.clip(height, 0, None)
+    
+    valid = (b[:, 2] > b[:, 0]) & (b[:, 3] > b[:, 1])
+    area = np.where(valid, (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1]), 1.0)
+    return np.where(valid[None, :], inter / area[None, :], 0.0)
+
+
+class PageText:
+    """Lazily built text model of a single page (spans, lines, words, bboxes)"""
+    
+    def __init__(self, page):
+        self.page = page
+        self._textpage = None
+        self._textbox_page = None
+        self._text_dict = None
+        self._spans = None
+        self._lines = None
+        self._words = None
+        self._span_index = None
+        self._word_index = None
+        self._word_overlaps = {}
+    
+    @property
+    def textpage(self):
+        """TextPage shared by the dict and words views"""
+        if self._textpage is None:
+            with profiling.stage('get_textpage'):
+                self._textpage = self.page.get_textpage(flags=fitz.TEXTFLAGS_DICT)
+        return self._textpage
+    
+    @property
+    def text_dict(self):
+        """Output of page.get_text("dict")"""
+        if self._text_dict is None:
+            textpage = self.textpage
+            with profiling.stage('get_text("dict")'):
+                self._text_dict = self.page.get_text("dict", textpage=textpage)
+        return self._text_dict
+    
+    @property
+    def lines(self):
+        """All text lines of the page in reading order"""
+        if self._lines is None:
+            self._lines = [
+                line
+                for block in self.text_dict.get("blocks", [])
+                if "lines" in block
+                for line in block["lines"]
+            ]
+        return self._lines
+    
+    @property
+    def spans(self):
+        """All text spans of the page in reading order"""
+        if self._spans is None:
+            self._spans = [span for line in self.lines for span in line["spans"]]
+        return self._spans
+    
+    @property
+    def line_height(self):
+        """Median height of the page's text lines, or None if it has none"""
+        heights = sorted(line["bbox"][3] - line["bbox"][1] for line in self.lines)
+        if not heights:
+            return None
+        return heights[len(heights) // 2]
+    
+    @property
+    def words(self):
+        """Output of page.get_text("words")"""
+        if self._words is None:
+            textpage = self.textpage
+            with profiling.stage('get_text("words")'):
+                self._words = self.page.get_text("words", textpage=textpage)
+        return self._words
+    
+    @property
+    def span_index(self):
+        """SpatialIndex over span bboxes"""
+        if self._span_index is None:
+            self._span_index = SpatialIndex(span["bbox"] for span in self.spans)
+        return self._span_index
+    
+    @property
+    def word_index(self):
+        """SpatialIndex over word bboxes"""
+        if self._word_index is None:
+            self._word_index = SpatialIndex(self.words)
+        return self._word_index
+    
+    def prepare(self, rects):
+        """
+        Compute word overlaps for many rects in one batch (needs NumPy)
+        
+        Later words_intersecting, words_in_quads and has_text calls for these
+        rects are answered from the batch; without NumPy this does nothing and
+        the spatial index is used instead.
+        """
+        keys = [tuple(fitz.Rect(rect)) for rect in rects]
+        keys = [key for key in dict.fromkeys(keys) if key not in self._word_overlaps]
+        # Without rects the page's text is not needed at all
+        if np is None or not keys:
+            return
+        words = self.words
+        if not words:
+            return
+        
+        ratios = overlap_matrix([word[:4] for word in words], keys)
+        for key, row in zip(keys, ratios):
+            hits = np.flatnonzero(row > 0)
+            self._word_overlaps[key] = (hits.tolist(), row[hits].tolist())
+    
+    def prepare_annotations(self, annots):
+        """prepare() for the rects and quads of a list of annotations"""
+        rects = []
+        for annot in annots:
+            try:
+                rects.append(annot.rect)
+                rects.extend(quad_rects(annot))
+            except Exception:
+                pass
+        self.prepare(rects)
+    
+    def _word_hits(self, rect):
+        """(word indices, overlap ratios) of words intersecting rect"""
+        key = tuple(fitz.Rect(rect))
+        if key in self._word_overlaps:
+            return self._word_overlaps[key]
+        
+        words = self.words
+        hits = self.word_index.query(rect)
+        return hits, [overlap_ratio(words[i], key) for i in hits]
+    
+    def spans_intersecting(self, rect):
+        """Spans whose bbox intersects rect, in reading order"""
+        spans = self.spans
+        return [spans[i] for i in self.span_index.query(rect)]
+    
+    def words_intersecting(self, rect):
+        """Words whose bbox intersects rect, in reading order"""
+        words = self.words
+        key = tuple(fitz.Rect(rect))
+        if key in self._word_overlaps:
+            return [words[i] for i in self._word_overlaps[key][0]]
+        return [words[i] for i in self.word_index.query(rect)]
+    
+    def words_in_quads(self, quads, min_overlap=QUAD_OVERLAP):
+        """
+        Words covered by a list of highlight quads, in reading order
+        
+        A word belongs to a quad if at least min_overlap of its area lies
+        inside the quad's rectangle; each word is returned once.
+        """
+        words = self.words
+        found = set()
+        
+        for rect in quads:
+            hits, ratios = self._word_hits(rect)
+            found.update(i for i, ratio in zip(hits, ratios) if ratio >= min_overlap)
+        
+        return [words[i] for i in sorted(found)]
+    
+    def quad_text(self, annot):
+        """Text under an annotation's quad points, or "" if it has none"""
+        quads = quad_rects(annot)
+        if not quads:
+            return ""
+        return " ".join(word[4] for word in self.words_in_quads(quads))
+    
+    def has_text(self, rect):
+        """Check if any word lies under rect (cheap test before get_textbox)"""
+        key = tuple(fitz.Rect(rect))
+        if key in self._word_overlaps:
+            return bool(self._word_overlaps[key][0])
+        return bool(self.word_index.query(rect))
+    
+    def textbox(self, rect):
+        """Same as page.get_textbox(rect) without re-parsing the page"""
+        with profiling.stage('get_textbox'):
+            if self._textbox_page is None:
+                self._textbox_page = self.page.get_textpage()
+            return self.page.get_textbox(rect, textpage=self._textbox_page)
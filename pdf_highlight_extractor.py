@@ -7,26 +7,208 @@ This program extracts highlighted text (in yellow) from PDF files
 and saves them to a text or Word file
 """
 
-import fitz  # PyMuPDF
 import tkinter as tk
+import tkinter.font as tkfont
 from tkinter import filedialog, messagebox, ttk
 import os
+import queue
+import threading
 from datetime import datetime
-from docx import Document
-from docx.shared import Inches
+
+from drawing_filter import reject_reason
+from lazy_modules import lazy_import
+from logs import get_logger
+from page_text import PageText
+from writers import DocxWriter, hex_color
+
+fitz = lazy_import('fitz')  # PyMuPDF
+
+log = get_logger('gui')
+
+# How often the GUI picks up results from the extraction worker
+POLL_INTERVAL_MS = 50
+
+# Upper bound of worker messages handled per poll, so the window stays responsive
+MAX_MESSAGES_PER_POLL = 100
+
+# Longer result rows are cut off in the list (the full text is shown on click)
+MAX_ROW_CHARS = 300
+
+# Filter choice that matches every value
+ALL = "All"
+
+
+class VirtualResultsView:
+    """
+    Results list that only renders the rows currently on screen
+    
+    The records stay in a plain list. Scrolling, filtering and appending only
+    change which slice of it is drawn, so a redraw costs the same with 50 or
+    50,000 results.
+    """
+    
+    def __init__(self, parent, on_select=None):
+        self.records = []
+        self.rows = []        # Indices of the records that pass the filter
+        self.seen = 0         # Records already considered by records_added()
+        self.top = 0          # First visible row
+        self.match = None     # Filter predicate, None shows every record
+        self.message = None
+        self.on_select = on_select
+        
+        self.frame = tk.Frame(parent)
+        self.text = tk.Text(
+            self.frame,
+            font=("Arial", 10),
+            wrap='none',
+            bg='white',
+            relief='sunken',
+            borderwidth=1,
+            cursor='arrow'
+        )
+        self.scrollbar = tk.Scrollbar(self.frame, command=self.yview)
+        self.scrollbar.pack(side='right', fill='y')
+        self.text.pack(side='left', fill='both', expand=True)
+        self.line_height = tkfont.Font(font=self.text['font']).metrics('linespace')
+        
+        self.text.bind('<Configure>', lambda event: self.render())
+        self.text.bind('<MouseWheel>', self.on_wheel)
+        self.text.bind('<Button-4>', lambda event: self.scroll(-3))
+        self.text.bind('<Button-5>', lambda event: self.scroll(3))
+        self.text.bind('<Button-1>', self.on_click)
+    
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+    
+    def set_records(self, records):
+        """Show a new list of records (appended to later, see records_added)"""
+        self.records = records
+        self.message = None
+        self.seen = 0
+        self.rows = []
+        self.top = 0
+        self.records_added()
+    
+    def records_added(self):
+        """Pick up records appended to the list since the last call"""
+        match = self.match
+        for i in range(self.seen, len(self.records)):
+            if match is None or match(self.records[i]):
+                self.rows.append(i)
+        self.seen = len(self.records)
+        self.render()
+    
+    def set_filter(self, match):
+        """Only show records for which match(record) is true (None shows all)"""
+        self.match = match
+        self.rows = []
+        self.seen = 0
+        self.top = 0
+        self.records_added()
+    
+    def show_message(self, message):
+        """Text shown instead of the rows while there are none"""
+        self.message = message
+        self.render()
+    
+    def scroll_to_page(self, page):
+        """Scroll to the first shown record on or after a page, False if there is none"""
+        for row, i in enumerate(self.rows):
+            if self.records[i]['page'] >= page:
+                self.top = row
+                self.render()
+                return True
+        return False
+    
+    def visible_rows(self):
+        """Number of rows that fit in the widget"""
+        return max(1, (self.text.winfo_height() - 4) // self.line_height)
+    
+    def format_row(self, i):
+        """One line of the list for record i"""
+        record = self.records[i]
+        text = " ".join(record['text'].split())
+        return f"[{i + 1}] Page {record['page']}  {record.get('type', '')}  {text}"[:MAX_ROW_CHARS]
+    
+    def render(self):
+        """Draw the visible slice of the rows"""
+        count = self.visible_rows()
+        total = len(self.rows)
+        self.top = max(0, min(self.top, total - count))
+        
+        self.text.config(state='normal')
+        self.text.delete('1.0', tk.END)
+        if total:
+            self.text.insert('1.0', "\n".join(
+                self.format_row(i) for i in self.rows[self.top:self.top + count]))
+        elif self.message:
+            self.text.insert('1.0', self.message)
+        self.text.config(state='disabled')
+        
+        if total:
+            self.scrollbar.set(self.top / total, min(1.0, (self.top + count) / total))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+    
+    def scroll(self, rows):
+        self.top += rows
+        self.render()
+        return 'break'
+    
+    def yview(self, *args):
+        """Scrollbar command"""
+        if args[0] == 'moveto':
+            self.top = int(float(args[1]) * len(self.rows))
+            self.render()
+        elif args[0] == 'scroll':
+            rows = int(args[1])
+            if args[2] == 'pages':
+                rows *= self.visible_rows()
+            self.scroll(rows)
+    
+    def on_wheel(self, event):
+        return self.scroll(-3 if event.delta > 0 else 3)
+    
+    def on_click(self, event):
+        line = int(self.text.index(f"@{event.x},{event.y}").split('.')[0])
+        row = self.top + line - 1
+        if self.on_select and row < len(self.rows):
+            self.on_select(self.records[self.rows[row]])
+        return 'break'
+
+
+def parse_pages(text):
+    """
+    Page numbers of a filter such as "3", "10-20" or "1, 4-6"
+    
+    Returns:
+        list: (first, last) page ranges
+    """
+    ranges = []
+    for part in text.replace(' ', '').split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        ranges.append((int(first), int(last or first)))
+    return ranges
 
 
 class PDFHighlightExtractor:
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("PDF Highlight Text Extractor")
-        self.root.geometry("600x500")
+        self.root.geometry("700x600")
         self.root.configure(bg='#f0f0f0')
         
         # Variables
         self.pdf_file = None
         self.extracted_highlights = []
         
+        # Background extraction
+        self.worker = None
+        self.cancel_event = threading.Event()
+        self.results_queue = queue.Queue()
+        
         self.setup_ui()
     
     def setup_ui(self):
@@ -73,9 +255,12 @@ class PDFHighlightExtractor:
         )
         browse_btn.pack(side='right')
         
-        # Extract button
-        extract_btn = tk.Button(
-            self.root,
+        # Extract and cancel buttons
+        action_frame = tk.Frame(self.root, bg='#f0f0f0')
+        action_frame.pack(pady=(20, 5))
+        
+        self.extract_btn = tk.Button(
+            action_frame,
             text="Extract Highlighted Text",
             command=self.extract_highlights,
             bg='#e74c3c',
@@ -83,7 +268,23 @@ class PDFHighlightExtractor:
             font=("Arial", 12, "bold"),
             pady=10
         )
-        extract_btn.pack(pady=20)
+        self.extract_btn.pack(side='left', padx=5)
+        
+        self.cancel_btn = tk.Button(
+            action_frame,
+            text="Cancel",
+            command=self.cancel_extraction,
+            bg='#95a5a6',
+            fg='white',
+            font=("Arial", 12, "bold"),
+            pady=10,
+            state='disabled'
+        )
+        self.cancel_btn.pack(side='left', padx=5)
+        
+        # Per-page progress
+        self.progress = ttk.Progressbar(self.root, mode='determinate')
+        self.progress.pack(pady=(0, 10), padx=20, fill='x')
         
         # Results display area
         results_frame = tk.Frame(self.root, bg='#f0f0f0')
@@ -96,25 +297,55 @@ class PDFHighlightExtractor:
             bg='#f0f0f0'
         ).pack(anchor='w')
         
-        # Text area with scrollbar
-        text_frame = tk.Frame(results_frame)
-        text_frame.pack(fill='both', expand=True)
+        # Filters and jump to page
+        filter_frame = tk.Frame(results_frame, bg='#f0f0f0')
+        filter_frame.pack(fill='x', pady=(0, 5))
         
-        self.results_text = tk.Text(
-            text_frame,
-            font=("Arial", 10),
-            wrap='word',
-            bg='white',
-            relief='sunken',
-            borderwidth=1
-        )
+        tk.Label(filter_frame, text="Pages:", bg='#f0f0f0').pack(side='left')
+        self.page_filter_var = tk.StringVar()
+        page_entry = tk.Entry(filter_frame, textvariable=self.page_filter_var, width=10)
+        page_entry.pack(side='left', padx=(2, 8))
+        page_entry.bind('<Return>', lambda event: self.apply_filter())
+        
+        tk.Label(filter_frame, text="Type:", bg='#f0f0f0').pack(side='left')
+        self.type_filter = ttk.Combobox(filter_frame, values=[ALL], width=10, state='readonly')
+        self.type_filter.set(ALL)
+        self.type_filter.pack(side='left', padx=(2, 8))
+        self.type_filter.bind('<<ComboboxSelected>>', lambda event: self.apply_filter())
         
-        scrollbar = tk.Scrollbar(text_frame)
-        scrollbar.pack(side='right', fill='y')
-        self.results_text.pack(side='left', fill='both', expand=True)
+        tk.Label(filter_frame, text="Colour:", bg='#f0f0f0').pack(side='left')
+        self.color_filter = ttk.Combobox(filter_frame, values=[ALL], width=9, state='readonly')
+        self.color_filter.set(ALL)
+        self.color_filter.pack(side='left', padx=(2, 8))
+        self.color_filter.bind('<<ComboboxSelected>>', lambda event: self.apply_filter())
         
-        self.results_text.config(yscrollcommand=scrollbar.set)
-        scrollbar.config(command=self.results_text.yview)
+        tk.Button(filter_frame, text="Filter", command=self.apply_filter).pack(side='left')
+        
+        go_btn = tk.Button(filter_frame, text="Go", command=self.jump_to_page)
+        go_btn.pack(side='right')
+        self.jump_var = tk.StringVar()
+        jump_entry = tk.Entry(filter_frame, textvariable=self.jump_var, width=5)
+        jump_entry.pack(side='right', padx=2)
+        jump_entry.bind('<Return>', lambda event: self.jump_to_page())
+        tk.Label(filter_frame, text="Go to page:", bg='#f0f0f0').pack(side='right')
+        
+        # Result list (only the visible rows are drawn)
+        self.results_view = VirtualResultsView(results_frame, on_select=self.show_detail)
+        self.results_view.pack(fill='both', expand=True)
+        self.known_types = set()
+        self.known_colors = set()
+        
+        # Full text of the clicked result
+        self.detail_var = tk.StringVar()
+        tk.Label(
+            results_frame,
+            textvariable=self.detail_var,
+            font=("Arial", 10),
+            bg='#f0f0f0',
+            anchor='w',
+            justify='left',
+            wraplength=640
+        ).pack(fill='x', pady=(5, 0))
         
         # Save buttons frame
         save_frame = tk.Frame(self.root, bg='#f0f0f0')
@@ -168,104 +399,199 @@ class PDFHighlightExtractor:
             self.status_var.set(f"File selected: {os.path.basename(file_path)}")
     
     def extract_highlights(self):
-        """Extract highlighted text from PDF"""
+        """Start extracting highlighted text from PDF in the background"""
         if not self.pdf_file:
             messagebox.showerror("Error", "Please select a PDF file first!")
             return
         
+        if self.worker and self.worker.is_alive():
+            return
+        
+        self.extracted_highlights = []
+        self.reset_filters()
+        self.results_view.set_records(self.extracted_highlights)
+        self.progress['value'] = 0
+        self.extract_btn.config(state='disabled')
+        self.cancel_btn.config(state='normal')
+        self.status_var.set("Extracting highlighted text...")
+        
+        # A fresh queue and event per run, so a cancelled worker that is still
+        # finishing its page cannot post into the next run
+        self.cancel_event = threading.Event()
+        self.results_queue = queue.Queue()
+        self.worker = threading.Thread(
+            target=self.extract_worker,
+            args=(self.pdf_file, self.results_queue, self.cancel_event),
+            daemon=True
+        )
+        self.worker.start()
+        self.root.after(POLL_INTERVAL_MS, self.poll_results)
+    
+    def cancel_extraction(self):
+        """Ask the running extraction to stop after the current page"""
+        if self.worker and self.worker.is_alive():
+            self.cancel_event.set()
+            self.cancel_btn.config(state='disabled')
+            self.status_var.set("Cancelling...")
+    
+    def extract_worker(self, pdf_path, results, cancel):
+        """
+        Extract page by page on the worker thread, posting to the results queue
+        
+        All PyMuPDF work happens on this thread; the GUI only reads the queue.
+        Messages: ('start', page_count), ('page', page_num, highlights),
+        then one of ('done',), ('cancelled', page_num) or ('error', message).
+        """
         try:
-            self.status_var.set("Extracting highlighted text...")
-            self.root.update()
-            
-            # Open PDF file
-            doc = fitz.open(self.pdf_file)
-            self.extracted_highlights = []
-            
-            # Search through all pages
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                
-                # Search for annotations
-                annotations = page.annots()
+            with fitz.open(pdf_path) as doc:
+                results.put(('start', len(doc)))
                 
-                for annot in annotations:
-                    annot_type = annot.type[1] if len(annot.type) > 1 else annot.type[0]
-                    
-                    # Check for different highlight types
-                    if annot_type in ['Highlight', 'Squiggly', 'Underline', 'StrikeOut', 'Square', 'FreeText']:
-                        # Get highlighted text
-                        highlighted_text = self.get_highlighted_text(page, annot)
-                        
-                        if highlighted_text:
-                            highlight_info = {
-                                'page': page_num + 1,
-                                'text': highlighted_text.strip(),
-                                'color': self.get_annot_color(annot),
-                                'type': annot_type
-                            }
-                            
-                            # Check for yellow color (accepting most colors now)
-                            if self.is_yellow_highlight(highlight_info['color']):
-                                self.extracted_highlights.append(highlight_info)
-                
-                # Additional: Search for highlights using alternative methods
-                try:
-                    # Search in drawings
-                    drawings = page.get_drawings()
-                    for drawing in drawings:
-                        if 'fill' in drawing and drawing['fill']:
-                            fill_color = drawing.get('fill')
-                            if fill_color and len(fill_color) >= 3:
-                                r, g, b = fill_color[0], fill_color[1], fill_color[2]
-                                # If color is light (might be a highlight)
-                                if (r + g + b) / 3 > 0.6:
-                                    rect = drawing.get('rect')
-                                    if rect:
-                                        text = page.get_textbox(rect)
-                                        if text and text.strip():
-                                            highlight_info = {
-                                                'page': page_num + 1,
-                                                'text': text.strip(),
-                                                'color': fill_color,
-                                                'type': 'Drawing'
-                                            }
-                                            self.extracted_highlights.append(highlight_info)
-                except:
-                    pass
-            
-            doc.close()
-            
-            # Display results
-            self.display_results()
-            
-            self.status_var.set(f"Extracted {len(self.extracted_highlights)} highlighted text(s)")
+                for page_num in range(len(doc)):
+                    if cancel.is_set():
+                        results.put(('cancelled', page_num))
+                        return
+                    results.put(('page', page_num, self.extract_page(doc[page_num], page_num)))
             
+            results.put(('done',))
+        
         except Exception as e:
-            messagebox.showerror("Error", f"An error occurred while extracting text: {str(e)}")
+            results.put(('error', str(e)))
+    
+    def poll_results(self):
+        """Show results posted by the worker since the last poll"""
+        added = False
+        finished = None
+        
+        try:
+            for _ in range(MAX_MESSAGES_PER_POLL):
+                message = self.results_queue.get_nowait()
+                
+                if message[0] == 'start':
+                    self.progress.config(maximum=max(message[1], 1))
+                elif message[0] == 'page':
+                    _, page_num, page_highlights = message
+                    self.extracted_highlights.extend(page_highlights)
+                    self.update_filter_choices(page_highlights)
+                    added = added or bool(page_highlights)
+                    self.progress['value'] = page_num + 1
+                else:
+                    finished = message
+                    break
+        except queue.Empty:
+            pass
+        
+        # One redraw per poll, however many highlights arrived
+        if added:
+            self.results_view.records_added()
+        
+        if finished:
+            self.finish_extraction(finished)
+            return
+        
+        self.status_var.set(
+            f"Extracting highlighted text... page {int(self.progress['value'])} of "
+            f"{int(self.progress['maximum'])}, {len(self.extracted_highlights)} found")
+        self.root.after(POLL_INTERVAL_MS, self.poll_results)
+    
+    def finish_extraction(self, message):
+        """Reset the controls once the worker has stopped"""
+        self.extract_btn.config(state='normal')
+        self.cancel_btn.config(state='disabled')
+        count = len(self.extracted_highlights)
+        
+        if message[0] == 'error':
+            messagebox.showerror("Error", f"An error occurred while extracting text: {message[1]}")
             self.status_var.set("Error occurred during extraction")
+        elif message[0] == 'cancelled':
+            self.status_var.set(f"Cancelled after {message[1]} page(s), {count} highlighted text(s) so far")
+        else:
+            if not count:
+                self.results_view.show_message("No highlighted text found in this file.")
+            self.status_var.set(f"Extracted {count} highlighted text(s)")
+    
+    def extract_page(self, page, page_num):
+        """Extract highlighted text from one page (runs on the worker thread)"""
+        page_highlights = []
+        page_text = PageText(page)
+        
+        # Search for annotations
+        annotations = list(page.annots())
+        
+        # Find the words under all annotations of the page in one batch
+        page_text.prepare_annotations(annotations)
+        
+        for annot in annotations:
+            annot_type = annot.type[1] if len(annot.type) > 1 else annot.type[0]
+            
+            # Check for different highlight types
+            if annot_type in ['Highlight', 'Squiggly', 'Underline', 'StrikeOut', 'Square', 'FreeText']:
+                # Get highlighted text
+                highlighted_text = self.get_highlighted_text(page, annot, page_text)
+                
+                if highlighted_text:
+                    highlight_info = {
+                        'page': page_num + 1,
+                        'text': highlighted_text.strip(),
+                        'color': self.get_annot_color(annot),
+                        'type': annot_type
+                    }
+                    
+                    # Check for yellow color (accepting most colors now)
+                    if self.is_yellow_highlight(highlight_info['color']):
+                        page_highlights.append(highlight_info)
+        
+        # Additional: Search for highlights using alternative methods
+        try:
+            # Search in drawings
+            drawings = page.get_drawings()
+            for drawing in drawings:
+                if 'fill' in drawing and drawing['fill']:
+                    fill_color = drawing.get('fill')
+                    if fill_color and len(fill_color) >= 3:
+                        r, g, b = fill_color[0], fill_color[1], fill_color[2]
+                        # If color is light (might be a highlight)
+                        if (r + g + b) / 3 > 0.6:
+                            # Backgrounds, table cells and grey boxes are not highlights
+                            if reject_reason(drawing, page.rect, page_text.line_height):
+                                continue
+                            rect = drawing.get('rect')
+                            if rect and page_text.has_text(rect):
+                                text = page_text.textbox(rect)
+                                if text and text.strip():
+                                    highlight_info = {
+                                        'page': page_num + 1,
+                                        'text': text.strip(),
+                                        'color': fill_color,
+                                        'type': 'Drawing'
+                                    }
+                                    page_highlights.append(highlight_info)
+        except:
+            pass
+        
+        return page_highlights
     
-    def get_highlighted_text(self, page, annot):
+    def get_highlighted_text(self, page, annot, page_text=None):
         """Extract highlighted text from annotation"""
         try:
+            if page_text is None:
+                page_text = PageText(page)
+            
+            # Method 0: Words inside the highlight's quad points (exact lines only)
+            highlighted_text = page_text.quad_text(annot)
+            if highlighted_text:
+                return highlighted_text
+            
             # Get highlight rectangle
             rect = annot.rect
             
             # Method 1: Extract text from highlighted area
-            text_instances = page.get_text("dict")
-            highlighted_text = ""
-            
-            for block in text_instances["blocks"]:
-                if "lines" in block:
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            span_rect = fitz.Rect(span["bbox"])
-                            # Check if text intersects with highlight area
-                            if span_rect.intersects(rect):
-                                highlighted_text += span["text"] + " "
+            # Check if text intersects with highlight area
+            for span in page_text.spans_intersecting(rect):
+                highlighted_text += span["text"] + " "
             
             # Method 2: If no text found with previous method
             if not highlighted_text.strip():
-                highlighted_text = page.get_textbox(rect)
+                highlighted_text = page_text.textbox(rect)
             
             # Method 3: Extract text with higher precision
             if not highlighted_text.strip():
@@ -274,20 +600,17 @@ class PDFHighlightExtractor:
                     rect.x0 - 2, rect.y0 - 2, 
                     rect.x1 + 2, rect.y1 + 2
                 )
-                highlighted_text = page.get_textbox(expanded_rect)
+                highlighted_text = page_text.textbox(expanded_rect)
             
             # Method 4: Extract text using alternative method
             if not highlighted_text.strip():
-                words = page.get_text("words")
-                for word in words:
-                    word_rect = fitz.Rect(word[:4])
-                    if word_rect.intersects(rect):
-                        highlighted_text += word[4] + " "
+                for word in page_text.words_intersecting(rect):
+                    highlighted_text += word[4] + " "
             
             return highlighted_text.strip()
-            
+        
         except Exception as e:
-            print(f"Error extracting text: {e}")
+            log.warning("Error extracting text: %s", e)
             return ""
     
     def get_annot_color(self, annot):
@@ -335,18 +658,68 @@ class PDFHighlightExtractor:
         # When in doubt, accept the highlight
         return True
     
-    def display_results(self):
-        """Display results in text area"""
-        self.results_text.delete(1.0, tk.END)
+    def reset_filters(self):
+        """Clear the filters and their choices"""
+        self.known_types = set()
+        self.known_colors = set()
+        self.page_filter_var.set("")
+        self.type_filter.config(values=[ALL])
+        self.type_filter.set(ALL)
+        self.color_filter.config(values=[ALL])
+        self.color_filter.set(ALL)
+        self.detail_var.set("")
+        self.results_view.match = None
+    
+    def update_filter_choices(self, highlights):
+        """Offer the types and colours of new results in the filter lists"""
+        types = {highlight.get('type') or '' for highlight in highlights} - self.known_types
+        colors = {hex_color(highlight.get('color')) or '' for highlight in highlights} - self.known_colors
         
-        if not self.extracted_highlights:
-            self.results_text.insert(tk.END, "No highlighted text found in this file.")
+        if types:
+            self.known_types |= types
+            self.type_filter.config(values=[ALL] + sorted(self.known_types))
+        if colors:
+            self.known_colors |= colors
+            self.color_filter.config(values=[ALL] + sorted(self.known_colors))
+    
+    def apply_filter(self):
+        """Show only the results matching the page, type and colour filters"""
+        try:
+            pages = parse_pages(self.page_filter_var.get())
+        except ValueError:
+            messagebox.showerror("Error", "Pages must look like 3, 10-20 or 1, 4-6")
             return
         
-        for i, highlight in enumerate(self.extracted_highlights, 1):
-            self.results_text.insert(tk.END, f"[{i}] Page {highlight['page']}:\n")
-            self.results_text.insert(tk.END, f"{highlight['text']}\n")
-            self.results_text.insert(tk.END, "-" * 50 + "\n\n")
+        annot_type = self.type_filter.get()
+        color = self.color_filter.get()
+        
+        def match(highlight):
+            if pages and not any(first <= highlight['page'] <= last for first, last in pages):
+                return False
+            if annot_type != ALL and (highlight.get('type') or '') != annot_type:
+                return False
+            if color != ALL and (hex_color(highlight.get('color')) or '') != color:
+                return False
+            return True
+        
+        filtered = bool(pages) or annot_type != ALL or color != ALL
+        self.results_view.set_filter(match if filtered else None)
+        if filtered:
+            self.status_var.set(f"Showing {len(self.results_view.rows)} of "
+                                f"{len(self.extracted_highlights)} highlighted text(s)")
+    
+    def jump_to_page(self):
+        """Scroll the result list to a page"""
+        try:
+            page = int(self.jump_var.get())
+        except ValueError:
+            return
+        if not self.results_view.scroll_to_page(page):
+            self.status_var.set(f"No results on or after page {page}")
+    
+    def show_detail(self, highlight):
+        """Show the full text of a clicked result"""
+        self.detail_var.set(f"Page {highlight['page']}: {highlight['text']}")
     
     def save_as_txt(self):
         """Save results as text file"""
@@ -377,7 +750,7 @@ class PDFHighlightExtractor:
                 
                 messagebox.showinfo("Success", f"File saved successfully at:\n{file_path}")
                 self.status_var.set("Text file saved successfully")
-                
+            
             except Exception as e:
                 messagebox.showerror("Error", f"An error occurred while saving file: {str(e)}")
     
@@ -395,37 +768,13 @@ class PDFHighlightExtractor:
         
         if file_path:
             try:
-                doc = Document()
-                
-                # Add title
-                heading = doc.add_heading('Highlighted Text from PDF', 0)
-                heading.alignment = 1  # Center alignment
+                with DocxWriter(file_path, self.pdf_file) as writer:
+                    for highlight in self.extracted_highlights:
+                        writer.write(highlight)
                 
-                # Add file information
-                info_para = doc.add_paragraph()
-                info_para.add_run(f"Source file: {os.path.basename(self.pdf_file)}\n").bold = True
-                info_para.add_run(f"Extraction date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                info_para.add_run(f"Number of extracted texts: {len(self.extracted_highlights)}")
-                
-                doc.add_paragraph()  # Empty line
-                
-                # Add extracted texts
-                for i, highlight in enumerate(self.extracted_highlights, 1):
-                    # Number and page of text
-                    header_para = doc.add_paragraph()
-                    header_para.add_run(f"[{i}] Page {highlight['page']}:").bold = True
-                    
-                    # Highlighted text
-                    text_para = doc.add_paragraph(highlight['text'])
-                    text_para.style = 'Quote'
-                    
-                    # Separator line
-                    doc.add_paragraph('_' * 50)
-                
-                doc.save(file_path)
                 messagebox.showinfo("Success", f"File saved successfully at:\n{file_path}")
                 self.status_var.set("Word file saved successfully")
-                
+            
             except Exception as e:
                 messagebox.showerror("Error", f"An error occurred while saving file: {str(e)}")
     
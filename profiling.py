@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Per-stage timing of the extractors
+
+While a Profiler is active, the extractors record wall-clock time, CPU time
+and call counts of their stages (opening the file, loading pages, parsing
+text, reading drawings, get_textbox, duplicate removal, writing) and of
+every detector, in total and per page:
+    
+    profiler = profiling.start("book.pdf")
+    extract_all_highlights("book.pdf")
+    profiling.stop()
+    profiler.save("book_profile.json")
+    print("\n".join(profiler.summary()))
+
+When no profiler is active the hooks do nothing.
+"""
+
+import json
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+
+# Number of pages listed in the summary and the "slowest_pages" report
+TOP_PAGES = 10
+
+# Profiler of the current run, or None when profiling is off
+_active = None
+
+
+def start(source=None):
+    """Start profiling the extractors of this process"""
+    global _active
+    _active = Profiler(source)
+    return _active
+
+
+def stop():
+    """Stop profiling and return the profiler that was active"""
+    global _active
+    profiler, _active = _active, None
+    if profiler:
+        profiler.finish()
+    return profiler
+
+
+def stage(name):
+    """Time a stage of the active profiler (no-op when profiling is off)"""
+    if _active is None:
+        return nullcontext()
+    return _active.stage(name)
+
+
+def detector(name):
+    """Time a detector of the active profiler (no-op when profiling is off)"""
+    if _active is None:
+        return nullcontext()
+    return _active.stage(name, detector=True)
+
+
+def page(page_num):
+    """Attribute the timings of the enclosed code to a page (no-op when profiling is off)"""
+    if _active is None:
+        return nullcontext()
+    return _active.page(page_num)
+
+
+def path_from_args(args, pdf_path):
+    """
+    Profile file chosen with --profile or --profile=PATH in a list of arguments
+    
+    Returns:
+        str: PATH, "<PDF name>_profile.json" for a bare --profile, or None
+    """
+    for arg in args:
+        if arg == '--profile':
+            return f"{os.path.splitext(os.path.basename(pdf_path))[0]}_profile.json"
+        if arg.startswith('--profile='):
+            return arg.split('=', 1)[1]
+    return None
+
+
+def _add(table, name, wall, cpu, calls=1):
+    """Add one measurement to a {name: {'calls', 'wall', 'cpu'}} table"""
+    entry = table.setdefault(name, {'calls': 0, 'wall': 0.0, 'cpu': 0.0})
+    entry['calls'] += calls
+    entry['wall'] += wall
+    entry['cpu'] += cpu
+
+
+def _merge_table(table, other):
+    for name, entry in other.items():
+        _add(table, name, entry['wall'], entry['cpu'], entry['calls'])
+
+
+def _sorted_table(table):
+    """Table sorted by wall time, times rounded to microseconds"""
+    return {
+        name: {'calls': entry['calls'], 'wall': round(entry['wall'], 6), 'cpu': round(entry['cpu'], 6)}
+        for name, entry in sorted(table.items(), key=lambda item: -item[1]['wall'])
+    }
+
+
+class Profiler:
+    """Wall time, CPU time and call counts per stage, per detector and per page"""
+    
+    def __init__(self, source=None):
+        self.source = os.path.basename(source) if source else None
+        self.stages = {}
+        self.detectors = {}
+        self.pages = []
+        self.worker_cpu = 0.0
+        self._page = None
+        self._started = (time.perf_counter(), time.process_time())
+        self._totals = None
+    
+    @contextmanager
+    def stage(self, name, detector=False):
+        """Time the enclosed code as a stage (or a detector) of the current page"""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            key = 'detectors' if detector else 'stages'
+            _add(getattr(self, key), name, wall, cpu)
+            if self._page is not None:
+                _add(self._page[key], name, wall, cpu)
+    
+    @contextmanager
+    def page(self, page_num):
+        """Attribute the enclosed stages to a zero-based page number"""
+        record = {'source': self.source, 'page': page_num + 1, 'wall': 0.0, 'cpu': 0.0,
+                  'stages': {}, 'detectors': {}}
+        outer, self._page = self._page, record
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = time.perf_counter() - wall
+            record['cpu'] = time.process_time() - cpu
+            self._page = outer
+            self.pages.append(record)
+    
+    def totals(self):
+        """(wall, CPU) seconds since the start, or until finish(); CPU includes merged workers"""
+        if self._totals is not None:
+            return self._totals
+        return (time.perf_counter() - self._started[0],
+                time.process_time() - self._started[1] + self.worker_cpu)
+    
+    def finish(self):
+        """Stop the clock of the totals"""
+        self._totals = self.totals()
+    
+    def data(self):
+        """Raw measurements, e.g. to send from a worker process to merge()"""
+        return {
+            'stages': self.stages,
+            'detectors': self.detectors,
+            'pages': self.pages,
+            'cpu': self.totals()[1],
+        }
+    
+    def merge(self, data):
+        """Add the measurements of another profiler (see data())"""
+        _merge_table(self.stages, data['stages'])
+        _merge_table(self.detectors, data['detectors'])
+        self.pages.extend(data['pages'])
+        self.worker_cpu += data['cpu']
+    
+    def report(self, top=TOP_PAGES):
+        """
+        Profile as a JSON-serializable dict
+        
+        Returns:
+            dict: 'wall' and 'cpu' totals, 'stages' and 'detectors' tables
+                sorted by wall time, 'slowest_files', 'slowest_pages' (the top
+                pages with their costliest detector) and 'pages' (every page in
+                processing order)
+        """
+        pages = [self._page_report(record) for record in self.pages]
+        wall, cpu = self.totals()
+        return {
+            'source': self.source,
+            'wall': round(wall, 6),
+            'cpu': round(cpu, 6),
+            'page_count': len(pages),
+            'stages': _sorted_table(self.stages),
+            'detectors': _sorted_table(self.detectors),
+            'slowest_files': self._file_totals(pages)[:top],
+            'slowest_pages': sorted(pages, key=lambda record: -record['wall'])[:top],
+            'pages': pages,
+        }
+    
+    @staticmethod
+    def _file_totals(pages):
+        """Page time per source file, slowest first"""
+        files = {}
+        for record in pages:
+            entry = files.setdefault(record['source'],
+                                     {'source': record['source'], 'pages': 0, 'wall': 0.0, 'cpu': 0.0})
+            entry['pages'] += 1
+            entry['wall'] += record['wall']
+            entry['cpu'] += record['cpu']
+        for entry in files.values():
+            entry['wall'] = round(entry['wall'], 6)
+            entry['cpu'] = round(entry['cpu'], 6)
+        return sorted(files.values(), key=lambda entry: -entry['wall'])
+    
+    @staticmethod
+    def _page_report(record):
+        detectors = _sorted_table(record['detectors'])
+        return {
+            'source': record['source'],
+            'page': record['page'],
+            'wall': round(record['wall'], 6),
+            'cpu': round(record['cpu'], 6),
+            'slowest_detector': next(iter(detectors), None),
+            'stages': _sorted_table(record['stages']),
+            'detectors': detectors,
+        }
+    
+    def save(self, path, top=TOP_PAGES):
+        """Write report() to a JSON file"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(top), f, ensure_ascii=False, indent=2)
+    
+    def summary(self, top=TOP_PAGES):
+        """
+        Summary table of the profile
+        
+        Returns:
+            list: Lines of text (stages, detectors and the slowest pages)
+        """
+        report = self.report(top)
+        lines = [
+            f"Profile: {report['wall']:.3f} s wall, {report['cpu']:.3f} s CPU, "
+            f"{report['page_count']} page(s)",
+            "",
+            f"{'Stage':<32} {'Calls':>8} {'Wall (s)':>10} {'CPU (s)':>10}",
+            "-" * 63,
+        ]
+        for title, table in (('', report['stages']), ('detector: ', report['detectors'])):
+            for name, entry in table.items():
+                lines.append(f"{(title + name)[:32]:<32} {entry['calls']:>8} "
+                             f"{entry['wall']:>10.4f} {entry['cpu']:>10.4f}")
+        
+        # Only worth listing for runs over several files
+        if len(report['slowest_files']) > 1:
+            lines += ["", "Slowest files:"]
+            for entry in report['slowest_files']:
+                lines.append(f"  {entry['source']}: {entry['wall']:.4f} s over {entry['pages']} page(s)")
+        
+        if report['slowest_pages']:
+            lines += ["", "Slowest pages:"]
+            for record in report['slowest_pages']:
+                name = f"{record['source']} p. {record['page']}" if record['source'] else f"Page {record['page']}"
+                detector_name = record['slowest_detector']
+                costliest = ""
+                if detector_name:
+                    costliest = f" (mostly {detector_name}: {record['detectors'][detector_name]['wall']:.4f} s)"
+                lines.append(f"  {name}: {record['wall']:.4f} s{costliest}")
+        
+        return lines
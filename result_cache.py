@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Persistent result cache for the highlight extractors
+
+Results are stored in a SQLite database keyed by the PDF's content hash,
+the extractor version and the extraction options, so unchanged files are
+never re-extracted. A file's hash is only recomputed when its mtime or
+size changes.
+
+When a file did change, per-page results are kept alongside a digest of
+each page's content streams and annotations, so only the pages that were
+edited are extracted again.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import sqlite3
+import sys
+import time
+
+
+# Bump whenever a change to the extractors alters their output
+EXTRACTOR_VERSION = "4"
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "PDF_HIGHLIGHT_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "pdf_highlight_extractor"),
+)
+
+# Least recently used entries are evicted above this total size
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Re-extracted pages are written to the cache in batches of this many
+PAGE_WRITE_BATCH = 50
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _referenced_xrefs(doc, kind, value):
+    """Xrefs referenced by a PDF object value, resolving indirect arrays"""
+    if kind == 'xref':
+        xref = int(value.split()[0])
+        if doc.xref_is_stream(xref):
+            return [xref]
+        return _referenced_xrefs(doc, 'array', doc.xref_object(xref, compressed=True))
+    if kind == 'array':
+        return [int(num) for num in re.findall(r'(\d+) \d+ R', value)]
+    return []
+
+
+def page_digest(doc, page_num):
+    """
+    Digest of one page's content streams and annotations
+    
+    Works on the xref table only, so the page is not loaded.
+    """
+    digest = hashlib.sha256()
+    xref = doc.page_xref(page_num)
+    digest.update(doc.xref_object(xref, compressed=True).encode('utf-8'))
+    
+    kind, value = doc.xref_get_key(xref, "Contents")
+    for content_xref in _referenced_xrefs(doc, kind, value):
+        digest.update(doc.xref_stream_raw(content_xref) or b'')
+    
+    kind, value = doc.xref_get_key(xref, "Annots")
+    digest.update(value.encode('utf-8'))
+    for annot_xref in _referenced_xrefs(doc, kind, value):
+        digest.update(doc.xref_object(annot_xref, compressed=True).encode('utf-8'))
+    
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """SQLite-backed cache of extraction results"""
+    
+    def __init__(self, cache_dir=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+        
+        self.db = sqlite3.connect(os.path.join(self.cache_dir, "results.sqlite3"), timeout=30)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                digest TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS results (
+                key TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                records BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS results_digest ON results (digest);
+            CREATE INDEX IF NOT EXISTS results_last_access ON results (last_access);
+            CREATE TABLE IF NOT EXISTS pages (
+                path TEXT NOT NULL,
+                key TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                payload BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL,
+                PRIMARY KEY (path, key, page)
+            );
+        """)
+    
+    def close(self):
+        """Close the database"""
+        self.db.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def digest(self, path):
+        """Content hash of a file, recomputed only if its mtime or size changed"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        
+        row = self.db.execute(
+            "SELECT mtime_ns, size, digest FROM files WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == stat.st_mtime_ns and row[1] == stat.st_size:
+            return row[2]
+        
+        digest = file_digest(path)
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO files (path, mtime_ns, size, digest) VALUES (?, ?, ?, ?)",
+                (path, stat.st_mtime_ns, stat.st_size, digest))
+        return digest
+    
+    def page_key(self, method, options=None):
+        """Key of the per-page results of one extractor and options"""
+        return self.key(None, method, options)
+    
+    def key(self, digest, method, options=None):
+        """Cache key for a file digest, extractor and options"""
+        payload = json.dumps({
+            'digest': digest,
+            'version': EXTRACTOR_VERSION,
+            'method': method,
+            'options': options or {},
+        }, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+    
+    def get(self, path, method, options=None):
+        """
+        Cached records for a PDF
+        
+        Returns:
+            list: The stored records, or None if the file is not cached
+        """
+        return self.lookup(self.digest(path), method, options)
+    
+    def put(self, path, method, records, options=None):
+        """Store the records extracted from a PDF"""
+        self.store(self.digest(path), method, records, options)
+    
+    def lookup(self, digest, method, options=None):
+        """Like get, for a file known only by its content hash (e.g. an upload)"""
+        key = self.key(digest, method, options)
+        row = self.db.execute("SELECT records FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        
+        with self.db:
+            self.db.execute("UPDATE results SET last_access = ? WHERE key = ?", (time.time(), key))
+        return pickle.loads(row[0])
+    
+    def store(self, digest, method, records, options=None):
+        """Like put, for a file known only by its content hash"""
+        key = self.key(digest, method, options)
+        blob = pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL)
+        
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results (key, digest, records, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, digest, blob, len(blob), time.time()))
+        self.evict()
+    
+    def extract_pages(self, doc, pdf_path, method, extract_page, options=None):
+        """
+        Run extract_page on every page, reusing stored results of unchanged pages
+        
+        Args:
+            doc: Open fitz document of pdf_path
+            pdf_path (str): PDF file path
+            method (str): Extractor name
+            extract_page (callable): Takes a zero-based page number and returns
+                that page's results (any picklable value)
+            options (dict): Extraction options (optional)
+        
+        Returns:
+            tuple: (list of per-page results in page order, number of reused pages)
+        """
+        results = []
+        reused = 0
+        for payload, from_cache in self.iter_pages(doc, pdf_path, method, extract_page, options):
+            results.append(payload)
+            reused += from_cache
+        return results, reused
+    
+    def iter_pages(self, doc, pdf_path, method, extract_page, options=None):
+        """
+        Like extract_pages, but yield each page's results as soon as they are ready
+        
+        Only the pages that changed are written, in batches of PAGE_WRITE_BATCH
+        as they are extracted, so a consumer that stops early keeps what was
+        done so far. Pages past the end of the document are dropped once the
+        last page has been yielded.
+        
+        Yields:
+            tuple: (page results, True if they were loaded from the cache)
+        """
+        path = os.path.abspath(pdf_path)
+        key = self.page_key(method, options)
+        stored = dict(self.db.execute(
+            "SELECT page, digest FROM pages WHERE path = ? AND key = ?", (path, key)))
+        
+        rows = []
+        now = time.time()
+        
+        for page_num in range(len(doc)):
+            digest = page_digest(doc, page_num)
+            
+            row = None
+            if stored.get(page_num) == digest:
+                row = self.db.execute(
+                    "SELECT payload FROM pages WHERE path = ? AND key = ? AND page = ?",
+                    (path, key, page_num)).fetchone()
+            
+            if row is not None:
+                payload = pickle.loads(row[0])
+                from_cache = True
+            else:
+                payload = extract_page(page_num)
+                blob = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+                rows.append((path, key, page_num, digest, blob, len(blob), now))
+                if len(rows) >= PAGE_WRITE_BATCH:
+                    self._write_pages(rows)
+                    rows = []
+                from_cache = False
+            
+            yield payload, from_cache
+        
+        self._write_pages(rows)
+        with self.db:
+            self.db.execute("DELETE FROM pages WHERE path = ? AND key = ? AND page >= ?",
+                            (path, key, len(doc)))
+            self.db.execute("UPDATE pages SET last_access = ? WHERE path = ? AND key = ?",
+                            (now, path, key))
+        self.evict()
+    
+    def _write_pages(self, rows):
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO pages (path, key, page, digest, payload, size, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    
+    def evict(self):
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        total = self.db.execute(
+            "SELECT (SELECT COALESCE(SUM(size), 0) FROM results) + "
+            "(SELECT COALESCE(SUM(size), 0) FROM pages)").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        
+        # Per-page results of one file are evicted together
+        entries = self.db.execute("""
+            SELECT 'results', key, NULL, size, last_access FROM results
+            UNION ALL
+            SELECT 'pages', key, path, SUM(size), MAX(last_access) FROM pages GROUP BY path, key
+            ORDER BY 5
+        """).fetchall()
+        
+        with self.db:
+            for table, key, path, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                if table == 'results':
+                    self.db.execute("DELETE FROM results WHERE key = ?", (key,))
+                else:
+                    self.db.execute("DELETE FROM pages WHERE path = ? AND key = ?", (path, key))
+                total -= size
+    
+    def invalidate(self, path=None):
+        """Forget the cached results of one PDF, or of every PDF if no path is given"""
+        with self.db:
+            if path is None:
+                self.db.execute("DELETE FROM results")
+                self.db.execute("DELETE FROM files")
+                self.db.execute("DELETE FROM pages")
+                return
+            
+            path = os.path.abspath(path)
+            row = self.db.execute("SELECT digest FROM files WHERE path = ?", (path,)).fetchone()
+            if row:
+                self.db.execute("DELETE FROM results WHERE digest = ?", (row[0],))
+            self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+            self.db.execute("DELETE FROM pages WHERE path = ?", (path,))
+    
+    def stats(self):
+        """Number of cached results and their total size in bytes (including per-page results)"""
+        return self.db.execute(
+            "SELECT (SELECT COUNT(*) FROM results), "
+            "(SELECT COALESCE(SUM(size), 0) FROM results) + "
+            "(SELECT COALESCE(SUM(size), 0) FROM pages)").fetchone()
+
+
+def main():
+    """Main function"""
+    if len(sys.argv) < 2 or sys.argv[1] not in ('--stats', '--clear'):
+        print("Usage:")
+        print(f"python {sys.argv[0]} --stats")
+        print(f"python {sys.argv[0]} --clear [PDF_file_path ...]")
+        return
+    
+    with ResultCache() as cache:
+        if sys.argv[1] == '--clear':
+            paths = sys.argv[2:] or [None]
+            for path in paths:
+                cache.invalidate(path)
+            print("Cache cleared." if paths == [None] else f"Cleared {len(paths)} file(s) from cache.")
+        
+        count, size = cache.stats()
+        print(f"Cache directory: {cache.cache_dir}")
+        print(f"Cached results: {count} ({size / 1024:.1f} KB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -18,10 +18,10 @@ if errorlevel 1 (
 
 REM Check required libraries
 echo Checking required libraries...
-python -c "import fitz, docx" > nul 2>&1
+python -c "import fitz" > nul 2>&1
 if errorlevel 1 (
     echo Installing required libraries...
-    pip install PyMuPDF python-docx
+    pip install PyMuPDF
     if errorlevel 1 (
         echo Error installing libraries
         pause
@@ -34,8 +34,9 @@ echo Choose execution method:
 echo 1. Graphical Interface (Easy to use)
 echo 2. Enhanced Version (Advanced extraction)
 echo 3. Simple Version (Command line)
+echo 4. Batch Mode (All PDFs in a folder)
 echo.
-set /p choice="Enter your choice (1-3): "
+set /p choice="Enter your choice (1-4): "
 
 if "!choice!"=="1" (
     echo Running graphical interface...
@@ -62,6 +63,17 @@ if "!choice!"=="1" (
     ) else (
         echo File not found: !pdf_file!
     )
+) else if "!choice!"=="4" (
+    echo.
+    set /p pdf_dir="Enter folder path (or drag it here): "
+    REM Remove quotes from folder path
+    set pdf_dir=!pdf_dir:"=!
+    if exist "!pdf_dir!" (
+        echo Running batch mode...
+        python batch_extractor.py "!pdf_dir!" --output-dir highlights
+    ) else (
+        echo Folder not found: !pdf_dir!
+    )
 ) else (
     echo Invalid choice!
     goto :eof
@@ -4,151 +4,251 @@
 Simple PDF Highlight Extractor
 """
 
-import fitz  # PyMuPDF
+import logging
 import sys
 import os
-from datetime import datetime
 
+import profiling
+from annotation_scan import annotated_pages, has_annotations
+from drawing_filter import reject_reason
+from lazy_modules import lazy_import
+from logs import PROGRESS, configure, get_logger, mode_from_args
+from page_text import PageText, quad_rects
+from result_cache import ResultCache
+from writers import STDOUT, open_writer
 
-def extract_yellow_highlights(pdf_path, output_path=None):
+fitz = lazy_import('fitz')  # PyMuPDF
+
+log = get_logger('simple')
+
+# Annotation types that may mark highlighted text
+HIGHLIGHT_TYPES = ['Highlight', 'Squiggly', 'Underline', 'StrikeOut', 'Square', 'FreeText']
+
+
+def extract_yellow_highlights(pdf_path, output_path=None, cache=None, output_format=None):
     """
     Extract yellow highlighted text from PDF file
     
     Args:
         pdf_path (str): PDF file path
         output_path (str): Output file path (optional)
+        cache (ResultCache): Result cache to read from and update (optional)
+        output_format (str): 'txt', 'jsonl', 'csv' or 'docx' (optional, default
+            from the output file extension)
     
     Returns:
         list: List of extracted texts
     """
     
     if not os.path.exists(pdf_path):
-        print(f"Error: File not found: {pdf_path}")
+        log.error("Error: File not found: %s", pdf_path)
         return []
     
     try:
-        # Open PDF file
-        doc = fitz.open(pdf_path)
-        extracted_highlights = []
-        
-        print(f"Processing file: {os.path.basename(pdf_path)}")
-        print(f"Number of pages: {len(doc)}")
+        with profiling.stage('cache'):
+            extracted_highlights = cache.get(pdf_path, 'simple') if cache else None
+        # The cache has the file's digest already, the writers need not hash it again
+        digest = cache.digest(pdf_path) if cache and output_path else None
+        writer = None
         
-        # Search through all pages
-        for page_num in range(len(doc)):
-            page = doc[page_num]
-            print(f"Processing page {page_num + 1}...")
-            
-            # Search for annotations
-            annotations = page.annots()
-            page_highlights = 0
+        if extracted_highlights is not None:
+            log.log(PROGRESS, "Loaded results for %s from cache", os.path.basename(pdf_path))
+        else:
+            # Open PDF file
+            with profiling.stage('open'):
+                doc = fitz.open(pdf_path)
+            extracted_highlights = []
             
-            for annot in annotations:
-                annot_type = annot.type[1] if len(annot.type) > 1 else annot.type[0]
-                print(f"  Annotation type: {annot_type}")
-                
-                # Check for different highlight types
-                if annot_type in ['Highlight', 'Squiggly', 'Underline', 'StrikeOut', 'Square', 'FreeText']:
-                    # Get highlighted text
-                    highlighted_text = get_highlighted_text(page, annot)
-                    
-                    if highlighted_text and highlighted_text.strip():
-                        # Get highlight color
-                        color = get_annot_color(annot)
-                        print(f"    Highlight color: {color}")
-                        
-                        # Check color (accepting most colors now)
-                        if is_yellow_highlight(color):
-                            highlight_info = {
-                                'page': page_num + 1,
-                                'text': highlighted_text.strip(),
-                                'color': color,
-                                'type': annot_type
-                            }
-                            extracted_highlights.append(highlight_info)
-                            page_highlights += 1
-                            print(f"    ✓ Extracted text: {highlighted_text[:50]}...")
-                        else:
-                            print(f"    ✗ Color mismatch")
-                    else:
-                        print(f"    ✗ No text found")
-                else:
-                    print(f"    ✗ Unsupported annotation type")
+            log.log(PROGRESS, "Processing file: %s", os.path.basename(pdf_path))
+            log.log(PROGRESS, "Number of pages: %d", len(doc))
             
-            print(f"  Found {page_highlights} highlighted text(s) on page {page_num + 1}")
+            # Results are written out page by page as they are found
+            writer = open_output(output_path, pdf_path, output_format, digest) if output_path else None
             
-            # Additional: Search for highlights using other methods
-            # Search for hidden or embedded highlights
+            # Search through all pages
             try:
-                # Alternative method: Search page content for special formatting
-                page_dict = page.get_text("dict")
-                for block in page_dict.get("blocks", []):
-                    if "lines" in block:
-                        for line in block["lines"]:
-                            for span in line["spans"]:
-                                # Check formatting properties
-                                if span.get("flags", 0) & 2**4:  # Bold
-                                    # Might be highlighted text
-                                    pass
-            except:
-                pass
+                for page_results in iter_page_highlights(doc, pdf_path, cache):
+                    extracted_highlights.extend(page_results)
+                    if writer:
+                        with profiling.stage('write'):
+                            for highlight in page_results:
+                                writer.write(highlight)
+            except BaseException:
+                if writer:
+                    writer.discard()
+                raise
+            finally:
+                doc.close()
             
-            # Search using alternative methods
-            alternative_highlights = find_highlights_alternative(page, page_num)
-            extracted_highlights.extend(alternative_highlights)
-        
-        doc.close()
+            if cache:
+                with profiling.stage('cache'):
+                    cache.put(pdf_path, 'simple', extracted_highlights)
         
         # Print results
-        print(f"\nFinished! Found {len(extracted_highlights)} highlighted text(s)")
+        log.log(PROGRESS, "\nFinished! Found %d highlighted text(s)", len(extracted_highlights))
         
         # Save results if output path specified
-        if output_path and extracted_highlights:
-            save_to_file(extracted_highlights, pdf_path, output_path)
+        if writer and extracted_highlights:
+            close_output(writer, output_path)
+        elif writer:
+            writer.discard()
+        elif output_path and extracted_highlights:
+            save_to_file(extracted_highlights, pdf_path, output_path, output_format, digest)
         
-        # Print extracted texts
-        if extracted_highlights:
-            print("\n" + "=" * 60)
-            print("Extracted Texts:")
-            print("=" * 60)
+        # Print extracted texts (skipped entirely unless they will be shown)
+        if extracted_highlights and log.isEnabledFor(logging.INFO):
+            log.info("\n" + "=" * 60)
+            log.info("Extracted Texts:")
+            log.info("=" * 60)
             
             for i, highlight in enumerate(extracted_highlights, 1):
-                print(f"\n[{i}] Page {highlight['page']}:")
-                print("-" * 40)
-                print(highlight['text'])
-                print("-" * 40)
-        else:
-            print("No highlighted text found in this file.")
+                log.info("\n[%d] Page %s:", i, highlight['page'])
+                log.info("-" * 40)
+                log.info("%s", highlight['text'])
+                log.info("-" * 40)
+        elif not extracted_highlights:
+            log.info("No highlighted text found in this file.")
         
         return extracted_highlights
-        
+    
     except Exception as e:
-        print(f"Error processing file: {str(e)}")
+        log.error("Error processing file: %s", e)
         return []
 
 
-def get_highlighted_text(page, annot):
+def iter_page_highlights(doc, pdf_path=None, cache=None):
+    """
+    Yield the highlights of each page of an open document as soon as it is done
+    
+    Args:
+        doc: Open fitz document
+        pdf_path (str): PDF file path (only needed with a cache)
+        cache (ResultCache): Reuse results of pages unchanged since the last run (optional)
+    
+    Yields:
+        list: Extracted texts of one page, in page order
+    """
+    # Pre-scan the xref table for pages with highlight annotations
+    with profiling.stage('annotation scan'):
+        annotated = set(annotated_pages(doc, HIGHLIGHT_TYPES))
+    if not annotated:
+        log.info("No highlight annotations in this file, searching drawings only")
+    
+    def extract_page(page_num):
+        with profiling.page(page_num):
+            with profiling.stage('load page'):
+                page = doc[page_num]
+            return extract_page_highlights(page, page_num, page_num in annotated)
+    
+    if not cache:
+        for page_num in range(len(doc)):
+            yield extract_page(page_num)
+        return
+    
+    # Only pages changed since the last run are extracted again
+    reused = 0
+    for page_results, from_cache in cache.iter_pages(doc, pdf_path, 'simple', extract_page):
+        reused += from_cache
+        yield page_results
+    if reused:
+        log.log(PROGRESS, "Reused results of %d unchanged page(s)", reused)
+
+
+def extract_page_highlights(page, page_num, has_annots=None):
+    """
+    Extract yellow highlighted text from a single page
+    
+    Args:
+        page: fitz page
+        page_num (int): Zero-based page number
+        has_annots (bool): Whether the page carries highlight annotations
+            (optional, looked up in the xref table if not given)
+    
+    Returns:
+        list: List of extracted texts on this page
+    """
+    page_results = []
+    page_text = PageText(page)
+    log.log(PROGRESS, "Processing page %d...", page_num + 1)
+    
+    if has_annots is None:
+        has_annots = has_annotations(page.parent, page_num, HIGHLIGHT_TYPES)
+    
+    # Search for annotations
+    with profiling.stage('annots'):
+        annotations = list(page.annots()) if has_annots else []
+    page_highlights = 0
+    
+    with profiling.detector('Annotations'):
+        # Find the words under all annotations of the page in one batch
+        page_text.prepare_annotations(annotations)
+        
+        for annot in annotations:
+            annot_type = annot.type[1] if len(annot.type) > 1 else annot.type[0]
+            log.debug("  Annotation type: %s", annot_type)
+            
+            # Check for different highlight types
+            if annot_type in HIGHLIGHT_TYPES:
+                # Get highlighted text
+                highlighted_text = get_highlighted_text(page, annot, page_text)
+                
+                if highlighted_text and highlighted_text.strip():
+                    # Get highlight color
+                    color = get_annot_color(annot)
+                    log.debug("    Highlight color: %s", color)
+                    
+                    # Check color (accepting most colors now)
+                    if is_yellow_highlight(color):
+                        highlight_info = {
+                            'page': page_num + 1,
+                            'text': highlighted_text.strip(),
+                            'color': color,
+                            'type': annot_type,
+                            'rect': list(annot.rect),
+                            'quads': [list(quad) for quad in quad_rects(annot)]
+                        }
+                        page_results.append(highlight_info)
+                        page_highlights += 1
+                        log.debug("    ✓ Extracted text: %.50s...", highlighted_text)
+                    else:
+                        log.debug("    ✗ Color mismatch")
+                else:
+                    log.debug("    ✗ No text found")
+            else:
+                log.debug("    ✗ Unsupported annotation type")
+    
+    log.debug("  Found %d highlighted text(s) on page %d", page_highlights, page_num + 1)
+    
+    # Search using alternative methods
+    with profiling.detector('Drawings'):
+        alternative_highlights = find_highlights_alternative(page, page_num, page_text)
+    page_results.extend(alternative_highlights)
+    
+    return page_results
+
+
+def get_highlighted_text(page, annot, page_text=None):
     """Extract highlighted text from annotation"""
     try:
+        if page_text is None:
+            page_text = PageText(page)
+        
+        # Method 0: Words inside the highlight's quad points (exact lines only)
+        highlighted_text = page_text.quad_text(annot)
+        if highlighted_text:
+            return highlighted_text
+        
         # Get highlight rectangle
         rect = annot.rect
         
         # Method 1: Extract text from highlighted area
-        text_instances = page.get_text("dict")
-        highlighted_text = ""
-        
-        for block in text_instances["blocks"]:
-            if "lines" in block:
-                for line in block["lines"]:
-                    for span in line["spans"]:
-                        span_rect = fitz.Rect(span["bbox"])
-                        # Check if text intersects with highlight area
-                        if span_rect.intersects(rect):
-                            highlighted_text += span["text"] + " "
+        # Check if text intersects with highlight area
+        for span in page_text.spans_intersecting(rect):
+            highlighted_text += span["text"] + " "
         
         # Method 2: If no text found with previous method
         if not highlighted_text.strip():
-            highlighted_text = page.get_textbox(rect)
+            highlighted_text = page_text.textbox(rect)
         
         # Method 3: Extract text with higher precision
         if not highlighted_text.strip():
@@ -157,20 +257,17 @@ def get_highlighted_text(page, annot):
                 rect.x0 - 2, rect.y0 - 2, 
                 rect.x1 + 2, rect.y1 + 2
             )
-            highlighted_text = page.get_textbox(expanded_rect)
+            highlighted_text = page_text.textbox(expanded_rect)
         
         # Method 4: Extract text using alternative method
         if not highlighted_text.strip():
-            words = page.get_text("words")
-            for word in words:
-                word_rect = fitz.Rect(word[:4])
-                if word_rect.intersects(rect):
-                    highlighted_text += word[4] + " "
+            for word in page_text.words_intersecting(rect):
+                highlighted_text += word[4] + " "
         
         return highlighted_text.strip()
-        
+    
     except Exception as e:
-        print(f"Error extracting text: {e}")
+        log.warning("Error extracting text: %s", e)
         return ""
 
 
@@ -221,39 +318,51 @@ def is_yellow_highlight(color):
     return True
 
 
-def save_to_file(highlights, pdf_path, output_path):
-    """Save extracted texts to file"""
+def save_to_file(highlights, pdf_path, output_path, output_format=None, digest=None):
+    """Save extracted texts to file (digest: SHA-256 of the PDF if already known)"""
     try:
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write("Highlighted Text from PDF\n")
-            f.write("=" * 60 + "\n")
-            f.write(f"Source file: {os.path.basename(pdf_path)}\n")
-            f.write(f"Extraction date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-            f.write(f"Number of extracted texts: {len(highlights)}\n")
-            f.write("=" * 60 + "\n\n")
-            
-            for i, highlight in enumerate(highlights, 1):
-                f.write(f"[{i}] Page {highlight['page']}:\n")
-                f.write("-" * 40 + "\n")
-                f.write(f"{highlight['text']}\n")
-                f.write("-" * 40 + "\n\n")
-        
-        print(f"\nResults saved to: {output_path}")
+        with open_writer(output_path, pdf_path, output_format=output_format, digest=digest) as writer:
+            for highlight in highlights:
+                writer.write(highlight)
         
+        log.log(PROGRESS, "\nResults saved to: %s", output_path)
+    
     except Exception as e:
-        print(f"Error saving file: {str(e)}")
+        log.error("Error saving file: %s", e)
 
 
-def find_highlights_alternative(page, page_num):
+def open_output(output_path, pdf_path, output_format=None, digest=None):
+    """Writer that saves results while they are extracted, or None if it cannot be opened"""
+    try:
+        return open_writer(output_path, pdf_path, output_format=output_format, digest=digest)
+    except Exception as e:
+        log.error("Error saving file: %s", e)
+        return None
+
+
+def close_output(writer, output_path):
+    """Finish a writer from open_output"""
+    try:
+        with profiling.stage('write'):
+            writer.close()
+        log.log(PROGRESS, "\nResults saved to: %s", output_path)
+    except Exception as e:
+        log.error("Error saving file: %s", e)
+
+
+def find_highlights_alternative(page, page_num, page_text=None):
     """Search for highlights using alternative methods"""
     highlights = []
     
     try:
-        # Method 1: Search in content streams
-        text_instances = page.get_text("dict")
+        if page_text is None:
+            page_text = PageText(page)
         
         # Method 2: Search for colored rectangles
-        drawings = page.get_drawings()
+        candidates = []
+        rejected = 0
+        with profiling.stage('get_drawings'):
+            drawings = page.get_drawings()
         for drawing in drawings:
             if 'fill' in drawing and drawing['fill']:
                 # Check color
@@ -262,54 +371,91 @@ def find_highlights_alternative(page, page_num):
                     r, g, b = fill_color[0], fill_color[1], fill_color[2]
                     # If color is yellow or light
                     if (r > 0.7 and g > 0.7 and b < 0.5) or (r + g + b) / 3 > 0.6:
-                        # Extract text from this area
+                        # Backgrounds, table cells and grey boxes are not highlights
+                        if reject_reason(drawing, page.rect, page_text.line_height):
+                            rejected += 1
+                            continue
+                        
                         rect = drawing.get('rect')
                         if rect:
-                            text = page.get_textbox(rect)
-                            if text and text.strip():
-                                highlights.append({
-                                    'page': page_num + 1,
-                                    'text': text.strip(),
-                                    'color': fill_color,
-                                    'type': 'Drawing'
-                                })
+                            candidates.append((rect, fill_color))
+        
+        if rejected:
+            log.debug("  Skipped %d shape(s) that cannot be highlights", rejected)
         
-        # Method 3: Search for text with colored background
-        words = page.get_text("words")
-        for word in words:
-            # Check for colored background in word
-            word_rect = fitz.Rect(word[:4])
-            # Can be developed further based on PDF type
+        # Find the words under all candidate rectangles in one batch
+        page_text.prepare([rect for rect, _ in candidates])
         
+        for rect, fill_color in candidates:
+            # Extract text from this area
+            if page_text.has_text(rect):
+                text = page_text.textbox(rect)
+                if text and text.strip():
+                    highlights.append({
+                        'page': page_num + 1,
+                        'text': text.strip(),
+                        'color': fill_color,
+                        'type': 'Drawing',
+                        'rect': list(rect)
+                    })
+    
     except Exception as e:
-        print(f"Error in alternative search: {e}")
+        log.warning("Error in alternative search: %s", e)
     
     return highlights
 
 
 def main():
     """Main function"""
-    print("PDF Yellow Highlight Text Extractor")
-    print("=" * 50)
+    # Records go to standard output, so everything else goes to stderr
+    if sys.argv[2:3] == [STDOUT]:
+        sys.stdout = sys.stderr
+    configure(mode_from_args(sys.argv))
+    
+    log.info("PDF Yellow Highlight Text Extractor")
+    log.info("=" * 50)
     
     if len(sys.argv) < 2:
         print("Usage:")
-        print(f"python {sys.argv[0]} <PDF_file_path> [output_file_path]")
+        print(f"python {sys.argv[0]} <PDF_file_path> [output_file_path | -] [--format=jsonl|csv|txt|docx] [--cache]")
+        print("                 [--quiet | --progress | --verbose] [--profile[=profile.json]]")
+        print("\nOptions:")
+        print("  --cache    Reuse results from previous runs if the file is unchanged")
+        print("  --quiet    Only show errors")
+        print("  --progress Only show file and page progress")
+        print("  --verbose  Also show every annotation that is examined")
+        print("  --format=F Output format (default from the file extension; JSONL for -)")
+        print("  -          Write records to standard output (messages go to stderr)")
+        print("  --profile  Time every stage and page; print a summary and save it as JSON")
+        print("             (default <PDF name>_profile.json)")
         print("\nExample:")
         print(f"python {sys.argv[0]} document.pdf")
         print(f"python {sys.argv[0]} document.pdf output.txt")
         return
     
     pdf_path = sys.argv[1]
-    output_path = sys.argv[2] if len(sys.argv) > 2 else None
+    output_path = sys.argv[2] if len(sys.argv) > 2 and not sys.argv[2].startswith('--') else None
+    cache = ResultCache() if '--cache' in sys.argv else None
+    output_format = next((arg.split('=', 1)[1] for arg in sys.argv if arg.startswith('--format=')), None)
+    profile_path = profiling.path_from_args(sys.argv, pdf_path)
     
     # Run extraction
-    highlights = extract_yellow_highlights(pdf_path, output_path)
+    profiler = profiling.start(pdf_path) if profile_path else None
+    highlights = extract_yellow_highlights(pdf_path, output_path, cache, output_format)
+    
+    if profiler:
+        profiling.stop()
+        profiler.save(profile_path)
+        print("\n" + "\n".join(profiler.summary()))
+        print(f"\nProfile saved to: {profile_path}")
+    
+    if cache:
+        cache.close()
     
     if highlights:
-        print(f"\nCompleted successfully! Extracted {len(highlights)} highlighted text(s).")
+        log.log(PROGRESS, "\nCompleted successfully! Extracted %d highlighted text(s).", len(highlights))
     else:
-        print("\nNo highlighted text found or an error occurred.")
+        log.log(PROGRESS, "\nNo highlighted text found or an error occurred.")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Incremental writers for extracted highlights
+
+Each writer takes records one at a time, as the extractors produce them,
+so a long document does not have to be held in memory before it can be
+saved. The output format is chosen from the file extension, or given
+explicitly; "-" writes to standard output.
+
+The JSONL and CSV writers share a stable, machine-readable schema (see
+SCHEMA_FIELDS) so the output can be ingested without re-parsing text.
+"""
+
+import csv
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import zipfile
+from datetime import datetime, timezone
+from html import escape
+
+from result_cache import file_digest
+
+
+# Output path meaning standard output
+STDOUT = '-'
+
+# Fields of every JSONL / CSV record, in column order:
+#   source  PDF file name          digest  SHA-256 of the PDF file
+#   page    1-based page number    method  Annotation, Drawing, ColoredText, Comprehensive or Raster
+#   type    annotation subtype (Highlight, Underline, ...) or empty
+#   color   "#rrggbb" or empty     rect    [x0, y0, x1, y1] in PDF points or empty
+#   quads   [[x0, y0, x1, y1], ...] one per highlighted line piece, or empty
+#   text    the extracted text
+SCHEMA_FIELDS = ('source', 'digest', 'page', 'method', 'type', 'color', 'rect', 'quads', 'text')
+
+
+def hex_color(color):
+    """Colour of a record as "#rrggbb" (RGB floats, grey level or sRGB integer), or None"""
+    if color is None or isinstance(color, bool):
+        return None
+    if isinstance(color, int):
+        return f"#{color & 0xFFFFFF:06x}"
+    if isinstance(color, float):
+        color = (color, color, color)
+    if isinstance(color, (list, tuple)) and len(color) >= 3:
+        return "#" + "".join(f"{round(min(max(c, 0.0), 1.0) * 255):02x}" for c in color[:3])
+    if isinstance(color, (list, tuple)) and len(color) == 1:
+        return hex_color(float(color[0]))
+    return None
+
+
+def _box(values):
+    """Rectangle rounded to 1/100 pt, or None"""
+    if not values or len(values) < 4:
+        return None
+    return [round(float(v), 2) for v in values[:4]]
+
+
+def schema_record(record, source=None, digest=None):
+    """
+    Record of either extractor in the stable SCHEMA_FIELDS layout
+    
+    Args:
+        record (dict): Record from the simple or the enhanced extractor
+        source (str): PDF file name
+        digest (str): SHA-256 of the PDF file
+    
+    Returns:
+        dict: Keys of SCHEMA_FIELDS, in that order
+    """
+    if 'method' in record:
+        # Enhanced extractor: 'Annotation-Highlight', 'Drawing', ...
+        method, _, annot_type = record['method'].partition('-')
+    elif record.get('type') == 'Drawing':
+        method, annot_type = 'Drawing', ''
+    else:
+        method, annot_type = 'Annotation', record.get('type', '')
+    
+    quads = [_box(quad) for quad in record.get('quads') or ()]
+    return {
+        'source': source,
+        'digest': digest,
+        'page': record['page'],
+        'method': method,
+        'type': annot_type or None,
+        'color': hex_color(record.get('color')),
+        'rect': _box(record.get('rect')),
+        'quads': [quad for quad in quads if quad] or None,
+        'text': record['text'],
+    }
+
+
+def _open_output(output_path, newline=None):
+    """(file, owned) for output_path; "-" is standard output, which is never closed"""
+    if output_path == STDOUT:
+        return sys.__stdout__, False
+    return open(output_path, 'w', encoding='utf-8', newline=newline), True
+
+
+class Writer:
+    """Base of the writers: context manager that saves on success and discards on error"""
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class TextWriter(Writer):
+    """Text layout of save_to_file (simple) or save_results (enhanced)"""
+    
+    def __init__(self, output_path, pdf_path, enhanced=False, digest=None):
+        self.output_path = output_path
+        self.pdf_path = pdf_path
+        self.enhanced = enhanced
+        self.count = 0
+        
+        # The header holds the total, so entries are spooled until close()
+        self._body = tempfile.TemporaryFile('w+', encoding='utf-8')
+    
+    def write(self, record):
+        """Append one record"""
+        self.count += 1
+        f = self._body
+        if self.enhanced:
+            f.write(f"[{self.count}] Page {record['page']} - Method: {record['method']}\n")
+            f.write("-" * 50 + "\n")
+            f.write(f"{record['text']}\n")
+            if 'color' in record and record['color']:
+                f.write(f"Color: {record['color']}\n")
+            f.write("-" * 50 + "\n\n")
+        else:
+            f.write(f"[{self.count}] Page {record['page']}:\n")
+            f.write("-" * 40 + "\n")
+            f.write(f"{record['text']}\n")
+            f.write("-" * 40 + "\n\n")
+    
+    def close(self):
+        """Write the header and the spooled entries to output_path"""
+        if self._body is None:
+            return
+        
+        title = "Highlighted Text from PDF - Enhanced Version" if self.enhanced else "Highlighted Text from PDF"
+        f, owned = _open_output(self.output_path)
+        try:
+            f.write(f"{title}\n")
+            f.write("=" * 60 + "\n")
+            f.write(f"Source file: {os.path.basename(self.pdf_path)}\n")
+            f.write(f"Extraction date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+            f.write(f"Number of extracted texts: {self.count}\n")
+            f.write("=" * 60 + "\n\n")
+            
+            self._body.seek(0)
+            shutil.copyfileobj(self._body, f)
+        finally:
+            if owned:
+                f.close()
+            else:
+                f.flush()
+        
+        self.discard()
+    
+    def discard(self):
+        """Drop the spooled entries without writing output_path"""
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+
+class RecordWriter(Writer):
+    """Base of the schema writers: one SCHEMA_FIELDS record per highlight, streamed out"""
+    
+    newline = None
+    
+    def __init__(self, output_path, pdf_path=None, enhanced=False, digest=None):
+        self.output_path = output_path
+        self.pdf_path = pdf_path
+        self.count = 0
+        self.source = os.path.basename(pdf_path) if pdf_path else None
+        self._digest = digest
+        self._file, self._owned = _open_output(output_path, self.newline)
+    
+    @property
+    def digest(self):
+        """SHA-256 of the PDF: the one given (e.g. from ResultCache.digest), else hashed on first use"""
+        if self._digest is None and self.pdf_path and os.path.isfile(self.pdf_path):
+            self._digest = file_digest(self.pdf_path)
+        return self._digest
+    
+    def write(self, record):
+        """Append one record"""
+        self.count += 1
+        self.write_row(schema_record(record, self.source, self.digest))
+        
+        # Pipeline consumers read standard output as records arrive
+        if not self._owned:
+            self._file.flush()
+    
+    def write_row(self, row):
+        """Write one schema record"""
+        raise NotImplementedError
+    
+    def close(self):
+        """Close the output file"""
+        if self._file is None:
+            return
+        if self._owned:
+            self._file.close()
+        else:
+            self._file.flush()
+        self._file = None
+    
+    def discard(self):
+        """Close and remove the output file"""
+        self.close()
+        if self._owned and os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+
+class JsonlWriter(RecordWriter):
+    """One JSON object per line"""
+    
+    def write_row(self, row):
+        self._file.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+class CsvWriter(RecordWriter):
+    """CSV with a header row; rect and quads are JSON arrays, missing values are empty"""
+    
+    newline = ''
+    
+    def __init__(self, output_path, pdf_path=None, enhanced=False, digest=None):
+        super().__init__(output_path, pdf_path, enhanced, digest)
+        self._csv = csv.writer(self._file)
+        self._csv.writerow(SCHEMA_FIELDS)
+    
+    def write_row(self, row):
+        self._csv.writerow([
+            '' if row[field] is None else
+            json.dumps(row[field]) if isinstance(row[field], list) else row[field]
+            for field in SCHEMA_FIELDS
+        ])
+
+
+# Parts of the .docx package written by DocxWriter. The styles are those of
+# the python-docx default template that the layout uses (Title and Quote).
+_W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+_DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '<Override PartName="/docProps/core.xml" '
+    'ContentType="application/vnd.openxmlformats-package.core-properties+xml"/>'
+    '</Types>'
+)
+
+_DOCX_PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="word/document.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '<Relationship Id="rId2" Target="docProps/core.xml" '
+    'Type="http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties"/>'
+    '</Relationships>'
+)
+
+_DOCX_DOCUMENT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="styles.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+    '</Relationships>'
+)
+
+_DOCX_CORE = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<cp:coreProperties '
+    'xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+    'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" '
+    'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+    '<dc:title>Highlighted Text from PDF</dc:title>'
+    '<dcterms:created xsi:type="dcterms:W3CDTF">{created}</dcterms:created>'
+    '</cp:coreProperties>'
+)
+
+_DOCX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<w:styles {_W}>'
+    '<w:docDefaults>'
+    '<w:rPrDefault><w:rPr><w:rFonts w:ascii="Calibri" w:hAnsi="Calibri" w:cs="Calibri"/><w:sz w:val="22"/><w:szCs w:val="22"/>'
+    '<w:lang w:val="en-US"/></w:rPr></w:rPrDefault>'
+    '<w:pPrDefault><w:pPr><w:spacing w:after="200" w:line="276" w:lineRule="auto"/></w:pPr></w:pPrDefault>'
+    '</w:docDefaults>'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/><w:qFormat/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/><w:basedOn w:val="Normal"/>'
+    '<w:next w:val="Normal"/><w:qFormat/>'
+    '<w:pPr><w:pBdr><w:bottom w:val="single" w:sz="8" w:space="4" w:color="4F81BD"/></w:pBdr>'
+    '<w:spacing w:after="300" w:line="240" w:lineRule="auto"/><w:contextualSpacing/></w:pPr>'
+    '<w:rPr><w:rFonts w:ascii="Cambria" w:hAnsi="Cambria"/><w:color w:val="17365D"/>'
+    '<w:spacing w:val="5"/><w:kern w:val="28"/><w:sz w:val="52"/><w:szCs w:val="52"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Quote"><w:name w:val="Quote"/><w:basedOn w:val="Normal"/>'
+    '<w:next w:val="Normal"/><w:qFormat/>'
+    '<w:rPr><w:i/><w:iCs/><w:color w:val="000000"/></w:rPr></w:style>'
+    '</w:styles>'
+)
+
+# Title and file information; {count} is only known when the body is complete
+_DOCX_HEADER = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<w:document {_W}><w:body>'
+    '<w:p><w:pPr><w:pStyle w:val="Title"/><w:jc w:val="center"/></w:pPr>'
+    '<w:r><w:t>Highlighted Text from PDF</w:t></w:r></w:p>'
+    '<w:p><w:r><w:rPr><w:b/></w:rPr><w:t xml:space="preserve">{source}</w:t><w:br/></w:r>'
+    '<w:r><w:t xml:space="preserve">{date}</w:t><w:br/></w:r>'
+    '<w:r><w:t>Number of extracted texts: {count}</w:t></w:r></w:p>'
+    '<w:p/>'
+)
+
+# Paragraphs of one record: bold number and page, quoted text, separator line
+_DOCX_RECORD = (
+    '<w:p><w:r><w:rPr><w:b/></w:rPr><w:t xml:space="preserve">{header}</w:t></w:r></w:p>'
+    '<w:p><w:pPr><w:pStyle w:val="Quote"/></w:pPr><w:r><w:t xml:space="preserve">{text}</w:t></w:r></w:p>'
+    '<w:p><w:r><w:t>{separator}</w:t></w:r></w:p>'
+)
+
+_DOCX_FOOTER = (
+    '<w:sectPr><w:pgSz w:w="12240" w:h="15840"/>'
+    '<w:pgMar w:top="1440" w:right="1800" w:bottom="1440" w:left="1800" '
+    'w:header="720" w:footer="720" w:gutter="0"/></w:sectPr>'
+    '</w:body></w:document>'
+)
+
+# Characters that XML 1.0 does not allow (PDF text sometimes contains them)
+_XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def _xml_text(text):
+    """Text escaped for a <w:t> element, with line breaks and tabs as Word breaks and tabs"""
+    text = escape(_XML_INVALID.sub('', text), quote=False)
+    return (text.replace('\r\n', '\n').replace('\r', '\n')
+            .replace('\n', '</w:t><w:br/><w:t xml:space="preserve">')
+            .replace('\t', '</w:t><w:tab/><w:t xml:space="preserve">'))
+
+
+class DocxWriter(Writer):
+    """
+    Word layout of the GUI's "Save as Word File", streamed into the .docx zip
+    
+    Every record becomes three prebuilt WordprocessingML paragraphs (number
+    and page, the text in the Quote style, a separator) spooled to a
+    temporary file; close() writes the package and copies the spooled body
+    into word/document.xml. Memory use does not grow with the number of
+    records, and python-docx is not needed.
+    """
+    
+    def __init__(self, output_path, pdf_path, enhanced=False, digest=None):
+        if output_path == STDOUT:
+            raise ValueError("Word output cannot be written to standard output")
+        
+        self.output_path = output_path
+        self.pdf_path = pdf_path
+        self.count = 0
+        
+        # The header holds the total, so paragraphs are spooled until close()
+        self._body = tempfile.TemporaryFile('w+b')
+    
+    def write(self, record):
+        """Append one record"""
+        self.count += 1
+        self._body.write(_DOCX_RECORD.format(
+            header=_xml_text(f"[{self.count}] Page {record['page']}:"),
+            text=_xml_text(record['text']),
+            separator='_' * 50,
+        ).encode('utf-8'))
+    
+    def close(self):
+        """Write the package to output_path"""
+        if self._body is None:
+            return
+        
+        now = datetime.now()
+        header = _DOCX_HEADER.format(
+            source=_xml_text(f"Source file: {os.path.basename(self.pdf_path)}"),
+            date=_xml_text(f"Extraction date: {now.strftime('%Y-%m-%d %H:%M:%S')}"),
+            count=self.count,
+        )
+        try:
+            with zipfile.ZipFile(self.output_path, 'w', zipfile.ZIP_DEFLATED) as package:
+                package.writestr('[Content_Types].xml', _DOCX_CONTENT_TYPES)
+                package.writestr('_rels/.rels', _DOCX_PACKAGE_RELS)
+                package.writestr('docProps/core.xml', _DOCX_CORE.format(
+                    created=now.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')))
+                package.writestr('word/_rels/document.xml.rels', _DOCX_DOCUMENT_RELS)
+                package.writestr('word/styles.xml', _DOCX_STYLES)
+                
+                with package.open('word/document.xml', 'w') as document:
+                    document.write(header.encode('utf-8'))
+                    self._body.seek(0)
+                    shutil.copyfileobj(self._body, document)
+                    document.write(_DOCX_FOOTER.encode('utf-8'))
+        except BaseException:
+            if os.path.exists(self.output_path):
+                os.remove(self.output_path)
+            raise
+        finally:
+            self.discard()
+    
+    def discard(self):
+        """Drop the spooled paragraphs without writing output_path"""
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+
+# Writer classes by format name
+WRITERS = {
+    'txt': TextWriter,
+    'jsonl': JsonlWriter,
+    'csv': CsvWriter,
+    'docx': DocxWriter,
+}
+
+
+def format_for(output_path, output_format=None):
+    """
+    Format name for an output path
+    
+    An explicit format wins; otherwise it follows the file extension, with
+    text as the default for files and JSONL for standard output.
+    """
+    if output_format:
+        if output_format not in WRITERS:
+            raise ValueError(f"Unknown output format: {output_format} (use {', '.join(WRITERS)})")
+        return output_format
+    if output_path == STDOUT:
+        return 'jsonl'
+    extension = os.path.splitext(output_path)[1].lower().lstrip('.')
+    return extension if extension in WRITERS else 'txt'
+
+
+def open_writer(output_path, pdf_path, enhanced=False, output_format=None, digest=None):
+    """
+    Writer for output_path, chosen by output_format or the file extension
+    
+    digest is the SHA-256 of the PDF if the caller already has it; the
+    schema writers otherwise hash the file themselves.
+    """
+    writer_class = WRITERS[format_for(output_path, output_format)]
+    return writer_class(output_path, pdf_path, enhanced, digest)
+
+
+def write_highlights(records, pdf_path, output_path, enhanced=False, output_format=None, digest=None):
+    """
+    Write records to output_path while they are being produced
+    
+    Args:
+        records (iterable): Highlight records, e.g. from iter_highlights()
+        pdf_path (str): Source PDF file path
+        output_path (str): Output file path (.txt, .jsonl, .csv or .docx), or "-"
+            for standard output
+        enhanced (bool): Use the enhanced text layout
+        output_format (str): 'txt', 'jsonl', 'csv' or 'docx' (optional, default
+            from the extension)
+        digest (str): SHA-256 of the PDF, e.g. from ResultCache.digest (optional)
+    
+    Returns:
+        int: Number of records written
+    """
+    with open_writer(output_path, pdf_path, enhanced, output_format, digest) as writer:
+        for record in records:
+            writer.write(record)
+    return writer.count